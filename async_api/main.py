@@ -5,8 +5,8 @@ import asyncio
 import time
 import random
 from azure.monitor.opentelemetry import configure_azure_monitor
-from opentelemetry import trace
 from dotenv import load_dotenv
+from pizza_library import tracing
 
 load_dotenv()
 
@@ -19,7 +19,7 @@ from aiocache import cached  # noqa: E402
 
 
 logger = logging.getLogger(__name__)
-tracer = trace.get_tracer(__name__)
+tracer = tracing.get_tracer(__name__)
 
 session: aiohttp.ClientSession = None
 
@@ -47,14 +47,14 @@ urls_to_fetch = [
 ]
 
 # Asynchronous HTTP requests using the shared aiohttp session with multiple URLs
-@tracer.start_as_current_span(name="fetch_data")
+@tracer.traced("fetch_data")
 async def fetch_data(url):
     async with session.get(url) as response:
         response.raise_for_status()
         return await response.json()  # Change to JSON for better demonstration
 
 @app.get("/fetch-multiple", description="Fetch data from multiple external APIs concurrently.")
-@tracer.start_as_current_span(name="get_multiple_external_data")
+@tracer.traced("get_multiple_external_data", tracing.REQUEST)
 async def get_multiple_external_data():
     urls = urls_to_fetch
     tasks = [fetch_data(url) for url in urls]
@@ -62,7 +62,7 @@ async def get_multiple_external_data():
     return {"data": data}
 
 @app.get("/fetch-multiple-with-errors", description="Fetch data from multiple external APIs concurrently with error handling.")
-@tracer.start_as_current_span(name="get_multiple_external_data_with_errors")
+@tracer.traced("get_multiple_external_data_with_errors", tracing.REQUEST)
 async def get_multiple_external_data_with_errors():
     urls = urls_to_fetch + ["https://jsonplaceholder.typicode.com/posts/invalid"]
     tasks = [fetch_data(url) for url in urls]
@@ -81,25 +81,25 @@ async def get_multiple_external_data_with_errors():
     return {"data": successful_data, "failed_urls": failed_urls}
 
 # Concurrent execution with asyncio.gather (100 tasks)
-@tracer.start_as_current_span(name="sample_task")
+@tracer.traced("sample_task")
 async def sample_task(task_id):
     await asyncio.sleep(random.uniform(0.5, 2))  # Variable sleep time
     return f"Task {task_id} completed"
 
 # Background task with increased complexity
-@tracer.start_as_current_span(name="background_task")
+@tracer.traced("background_task")
 async def background_task():
     await asyncio.sleep(10)
     print("Background task completed after 10 seconds")
 
 @app.get("/background-task", description="Trigger a background task that runs for 10 seconds.")
-@tracer.start_as_current_span(name="trigger_background_task")
+@tracer.traced("trigger_background_task", tracing.REQUEST)
 async def trigger_background_task():
     asyncio.create_task(background_task())
     return {"message": "Background task started with extended duration"}
 
 # Visual concurrent tasks with increased number and duration
-@tracer.start_as_current_span(name="visual_task")
+@tracer.traced("visual_task")
 async def visual_task(task_id):
     duration = random.uniform(2, 5)  # Increased duration
     print(f"Task {task_id:02} |{'-' * task_id} Start")
@@ -107,14 +107,14 @@ async def visual_task(task_id):
     print(f"Task {task_id:02} |{'-' * task_id} Done ({duration:.2f}s)")
 
 @app.get("/concurrent-tasks", description="Execute 100 visual concurrent tasks with increased load.")
-@tracer.start_as_current_span(name="run_visual_concurrent_tasks")
+@tracer.traced("run_visual_concurrent_tasks", tracing.REQUEST)
 async def run_visual_concurrent_tasks():
     tasks = [visual_task(i) for i in range(100)]
     await asyncio.gather(*tasks)
     return {"message": "Visual concurrent tasks completed with increased load"}
 
 # Visual limited concurrency with fewer semaphore permits
-@tracer.start_as_current_span(name="visual_limited_task")
+@tracer.traced("visual_limited_task")
 async def visual_limited_task(task_id, semaphore):
     async with semaphore:
         duration = random.uniform(2, 5)
@@ -123,7 +123,7 @@ async def visual_limited_task(task_id, semaphore):
         print(f"Task {task_id:02} |{'=' * task_id} Done ({duration:.2f}s)")
 
 @app.get("/limited-concurrency", description="Run 100 tasks with limited concurrency using a semaphore.")
-@tracer.start_as_current_span(name="run_visual_limited_concurrency")
+@tracer.traced("run_visual_limited_concurrency", tracing.REQUEST)
 async def run_visual_limited_concurrency():
     semaphore = asyncio.Semaphore(10)  # Increased limit to 10
     tasks = [visual_limited_task(i, semaphore) for i in range(100)]
@@ -131,19 +131,19 @@ async def run_visual_limited_concurrency():
     return {"message": "Visual limited concurrency tasks completed with increased tasks"}
 
 # Visual queue concurrency with more workers and tasks
-@tracer.start_as_current_span(name="visual_worker")
+@tracer.traced("visual_worker")
 async def visual_worker(name, queue):
     while not queue.empty():
         task_id = await queue.get()
         duration = random.uniform(2, 5)
-        with tracer.start_as_current_span(name=f"visual-task-{task_id}"):
+        with tracer.span(f"visual-task-{task_id}"):
             print(f"{name} |{'#' * task_id} Task {task_id:02} Start")
             await asyncio.sleep(duration)
             print(f"{name} |{'#' * task_id} Task {task_id:02} Done ({duration:.2f}s)")
             queue.task_done()
 
 @app.get("/queue-concurrency", description="Process 100 tasks using a queue with 10 worker coroutines.")
-@tracer.start_as_current_span(name="run_visual_queue_concurrency")
+@tracer.traced("run_visual_queue_concurrency", tracing.REQUEST)
 async def run_visual_queue_concurrency():
     queue = asyncio.Queue()
     for i in range(100):
@@ -161,13 +161,13 @@ async def run_visual_queue_concurrency():
 
 # Caching Example with reduced TTL and more access
 @cached(ttl=30)
-@tracer.start_as_current_span(name="get_cached_data")
+@tracer.traced("get_cached_data")
 async def get_cached_data():
     await asyncio.sleep(3)
     return {"data": "This is cached data with shorter TTL"}
 
 @app.get("/cached-data", description="Retrieve cached data with a TTL of 30 seconds, accessed multiple times.")
-@tracer.start_as_current_span(name="read_cached_data")
+@tracer.traced("read_cached_data", tracing.REQUEST)
 async def read_cached_data():
     data = await get_cached_data()
     # Access cached data multiple times
@@ -178,13 +178,13 @@ async def read_cached_data():
 # ----------------------------------------
 
 # Handling blocking I/O with longer duration
-@tracer.start_as_current_span(name="blocking_io")
+@tracer.traced("blocking_io")
 def blocking_io():
     time.sleep(10)
     return "Blocking I/O operation completed after 10 seconds"
 
 @app.get("/blocking-io", description="Handle a blocking I/O operation by running it in a separate thread.")
-@tracer.start_as_current_span(name="handle_blocking_io")
+@tracer.traced("handle_blocking_io", tracing.REQUEST)
 async def handle_blocking_io():
     result = await asyncio.to_thread(blocking_io)
     return {"result": result}
@@ -195,13 +195,13 @@ async def handle_blocking_io():
 
 # Bad Blocking Examples intensified
 @app.get("/bad-blocking-sleep", description="Endpoint demonstrating a blocking sleep of 10 seconds.")
-@tracer.start_as_current_span(name="bad_blocking_sleep")
+@tracer.traced("bad_blocking_sleep", tracing.REQUEST)
 async def bad_blocking_sleep():
     time.sleep(10)  # Increased blocking sleep
     return {"message": "This endpoint used a longer blocking sleep!"}
 
 @app.get("/bad-blocking-while", description="Endpoint demonstrating a CPU-bound blocking loop.")
-@tracer.start_as_current_span(name="bad_blocking_while")
+@tracer.traced("bad_blocking_while", tracing.REQUEST)
 async def bad_blocking_while():
     i = 0
     while i < 5e8:  # Increased CPU-bound blocking loop
@@ -209,7 +209,7 @@ async def bad_blocking_while():
     return {"message": "This endpoint used a longer blocking while loop!"}
 
 @app.get("/bad-blocking-file-io", description="Endpoint performing extensive blocking file I/O operations.")
-@tracer.start_as_current_span(name="bad_blocking_file_io")
+@tracer.traced("bad_blocking_file_io", tracing.REQUEST)
 async def bad_blocking_file_io():
     with open("very_large_file.txt", "w") as f:
         for i in range(50000000):
@@ -221,7 +221,7 @@ async def bad_blocking_file_io():
 # ----------------------------------------
 
 @app.get("/", description="Root endpoint welcoming users to the FastAPI async demo with Azure OpenTelemetry.")
-@tracer.start_as_current_span(name="root")
+@tracer.traced("root", tracing.REQUEST)
 async def root():
     return {"message": "Welcome to the FastAPI async demo with Azure OpenTelemetry!"}
 
@@ -0,0 +1,63 @@
+# serialization cost of one order message: the old model_dump + json.dumps envelope against the codec
+# python -m pizza_library.benchmarks.codec [--orders 20000]
+
+import argparse
+import json
+import time
+
+from pizza_library import codec
+from pizza_library.functions import create_random_orders
+from pizza_library.models import Order
+
+
+def _legacy_encode(order: Order) -> str:
+    return json.dumps(dict(type='order', data=order.model_dump()))
+
+
+def _legacy_decode(data: str) -> Order:
+    return Order.model_validate(json.loads(data)['data'])
+
+
+def _time(name: str, function, items) -> list:
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    elapsed = time.perf_counter() - start
+    size = sum(len(result) for result in results) / len(results)
+    print(f'{name:<32} {elapsed / len(items) * 1e6:8.2f} us/order {len(items) / elapsed:12,.0f} orders/s '
+          f'{size:8.0f} bytes')
+    return results
+
+
+def _time_decode(name: str, function, items):
+    # decoded orders are dropped right away like a consumer would, keeping them all measures the gc instead
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    elapsed = time.perf_counter() - start
+    print(f'{name:<32} {elapsed / len(items) * 1e6:8.2f} us/order {len(items) / elapsed:12,.0f} orders/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='order message encode and decode cost')
+    parser.add_argument('--orders', type=int, default=20_000)
+    args = parser.parse_args()
+
+    orders = list(create_random_orders(args.orders, seed=42))
+    legacy = _time('encode model_dump+json.dumps', _legacy_encode, orders)
+    envelopes = _time('encode codec json', codec.encode_envelope, orders)
+    binary = _time('encode codec binary', lambda order: codec.encode_envelope(order, codec.FORMAT_BINARY), orders)
+    _time_decode('decode json.loads+model_validate', _legacy_decode, legacy)
+    _time_decode('decode codec json', codec.decode_envelope, envelopes)
+    _time_decode('decode codec binary', codec.decode_envelope, binary)
+
+    for format in (codec.FORMAT_JSON, codec.FORMAT_BINARY):
+        batch = codec.encode_batch(orders, format)
+        chunks = [batch[i:i + 65536] for i in range(0, len(batch), 65536)]
+        start = time.perf_counter()
+        count = sum(1 for _ in codec.iter_decode_batch(chunks, format))
+        elapsed = time.perf_counter() - start
+        print(f'{"stream decode " + format:<32} {elapsed / count * 1e6:8.2f} us/order {count / elapsed:12,.0f} orders/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# per-lookup latency of get_order_by_id with a connection per call versus the shared per-thread connection
+# python -m pizza_library.benchmarks.get_order [--lookups 10000]
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from pizza_library.database import GET_ORDER_QUERY, configure_database, initialize_database, insert_orders, \
+    get_order_by_id
+from pizza_library.functions import create_random_order
+
+
+def _get_order_with_fresh_connection(path: str, order_id: int):
+    # what every lookup used to do: connect, parse the query, fetch, disconnect
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    try:
+        return connection.execute(GET_ORDER_QUERY, (order_id,)).fetchall()
+    finally:
+        connection.close()
+
+
+def _report(name: str, lookups: int, elapsed: float):
+    print(f'{name:<24} {elapsed / lookups * 1e6:8.1f} us/lookup  {lookups / elapsed:10,.0f} lookups/s')
+
+
+def run(path: str, orders: int = 1_000, lookups: int = 10_000):
+    database = configure_database(path)
+    initialize_database()
+    order_ids = insert_orders(create_random_order() for _ in range(orders))
+    sample = [random.choice(order_ids) for _ in range(lookups)]
+
+    start = time.perf_counter()
+    for order_id in sample:
+        _get_order_with_fresh_connection(database.path, order_id)
+    _report('connection per lookup', lookups, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for order_id in sample:
+        database.connection().execute(GET_ORDER_QUERY, (order_id,)).fetchall()
+    _report('shared connection', lookups, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for order_id in sample:
+        get_order_by_id(order_id)
+    _report('get_order_by_id', lookups, time.perf_counter() - start)
+    database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='get_order_by_id latency, connection per call vs shared connection')
+    parser.add_argument('--orders', type=int, default=1_000)
+    parser.add_argument('--lookups', type=int, default=10_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        run(os.path.join(directory, 'benchmark.db'), args.orders, args.lookups)
+
+
+if __name__ == '__main__':
+    main()
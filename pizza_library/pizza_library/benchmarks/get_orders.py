@@ -0,0 +1,60 @@
+# loading many orders: N x get_order_by_id versus get_orders and iter_orders
+# python -m pizza_library.benchmarks.get_orders [--orders 10000]
+
+import argparse
+import os
+import tempfile
+import time
+
+from pizza_library.database import configure_database, initialize_database, insert_orders, get_order_by_id, \
+    get_orders, iter_orders
+from pizza_library.functions import create_random_order
+
+
+def _report(name: str, orders: int, elapsed: float):
+    print(f'{name:<20} {elapsed:8.3f} s  {orders / elapsed:12,.0f} orders/s')
+
+
+def _best(function, repeat: int):
+    # the fastest of a few runs, the first one also pays for reading the file into the page cache
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed.append(time.perf_counter() - start)
+    return result, min(elapsed)
+
+
+def run(path: str, orders: int = 10_000, chunk_size: int = 1_000, repeat: int = 3):
+    database = configure_database(path)
+    initialize_database()
+    order_ids = insert_orders(create_random_order() for _ in range(orders))
+
+    looped, elapsed = _best(lambda: [get_order_by_id(order_id) for order_id in order_ids], repeat)
+    _report('N x get_order_by_id', orders, elapsed)
+
+    batched, batched_elapsed = _best(lambda: get_orders(order_ids), repeat)
+    _report('get_orders', orders, batched_elapsed)
+
+    streamed, streamed_elapsed = _best(lambda: sum(1 for _ in iter_orders(chunk_size=chunk_size)), repeat)
+    _report('iter_orders', orders, streamed_elapsed)
+    print(f'get_orders is {elapsed / batched_elapsed:.1f}x, iter_orders {elapsed / streamed_elapsed:.1f}x '
+          f'as fast as the loop')
+
+    assert looped == [batched[order_id] for order_id in order_ids]
+    assert streamed == orders
+    database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='N x get_order_by_id versus the batched loaders')
+    parser.add_argument('--orders', type=int, default=10_000)
+    parser.add_argument('--chunk-size', type=int, default=1_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        run(os.path.join(directory, 'benchmark.db'), args.orders, args.chunk_size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
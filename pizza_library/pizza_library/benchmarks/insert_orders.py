@@ -0,0 +1,43 @@
+# benchmark for pizza_library.database.insert_orders
+# python -m pizza_library.benchmarks.insert_orders [--sizes 1000 100000 1000000]
+
+import argparse
+import os
+import tempfile
+import time
+from itertools import cycle, islice
+
+from pizza_library.database import configure_database, flush_database, initialize_database, insert_orders
+from pizza_library.functions import create_random_order
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+
+def run(sizes=DEFAULT_SIZES, distinct_orders: int = 1_000):
+    # generating pydantic orders is not what we measure, so a pool of random orders is cycled through
+    pool = [create_random_order() for _ in range(distinct_orders)]
+    results = []
+    for size in sizes:
+        flush_database()
+        initialize_database()
+        start = time.perf_counter()
+        order_ids = insert_orders(islice(cycle(pool), size))
+        elapsed = time.perf_counter() - start
+        assert len(order_ids) == size
+        results.append((size, elapsed, size / elapsed))
+        print(f'{size:>10} orders  {elapsed:8.2f} s  {size / elapsed:12,.0f} orders/s')
+    flush_database()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='orders/second of insert_orders')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        configure_database(os.path.join(directory, 'benchmark.db'))
+        run(args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# throughput and end-to-end latency of the order pipeline itself (encoding and decoding the envelope, spans)
+# over the in-process transports, with no network in between
+# python -m pizza_library.benchmarks.messaging [--transport asyncio|memory|multiprocessing] [--orders 20000]
+
+import argparse
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from opentelemetry import trace
+
+from pizza_library.codec import decode_envelope
+from pizza_library.functions import create_random_order
+from pizza_library.messaging import AsyncioQueueBackend, InProcessQueueBackend, MultiprocessingQueueBackend, \
+    send_pizza_order, send_pizza_order_async, set_message_backend
+
+
+def _order_id(data) -> str:
+    # whichever PIZZA_MESSAGING_FORMAT the orders were sent in, decoded as a consumer would
+    return decode_envelope(data)[1].id
+
+
+def _percentile(values, percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _report(transport: str, sent_at: dict, received_at: dict, elapsed: float):
+    latencies = [received_at[order_id] - sent_at[order_id] for order_id in received_at]
+    print(f'{transport:<16} {len(received_at) / elapsed:10,.0f} msg/s  '
+          f'p50 {_percentile(latencies, 50) * 1e6:8.1f} us  p99 {_percentile(latencies, 99) * 1e6:8.1f} us')
+
+
+def run_asyncio(orders):
+    backend = AsyncioQueueBackend()
+    set_message_backend(backend)
+    sent_at, received_at = {}, {}
+
+    async def consume():
+        async for data in backend.receive_async(max_wait_time=1):
+            received_at[_order_id(data)] = time.monotonic()
+            if len(received_at) == len(orders):
+                return
+
+    async def produce():
+        for order in orders:
+            sent_at[order.id] = time.monotonic()
+            await send_pizza_order_async(order)
+            # like a request handler, give the other tasks a turn after every order
+            await asyncio.sleep(0)
+
+    async def main():
+        start = time.monotonic()
+        await asyncio.gather(consume(), produce())
+        return time.monotonic() - start
+
+    _report('asyncio', sent_at, received_at, asyncio.run(main()))
+
+
+def run_memory(orders):
+    backend = InProcessQueueBackend(maxsize=len(orders))
+    set_message_backend(backend)
+    sent_at, received_at = {}, {}
+
+    def consume():
+        for data in backend.receive(max_wait_time=1):
+            received_at[_order_id(data)] = time.monotonic()
+            if len(received_at) == len(orders):
+                return
+
+    consumer = threading.Thread(target=consume)
+    start = time.monotonic()
+    consumer.start()
+    for order in orders:
+        sent_at[order.id] = time.monotonic()
+        send_pizza_order(order)
+    consumer.join()
+    _report('memory', sent_at, received_at, time.monotonic() - start)
+
+
+def _consume_in_process(backend: MultiprocessingQueueBackend, results, count: int):
+    # time.monotonic is system wide on linux, so timestamps of both processes can be compared
+    received = []
+    for data in backend.receive(max_wait_time=5):
+        received.append((_order_id(data), time.monotonic()))
+        if len(received) == count:
+            break
+    results.put(received)
+
+
+def run_multiprocessing(orders):
+    backend = MultiprocessingQueueBackend(maxsize=len(orders))
+    set_message_backend(backend)
+    results = multiprocessing.Queue()
+    consumer = multiprocessing.Process(target=_consume_in_process, args=(backend, results, len(orders)))
+    consumer.start()
+    sent_at = {}
+    start = time.monotonic()
+    for order in orders:
+        sent_at[order.id] = time.monotonic()
+        send_pizza_order(order)
+    received_at = dict(results.get())
+    elapsed = max(received_at.values()) - start
+    consumer.join()
+    _report('multiprocessing', sent_at, received_at, elapsed)
+
+
+TRANSPORTS = {
+    'asyncio': run_asyncio,
+    'memory': run_memory,
+    'multiprocessing': run_multiprocessing,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='order pipeline throughput over in-process transports')
+    parser.add_argument('--transport', choices=TRANSPORTS, nargs='+', default=list(TRANSPORTS))
+    parser.add_argument('--orders', type=int, default=20_000)
+    parser.add_argument('--tracing', action='store_true', help='record spans with the SDK, without exporting')
+    args = parser.parse_args()
+    if args.tracing:
+        from opentelemetry.sdk.trace import TracerProvider
+        trace.set_tracer_provider(TracerProvider())
+
+    orders = [create_random_order() for _ in range(args.orders)]
+    for transport in args.transport:
+        TRANSPORTS[transport](orders)
+
+
+if __name__ == '__main__':
+    main()
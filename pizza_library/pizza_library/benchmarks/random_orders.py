@@ -0,0 +1,35 @@
+# order generation rate: create_random_order in a loop against create_random_orders as models and as json
+# python -m pizza_library.benchmarks.random_orders [--orders 100000] [--seed 42]
+
+import argparse
+import time
+
+from pizza_library.functions import create_random_order, create_random_orders
+
+
+def _report(name: str, count: int, elapsed: float):
+    print(f'{name:<28} {count:>9,} orders {elapsed:8.3f} s {count / elapsed:12,.0f} orders/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bulk order generation throughput')
+    parser.add_argument('--orders', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # the one by one path is slow, a tenth of the orders is enough for its rate
+    count = max(1, args.orders // 10)
+    start = time.perf_counter()
+    for _ in range(count):
+        create_random_order()
+    _report('create_random_order', count, time.perf_counter() - start)
+
+    for name, as_json in (('create_random_orders', False), ('create_random_orders json', True)):
+        start = time.perf_counter()
+        for _ in create_random_orders(args.orders, seed=args.seed, as_json=as_json):
+            pass
+        _report(name, args.orders, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
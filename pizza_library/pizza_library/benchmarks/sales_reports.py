@@ -0,0 +1,56 @@
+# sales reports from the aggregate tables versus ad-hoc GROUP BYs over the order history
+# python -m pizza_library.benchmarks.sales_reports [--orders 100000]
+
+import argparse
+import os
+import tempfile
+import time
+
+from pizza_library.database import UPDATE_SALES_BY_SIZE_QUERY, UPDATE_SALES_BY_INGREDIENT_TYPE_QUERY, \
+    UPDATE_SALES_BY_HOUR_QUERY, MAX_ORDER_ID, configure_database, initialize_database, insert_orders, \
+    get_sales_by_size, get_sales_by_ingredient_type, get_sales_by_hour
+from pizza_library.functions import create_random_order
+
+
+def _select_part(query: str) -> str:
+    # the GROUP BY that feeds the upsert is the ad-hoc report
+    return query[query.index('SELECT'):query.index('ON CONFLICT')]
+
+
+def _timed(name: str, report, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        report()
+    print(f'{name:<28} {(time.perf_counter() - start) / repeat * 1e3:10.3f} ms/report')
+
+
+def run(path: str, orders: int = 100_000, repeat: int = 10):
+    database = configure_database(path)
+    initialize_database()
+    pool = [create_random_order() for _ in range(1_000)]
+    for _ in range(orders // len(pool)):
+        insert_orders(pool)
+    connection = database.connection()
+
+    for name, query in (('size', UPDATE_SALES_BY_SIZE_QUERY),
+                        ('ingredient type', UPDATE_SALES_BY_INGREDIENT_TYPE_QUERY),
+                        ('hour', UPDATE_SALES_BY_HOUR_QUERY)):
+        _timed(f'GROUP BY {name}', lambda: connection.execute(_select_part(query), (0, MAX_ORDER_ID)).fetchall(),
+               repeat)
+    _timed('get_sales_by_size', get_sales_by_size, repeat)
+    _timed('get_sales_by_ingredient_type', get_sales_by_ingredient_type, repeat)
+    _timed('get_sales_by_hour', get_sales_by_hour, repeat)
+    database.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sales reports, aggregate tables versus GROUP BY')
+    parser.add_argument('--orders', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        run(os.path.join(directory, 'benchmark.db'), args.orders, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
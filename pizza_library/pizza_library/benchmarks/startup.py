@@ -0,0 +1,78 @@
+# cold import time of the service modules, each measured in a fresh interpreter
+# python -m pizza_library.benchmarks.startup [--modules pizza_library.storage] [--max-seconds 2.0] [--importtime]
+#
+# --max-seconds makes the run fail when a module is slower, so CI can catch startup regressions. Only the modules
+# of this library are measured by default, the services measure theirs with their own startup benchmark.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ('pizza_library.storage', 'pizza_library.messaging', 'pizza_library.functions',
+                   'pizza_library.database')
+
+
+def measure(module: str, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True, env=os.environ.copy())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def baseline(repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def slowest_imports(module: str, count: int = 15):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            check=True, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main(default_modules=DEFAULT_MODULES):
+    parser = argparse.ArgumentParser(description='cold import time of the service modules')
+    parser.add_argument('--modules', nargs='+', default=default_modules)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    parser.add_argument('--importtime', action='store_true', help='list the slowest imports of every module')
+    args = parser.parse_args()
+
+    interpreter = baseline(args.repeat)
+    print(f'{"interpreter":<28} {interpreter * 1e3:8.1f} ms')
+    too_slow = []
+    for module in args.modules:
+        try:
+            elapsed = measure(module, args.repeat) - interpreter
+        except subprocess.CalledProcessError:
+            print(f'{module:<28}   failed to import')
+            too_slow.append(module)
+            continue
+        print(f'{module:<28} {elapsed * 1e3:8.1f} ms')
+        if args.importtime:
+            for cumulative, name in slowest_imports(module):
+                print(f'    {cumulative / 1e3:8.1f} ms  {name}')
+        if args.max_seconds is not None and elapsed > args.max_seconds:
+            too_slow.append(module)
+    if too_slow:
+        sys.exit(f'startup budget exceeded or import failed: {", ".join(too_slow)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# what telemetry costs: cold start of setup_telemetry, and the per request overhead of spans and logs under
+# the sampling and log level settings, exporting to an exporter that drops everything
+# python -m pizza_library.benchmarks.telemetry [--requests 20000]
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from pizza_library.startup import create_sampler, create_span_processor
+
+# what startup.py imported up front before the exporters were deferred, the missing ones are skipped
+EAGER_IMPORTS = ('azure.core.settings', 'azure.core.tracing.ext.opentelemetry_span', 'azure.monitor.opentelemetry',
+                 'opentelemetry.sdk._logs', 'opentelemetry.sdk._logs.export', 'opentelemetry.sdk.trace.export',
+                 'opentelemetry.sdk.metrics', 'opentelemetry.sdk.metrics.export')
+
+
+class _DropExporter(SpanExporter):
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+def _run(code: str, repeat: int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, env=os.environ.copy())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def startup():
+    base = _run('pass')
+    eager = []
+    for module in EAGER_IMPORTS:
+        try:
+            __import__(module)
+            eager.append(module)
+        except ImportError:
+            print(f'  {module} is not installed, left out')
+    rows = [
+        ('import startup', 'import pizza_library.startup'),
+        ('setup_telemetry (console)', 'from pizza_library.startup import setup_telemetry; setup_telemetry("bench")'),
+        ('previous eager imports', ';'.join(f'import {module}' for module in eager) or 'pass'),
+    ]
+    for name, code in rows:
+        print(f'{name:<28} {(_run(code) - base) * 1000:8.1f} ms')
+
+
+def _request(tracer, logger, fail: bool):
+    # the span and log shape of one shop request
+    with tracer.start_as_current_span('GET /', attributes={'http.route': '/'}):
+        logger.debug('request details')
+        with tracer.start_as_current_span('shop'):
+            with tracer.start_as_current_span('send_pizza_order'):
+                with tracer.start_as_current_span('send_pizza_data'):
+                    pass
+            logger.info('created order')
+            if fail:
+                try:
+                    with tracer.start_as_current_span('archive'):
+                        raise ValueError('archive failed')
+                except ValueError:
+                    pass
+
+
+def _provider(ratio: float, keep_errors: bool) -> TracerProvider:
+    provider = TracerProvider(sampler=create_sampler(ratio, keep_errors, 0))
+    provider.add_span_processor(create_span_processor(_DropExporter(), keep_errors, 0))
+    return provider
+
+
+def _logger(name: str, level: str, exported: bool):
+    logger = logging.getLogger(f'bench.{name}')
+    logger.propagate = False
+    logger.setLevel(level)
+    logger_provider = None
+    if exported:
+        from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+        from opentelemetry.sdk._logs.export import BatchLogRecordProcessor, LogExporter, LogExportResult
+
+        class DropLogs(LogExporter):
+            def export(self, batch):
+                return LogExportResult.SUCCESS
+
+            def shutdown(self):
+                pass
+
+            def force_flush(self, timeout_millis: int = 30000) -> bool:
+                return True
+
+        logger_provider = LoggerProvider()
+        logger_provider.add_log_record_processor(BatchLogRecordProcessor(DropLogs()))
+        logger.addHandler(LoggingHandler(level=level, logger_provider=logger_provider))
+    return logger, logger_provider
+
+
+def per_request(requests: int):
+    # providers are created one at a time, every one of them starts an export thread
+    configs = [
+        ('no sdk', trace.NoOpTracerProvider, 'INFO', False),
+        # a root logger at NOTSET lets everything through, like DEBUG on this non propagating logger
+        ('sample 1.0, logs NOTSET', lambda: _provider(1.0, True), 'DEBUG', True),
+        ('sample 1.0, logs INFO', lambda: _provider(1.0, True), 'INFO', True),
+        ('sample 0.1 keep errors', lambda: _provider(0.1, True), 'INFO', True),
+        ('sample 0.1', lambda: _provider(0.1, False), 'INFO', True),
+        ('sample 0.0', lambda: _provider(0.0, False), 'INFO', True),
+    ]
+    for name, create_provider, level, exported in configs:
+        provider = create_provider()
+        tracer = provider.get_tracer(__name__)
+        logger, logger_provider = _logger(name, level, exported)
+        for i in range(min(1000, requests)):
+            _request(tracer, logger, i % 100 == 0)
+        start = time.perf_counter()
+        for i in range(requests):
+            # one request in a hundred fails
+            _request(tracer, logger, i % 100 == 0)
+        elapsed = time.perf_counter() - start
+        print(f'{name:<28} {elapsed / requests * 1e6:8.1f} us/request')
+        # the export threads of one setting must not eat into the next one
+        if isinstance(provider, TracerProvider):
+            provider.shutdown()
+        if logger_provider is not None:
+            logger_provider.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='telemetry startup and per request overhead')
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--skip-startup', action='store_true')
+    args = parser.parse_args()
+    if not args.skip_startup:
+        startup()
+    per_request(args.requests)
+
+
+if __name__ == '__main__':
+    main()
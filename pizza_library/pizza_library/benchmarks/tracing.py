@@ -0,0 +1,80 @@
+# ns per call of a traced step: plain start_as_current_span against the tracing helpers, with the trace
+# sampled, sampled out, sampled out but recorded for its errors and at lower verbosities, with the samplers
+# setup_telemetry uses, recording into an SDK that exports nothing
+# python -m pizza_library.benchmarks.tracing [--calls 200000]
+
+import argparse
+import time
+
+from opentelemetry.sdk.trace import TracerProvider
+
+from pizza_library import tracing
+from pizza_library.startup import create_sampler
+
+SAMPLED = 'sampled'
+SAMPLED_OUT = 'sampled out'
+ERRORS_KEPT = 'sampled out, errors kept'
+
+
+def _step():
+    pass
+
+
+def _measure(name: str, call, calls: int, state: str, provider_tracers: dict):
+    # every measurement runs inside a request span, sampled or not, like the steps of the shop do
+    root = provider_tracers[state]
+    with root.start_as_current_span('request'):
+        for _ in range(min(calls, 10_000)):
+            call()
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            call()
+        elapsed = time.perf_counter_ns() - start
+    print(f'{name:<52} {elapsed / calls:10.0f} ns/call')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cost of traced steps')
+    parser.add_argument('--calls', type=int, default=200_000)
+    args = parser.parse_args()
+
+    # no span processor: what is measured is creating and ending spans, not exporting them
+    samplers = {
+        SAMPLED: create_sampler(1.0),
+        SAMPLED_OUT: create_sampler(0.0, keep_errors=False, slow_span_ms=0),
+        ERRORS_KEPT: create_sampler(0.0, keep_errors=True, slow_span_ms=0),
+    }
+    tracers = {state: TracerProvider(sampler=sampler).get_tracer(__name__) for state, sampler in samplers.items()}
+    helpers = {state: tracing.Tracer(tracer) for state, tracer in tracers.items()}
+
+    def plain(state: str):
+        tracer = tracers[state]
+
+        def call():
+            with tracer.start_as_current_span('step'):
+                _step()
+        return call
+
+    def helper(state: str):
+        tracer = helpers[state]
+
+        def call():
+            with tracer.span('step'):
+                _step()
+        return call
+
+    def decorated(state: str):
+        return helpers[state].traced('step')(_step)
+
+    _measure('untraced call', _step, args.calls, SAMPLED, tracers)
+    for state in samplers:
+        _measure(f'start_as_current_span, {state}', plain(state), args.calls, state, tracers)
+        for verbosity in ('step', 'events', 'request', 'off'):
+            tracing.set_verbosity(verbosity)
+            _measure(f'tracer.span, {verbosity}, {state}', helper(state), args.calls, state, tracers)
+            _measure(f'@tracer.traced, {verbosity}, {state}', decorated(state), args.calls, state, tracers)
+    tracing.set_verbosity(tracing.PIZZA_TRACE_VERBOSITY)
+
+
+if __name__ == '__main__':
+    main()
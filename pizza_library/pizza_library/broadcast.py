@@ -0,0 +1,137 @@
+# in-process fan out of frames to many subscribers, for event streams to dashboards
+#
+# The publisher hands over bytes that are ready to write, serialized once for every subscriber. Each subscriber
+# has a bounded buffer. When a client reads slower than frames arrive and its buffer is full, either its oldest
+# frames are dropped and it is told how many (DROP_OLDEST), or it is disconnected and has to reconnect
+# (DISCONNECT); a slow client never holds up the publisher or the other subscribers.
+
+import asyncio
+import os
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from opentelemetry import metrics
+
+DROP_OLDEST = 'oldest'
+DISCONNECT = 'disconnect'
+
+PIZZA_BROADCAST_BUFFER = int(os.environ.get('PIZZA_BROADCAST_BUFFER', 256))
+PIZZA_BROADCAST_DROP = os.environ.get('PIZZA_BROADCAST_DROP', DROP_OLDEST)
+PIZZA_BROADCAST_MAX_SUBSCRIBERS = int(os.environ.get('PIZZA_BROADCAST_MAX_SUBSCRIBERS', 10_000))
+
+meter = metrics.get_meter(__name__)
+subscriber_count = meter.create_up_down_counter('pizza_broadcast_subscribers', 'subscribers connected', 'subscribers')
+dropped_frames = meter.create_counter('pizza_broadcast_dropped', 'frames slow subscribers did not get', 'frames')
+
+
+class TooManySubscribers(RuntimeError):
+    pass
+
+
+class Subscription:
+    def __init__(self, hub: 'BroadcastHub', max_buffer: int, drop: str):
+        self._hub = hub
+        self.max_buffer = max_buffer
+        self.drop = drop
+        self.closed = False
+        self._buffer: Deque[bytes] = deque()
+        self._dropped = 0
+        self._waiter: asyncio.Future = None
+
+    def _push(self, frame: bytes):
+        if len(self._buffer) >= self.max_buffer:
+            dropped_frames.add(1, {'policy': self.drop})
+            if self.drop == DISCONNECT:
+                self._buffer.clear()
+                self.close()
+                return
+            self._buffer.popleft()
+            self._dropped += 1
+        self._buffer.append(frame)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self, timeout: float = None) -> Optional[Tuple[List[bytes], int]]:
+        """
+        Waits up to timeout seconds for frames and returns all that are buffered, with the number of frames
+        dropped since the last call; ([], 0) when the timeout ran out, None once the subscription is closed and
+        read.
+        """
+        if not self._buffer and not self.closed:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiter = None
+        if self.closed and not self._buffer:
+            return None
+        frames, self._buffer = list(self._buffer), deque()
+        dropped, self._dropped = self._dropped, 0
+        return frames, dropped
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._hub._unsubscribe(self)
+            self._wake()
+
+
+class BroadcastHub:
+    """For use from one event loop; it takes no locks."""
+
+    def __init__(self, max_buffer: int = PIZZA_BROADCAST_BUFFER, drop: str = PIZZA_BROADCAST_DROP,
+                 max_subscribers: int = PIZZA_BROADCAST_MAX_SUBSCRIBERS):
+        if drop not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f'unknown drop policy {drop!r}, expected {DROP_OLDEST} or {DISCONNECT}')
+        self.max_buffer = max_buffer
+        self.drop = drop
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.closed = False
+        self._subscribers: Set[Subscription] = set()
+
+    def full(self) -> bool:
+        return len(self._subscribers) >= self.max_subscribers
+
+    def subscribe(self) -> Subscription:
+        if self.full():
+            raise TooManySubscribers(f'at most {self.max_subscribers} subscribers')
+        subscription = Subscription(self, self.max_buffer, self.drop)
+        if self.closed:
+            # ends right away, like the ones close() ended
+            subscription.closed = True
+            return subscription
+        self._subscribers.add(subscription)
+        subscriber_count.add(1)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            subscriber_count.add(-1)
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+    def publish(self, frame: bytes):
+        self.published += 1
+        # a copy, DISCONNECT removes subscribers while this loops
+        for subscription in list(self._subscribers):
+            subscription._push(frame)
+
+    def close(self):
+        """
+        Ends every subscription, their streams finish once they have read what was buffered. Later
+        subscriptions end as soon as they start.
+        """
+        self.closed = True
+        for subscription in list(self._subscribers):
+            subscription.close()
+
+    def stats(self) -> dict:
+        return {'subscribers': len(self._subscribers), 'published': self.published}
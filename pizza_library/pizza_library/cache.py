@@ -0,0 +1,95 @@
+# bounded in-process cache of serialized orders for the read endpoints
+#
+# Entries hold the response bytes and their ETag, so a hit neither touches sqlite nor serializes anything.
+# Writers put the new bytes in (or invalidate) right after their commit. The TTL bounds how long another
+# process' write can stay unseen, every process has a cache of its own.
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from opentelemetry import metrics
+
+PIZZA_ORDER_CACHE_SIZE = int(os.environ.get('PIZZA_ORDER_CACHE_SIZE', 10_000))
+PIZZA_ORDER_CACHE_TTL = float(os.environ.get('PIZZA_ORDER_CACHE_TTL', 60.0))
+
+meter = metrics.get_meter(__name__)
+cache_requests = meter.create_counter('pizza_order_cache_requests', 'order cache lookups by result', 'lookups')
+
+
+class CachedOrder(NamedTuple):
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+def etag_of(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, a W/ prefix on either side does not matter."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag.removeprefix('W/')
+    return any(candidate.strip().removeprefix('W/') == etag for candidate in if_none_match.split(','))
+
+
+class OrderCache:
+    """LRU with a TTL, for use from one event loop or thread; it takes no locks."""
+
+    def __init__(self, max_entries: int = PIZZA_ORDER_CACHE_SIZE, ttl: float = PIZZA_ORDER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[int, CachedOrder]' = OrderedDict()
+
+    def get(self, order_id: int) -> Optional[CachedOrder]:
+        entry = self._entries.get(order_id)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            del self._entries[order_id]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            cache_requests.add(1, {'result': 'miss'})
+            return None
+        self._entries.move_to_end(order_id)
+        self.hits += 1
+        cache_requests.add(1, {'result': 'hit'})
+        return entry
+
+    def get_many(self, order_ids: Iterable[int]) -> Dict[int, CachedOrder]:
+        found = {}
+        for order_id in order_ids:
+            entry = self.get(order_id)
+            if entry is not None:
+                found[order_id] = entry
+        return found
+
+    def put(self, order_id: int, body: bytes) -> CachedOrder:
+        entry = CachedOrder(body, etag_of(body), time.monotonic() + self.ttl)
+        self._entries[order_id] = entry
+        self._entries.move_to_end(order_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, order_id: int):
+        self._entries.pop(order_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
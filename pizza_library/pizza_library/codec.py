@@ -0,0 +1,332 @@
+# wire formats of pizza orders
+#
+# json: the order as model_dump_json produces it, wrapped in a {"type": "order", "v": 1, "data": ...} envelope
+# for messages. Encoding and decoding each take one pass through pydantic's serializer, no intermediate dicts.
+#
+# binary: a compact positional format. A message starts with MAGIC, the schema version
+# and the message type, then the order fields in declaration order: strings and list lengths as varint
+# prefixed, prices as little endian doubles and enums as one byte indexes into the tables below.
+# It is for links where message size matters, messages are about a third of their JSON size. It is not the
+# faster format: pydantic decodes JSON in Rust, binary messages are read in Python and decode slower, so
+# JSON stays the default everywhere.
+#
+# Batches are NDJSON of orders (the archive format) or varint length prefixed binary messages, and
+# iter_decode_batch decodes them from any chunking of the stream.
+
+import struct
+from functools import lru_cache
+from typing import Any, Iterable, Iterator, Literal, Tuple, Union
+
+from pydantic import TypeAdapter, ValidationError
+from typing_extensions import NotRequired, TypedDict
+
+from pizza_library.models import Ingredient, Order, Pizza, SizeEnum, TypeEnum, construct
+
+SCHEMA_VERSION = 1
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+MAGIC = b'\xa5P'
+
+# wire tables of schema version 1, append only: the index of a value is what goes over the wire
+SIZES = (SizeEnum.SMALL, SizeEnum.MEDIUM, SizeEnum.LARGE)
+TYPES = (TypeEnum.MEAT, TypeEnum.FISH, TypeEnum.SWEET, TypeEnum.SPICE, TypeEnum.CHEESE)
+MESSAGE_TYPES = ('order',)
+
+_SIZE_CODES = {size: i for i, size in enumerate(SIZES)}
+_TYPE_CODES = {type_: i for i, type_ in enumerate(TYPES)}
+_HEADER = struct.Struct('<2sBB')
+_CODED_DOUBLE = struct.Struct('<Bd')
+_SMALL_INTS = [bytes((i,)) for i in range(128)]
+
+
+class CodecError(ValueError):
+    pass
+
+
+class _OrderEnvelope(TypedDict):
+    type: Literal['order']
+    # envelopes without a version are the plain json.dumps ones of before the codec, same data as version 1
+    v: NotRequired[int]
+    data: Order
+
+
+@lru_cache(maxsize=None)
+def adapter(annotation) -> TypeAdapter:
+    """TypeAdapters build their validator and serializer on creation, so there is one per type."""
+    return TypeAdapter(annotation)
+
+
+def encode_order(order: Order) -> bytes:
+    """The order as JSON, byte for byte what model_dump_json returns."""
+    return adapter(Order).dump_json(order)
+
+
+def decode_order(data: Union[str, bytes]) -> Order:
+    try:
+        return adapter(Order).validate_json(data)
+    except ValidationError as e:
+        raise CodecError(f'invalid order: {e}') from e
+
+
+def encode_envelope(order: Order, format: str = FORMAT_JSON, payload: bytes = None) -> bytes:
+    """
+    The order message for the queue. payload is the order as encode_order returned it, pass it when the
+    order was encoded for something else already, so it is not serialized twice.
+    """
+    if format == FORMAT_BINARY:
+        return encode_binary(order)
+    if format != FORMAT_JSON:
+        raise ValueError(f'unknown format {format!r}, expected {FORMAT_JSON} or {FORMAT_BINARY}')
+    return b'{"type":"order","v":%d,"data":%s}' % (SCHEMA_VERSION, payload or encode_order(order))
+
+
+def decode_envelope(data: Union[str, bytes]) -> Tuple[str, Any]:
+    """
+    Returns the message type and its content: an Order for order messages, whatever JSON the sender put
+    in data for other types. Raises CodecError for messages of an unknown format or a newer schema.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)) and data[:2] == MAGIC:
+        return decode_binary(data)
+    try:
+        envelope = adapter(_OrderEnvelope).validate_json(data)
+    except ValidationError as e:
+        # not an order message, or a broken one
+        envelope = _decode_other_envelope(data, e)
+        return envelope['type'], envelope.get('data')
+    if envelope.get('v', 0) > SCHEMA_VERSION:
+        raise CodecError(f'order message has schema version {envelope["v"]}, this codec reads up to '
+                         f'{SCHEMA_VERSION}')
+    return 'order', envelope['data']
+
+
+def _decode_other_envelope(data, error: ValidationError) -> dict:
+    try:
+        envelope = adapter(dict).validate_json(data)
+    except ValidationError:
+        raise CodecError('message is neither JSON nor a binary pizza message') from error
+    if envelope.get('type') == 'order' or not isinstance(envelope.get('type'), str):
+        raise CodecError(f'invalid message: {error}') from error
+    return envelope
+
+
+def _pack_string(out: bytearray, value: str):
+    data = value.encode()
+    _pack_length(out, len(data))
+    out += data
+
+
+def _pack_length(out: bytearray, value: int):
+    if value < 128:
+        out += _SMALL_INTS[value]
+        return
+    while value >= 128:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_binary(order: Order) -> bytes:
+    out = bytearray(_HEADER.pack(MAGIC, SCHEMA_VERSION, 0))
+    _pack_string(out, order.id)
+    _pack_string(out, order.recipient_name)
+    _pack_length(out, len(order.pizzas))
+    for pizza in order.pizzas:
+        out += _CODED_DOUBLE.pack(_SIZE_CODES[pizza.size], pizza.price)
+        _pack_string(out, pizza.description)
+        _pack_length(out, len(pizza.ingredients))
+        for ingredient in pizza.ingredients:
+            _pack_string(out, ingredient.unit_of_measure)
+            _pack_string(out, ingredient.name)
+            out += _CODED_DOUBLE.pack(_TYPE_CODES[ingredient.type], ingredient.price_per_unit)
+    return bytes(out)
+
+
+def _read_length(data: bytes, position: int) -> Tuple[int, int]:
+    """The varint at position and the position after it; IndexError when the data ends inside it."""
+    value = data[position]
+    position += 1
+    if value < 128:
+        return value, position
+    value &= 0x7F
+    shift = 7
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 128:
+            return value, position
+        shift += 7
+
+
+def decode_binary(data: Union[bytes, bytearray, memoryview]) -> Tuple[str, Order]:
+    data = bytes(data)
+    return _decode_binary(data, 0, len(data))
+
+
+def _decode_binary(data: bytes, start: int, end: int) -> Tuple[str, Order]:
+    if end - start < _HEADER.size:
+        raise CodecError('binary message is shorter than its header')
+    magic, version, message_type = _HEADER.unpack_from(data, start)
+    if magic != MAGIC:
+        raise CodecError('not a binary pizza message')
+    if version > SCHEMA_VERSION:
+        raise CodecError(f'binary message has schema version {version}, this codec reads up to {SCHEMA_VERSION}')
+    try:
+        message_type = MESSAGE_TYPES[message_type]
+        order, position = _read_order(data, start + _HEADER.size)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise CodecError(f'corrupt binary message: {e}') from e
+    if position > end:
+        raise CodecError('corrupt binary message: a field runs past the end of the message')
+    if position < end:
+        raise CodecError(f'{end - position} bytes left over after the binary message')
+    return message_type, order
+
+
+def _read_order(data: bytes, position: int) -> Tuple[Order, int]:
+    # the reads are written out in one function, a call per field cost more than the field itself. Lengths
+    # below 128 are one byte; slices past the end come back short, the caller checks the final position
+    unpack_coded_double = _CODED_DOUBLE.unpack_from
+    coded_double_size = _CODED_DOUBLE.size
+
+    size = data[position]
+    position += 1
+    if size > 127:
+        size, position = _read_length(data, position - 1)
+    order_id = data[position:position + size].decode()
+    position += size
+    size = data[position]
+    position += 1
+    if size > 127:
+        size, position = _read_length(data, position - 1)
+    recipient_name = data[position:position + size].decode()
+    position += size
+
+    pizza_count = data[position]
+    position += 1
+    if pizza_count > 127:
+        pizza_count, position = _read_length(data, position - 1)
+    pizzas = []
+    for _ in range(pizza_count):
+        size_code, price = unpack_coded_double(data, position)
+        position += coded_double_size
+        size = data[position]
+        position += 1
+        if size > 127:
+            size, position = _read_length(data, position - 1)
+        description = data[position:position + size].decode()
+        position += size
+
+        ingredient_count = data[position]
+        position += 1
+        if ingredient_count > 127:
+            ingredient_count, position = _read_length(data, position - 1)
+        ingredients = []
+        for _ in range(ingredient_count):
+            size = data[position]
+            position += 1
+            if size > 127:
+                size, position = _read_length(data, position - 1)
+            unit_of_measure = data[position:position + size].decode()
+            position += size
+            size = data[position]
+            position += 1
+            if size > 127:
+                size, position = _read_length(data, position - 1)
+            name = data[position:position + size].decode()
+            position += size
+            type_code, price_per_unit = unpack_coded_double(data, position)
+            position += coded_double_size
+            ingredients.append(construct(Ingredient, {
+                'unit_of_measure': unit_of_measure,
+                'name': name,
+                'type': TYPES[type_code],
+                'price_per_unit': price_per_unit,
+            }))
+        pizzas.append(construct(Pizza, {
+            'size': SIZES[size_code],
+            'price': price,
+            'description': description,
+            'ingredients': ingredients,
+        }))
+    return construct(Order, {'id': order_id, 'recipient_name': recipient_name, 'pizzas': pizzas}), position
+
+
+def encode_batch(orders: Iterable[Order], format: str = FORMAT_JSON) -> bytes:
+    if format == FORMAT_JSON:
+        return b''.join([encode_order(order) + b'\n' for order in orders])
+    if format == FORMAT_BINARY:
+        out = bytearray()
+        for order in orders:
+            message = encode_binary(order)
+            _pack_length(out, len(message))
+            out += message
+        return bytes(out)
+    raise ValueError(f'unknown format {format!r}, expected {FORMAT_JSON} or {FORMAT_BINARY}')
+
+
+def iter_decode_batch(chunks: Iterable[bytes], format: str = FORMAT_JSON) -> Iterator[Order]:
+    """
+    Decodes a batch from a stream of byte chunks, for example the pieces of a blob download, and yields
+    every order as soon as it is complete. Chunk boundaries may fall anywhere.
+    """
+    if format == FORMAT_JSON:
+        yield from _iter_decode_lines(chunks)
+    elif format == FORMAT_BINARY:
+        yield from _iter_decode_frames(chunks)
+    else:
+        raise ValueError(f'unknown format {format!r}, expected {FORMAT_JSON} or {FORMAT_BINARY}')
+
+
+def _iter_decode_lines(chunks: Iterable[bytes]) -> Iterator[Order]:
+    validate = adapter(Order).validate_json
+    # the start of a line that goes on in the next chunks; it is only split once its end has arrived, so
+    # a long line is not copied again for every chunk
+    buffer = bytearray()
+    for chunk in chunks:
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            buffer += chunk
+            continue
+        buffer += chunk[:end]
+        for line in buffer.split(b'\n'):
+            if line.strip():
+                yield _validate_line(validate, line)
+        buffer = bytearray(chunk[end + 1:])
+    if buffer.strip():
+        yield _validate_line(validate, buffer)
+
+
+def _validate_line(validate, line: bytes) -> Order:
+    try:
+        return validate(line)
+    except ValidationError as e:
+        raise CodecError(f'invalid order in batch: {e}') from e
+
+
+def _iter_decode_frames(chunks: Iterable[bytes]) -> Iterator[Order]:
+    buffer = bytearray()
+    # bytes the buffer needs before its first message can be complete, so a long message is not parsed
+    # again for every chunk
+    needed = 1
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < needed:
+            continue
+        data = bytes(buffer)
+        position = 0
+        while True:
+            try:
+                size, start = _read_length(data, position)
+            except IndexError:
+                needed = len(data) - position + 1
+                break
+            end = start + size
+            if end > len(data):
+                needed = end - position
+                break
+            yield _decode_binary(data, start, end)[1]
+            position = end
+        del buffer[:position]
+    if buffer:
+        raise CodecError(f'batch ends in the middle of a message, {len(buffer)} bytes left over')
@@ -1,73 +1,345 @@
+import argparse
+import json
+import re
 import sqlite3
-from pizza_library.models import Ingredient, Order, Pizza
+import threading
+import time
+import uuid
+import warnings
+from contextlib import contextmanager
+from pizza_library.models import Ingredient, Order, Pizza, SizeEnum, TypeEnum, construct
 from pydantic import BaseModel, parse_obj_as
 from enum import Enum
-from typing import List
+from itertools import islice
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
 import os
+
+DATABASE_PATH = os.environ.get('PIZZA_DATABASE_PATH', 'pizza_orders.db')
+# sqlite3 keeps this many parsed statements per connection, the default of 128 is shared by all queries
+STATEMENT_CACHE_SIZE = 512
+
+# number of orders converted to rows per executemany round, all inside one transaction
+INSERT_CHUNK_SIZE = 10_000
+
+
+class ConnectionManager:
+    """
+    Hands out one long-lived sqlite connection per thread, so request handlers neither pay for connecting
+    nor for re-parsing their statements. PRAGMAs are applied once, when a thread's connection is created.
+    """
+
+    def __init__(self, path: str = DATABASE_PATH, cached_statements: int = STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        # (name, unit_of_measure, type) -> ingredients.id, the catalogue is small and ids never change
+        self.ingredient_ids: Dict[tuple, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode: reads never hold a transaction open, writes go through transaction()
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                     cached_statements=self.cached_statements)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """Runs the block in one write transaction on this thread's connection, joining an open one."""
+        connection = self.connection()
+        if connection.in_transaction:
+            yield connection
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            # ingredient ids handed out inside the transaction are gone again
+            self.ingredient_ids.clear()
+            raise
+        connection.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        # connections of other threads are closed now, make them reconnect on next use
+        self._local = threading.local()
+        self.ingredient_ids.clear()
+
+
+_connection_manager: ConnectionManager = None
+_connection_manager_lock = threading.Lock()
+
+
+def get_connection_manager() -> ConnectionManager:
+    global _connection_manager
+    if _connection_manager is None:
+        with _connection_manager_lock:
+            if _connection_manager is None:
+                _connection_manager = ConnectionManager()
+    return _connection_manager
+
+
+def configure_database(path: str = DATABASE_PATH, cached_statements: int = STATEMENT_CACHE_SIZE) -> ConnectionManager:
+    """Points the module level functions at another database file, closing the connections to the old one."""
+    global _connection_manager
+    with _connection_manager_lock:
+        if _connection_manager is not None:
+            _connection_manager.close()
+        _connection_manager = ConnectionManager(path, cached_statements)
+    return _connection_manager
+
+
 # Enum and BaseModel definitions as per your schema
-def flush_database():
-    db_file = 'pizza_orders.db'
-    if os.path.exists(db_file):
-        os.remove(db_file)
+def flush_database(database: ConnectionManager = None):
+    database = database or get_connection_manager()
+    database.close()
+    for db_file in (database.path, database.path + '-wal', database.path + '-shm'):
+        if os.path.exists(db_file):
+            os.remove(db_file)
 # Database Initialization
-def initialize_database():
-    conn = sqlite3.connect('pizza_orders.db')
-    
-    cursor = conn.cursor()
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS ingredients (
-                        id INTEGER PRIMARY KEY,
-                        unit_of_measure TEXT,
-                        name TEXT,
-                        type TEXT,
-                        price_per_unit REAL)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS pizzas (
-                        id INTEGER PRIMARY KEY,
-                        size TEXT,
-                        price REAL,
-                        description TEXT)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS pizza_ingredients (
-                        pizza_id INTEGER,
-                        ingredient_id INTEGER,
-                        FOREIGN KEY(pizza_id) REFERENCES pizzas(id),
-                        FOREIGN KEY(ingredient_id) REFERENCES ingredients(id))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
-                        id INTEGER PRIMARY KEY,
-                        recipient_name TEXT,
-                        position INTEGER)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS order_items (
-                        order_id INTEGER,
-                        pizza_id INTEGER,
-                        FOREIGN KEY(order_id) REFERENCES orders(id),
-                        FOREIGN KEY(pizza_id) REFERENCES pizzas(id))''')
-
-    conn.commit()
-    conn.close()
+def initialize_database(database: ConnectionManager = None):
+    database = database or get_connection_manager()
+    with database.transaction() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS ingredients (
+                            id INTEGER PRIMARY KEY,
+                            unit_of_measure TEXT,
+                            name TEXT,
+                            type TEXT,
+                            price_per_unit REAL)''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS pizzas (
+                            id INTEGER PRIMARY KEY,
+                            size TEXT,
+                            price REAL,
+                            description TEXT)''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS pizza_ingredients (
+                            pizza_id INTEGER,
+                            ingredient_id INTEGER,
+                            price_per_unit REAL,
+                            FOREIGN KEY(pizza_id) REFERENCES pizzas(id),
+                            FOREIGN KEY(ingredient_id) REFERENCES ingredients(id))''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
+                            id INTEGER PRIMARY KEY,
+                            uid TEXT,
+                            recipient_name TEXT,
+                            position INTEGER)''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS order_items (
+                            order_id INTEGER,
+                            pizza_id INTEGER,
+                            FOREIGN KEY(order_id) REFERENCES orders(id),
+                            FOREIGN KEY(pizza_id) REFERENCES pizzas(id))''')
+
+        _migrate(cursor)
+        cursor.close()
+
+
+# The sales aggregates are kept up to date by insert_orders: every committed range of order ids is folded
+# into the summary tables inside the same transaction, reports then only read one row per bucket.
+MAX_ORDER_ID = 2 ** 63 - 1
+
+UPDATE_SALES_BY_SIZE_QUERY = """
+        INSERT INTO sales_by_size (size, pizzas, revenue)
+        SELECT p.size, COUNT(*), SUM(p.price)
+        FROM order_items oi
+        JOIN pizzas p ON oi.pizza_id = p.id
+        WHERE oi.order_id BETWEEN ? AND ?
+        GROUP BY p.size
+        ON CONFLICT (size) DO UPDATE SET pizzas = pizzas + excluded.pizzas, revenue = revenue + excluded.revenue
+    """
+
+# a pizza counts once for every ingredient type it contains
+UPDATE_SALES_BY_INGREDIENT_TYPE_QUERY = """
+        INSERT INTO sales_by_ingredient_type (type, pizzas, revenue)
+        SELECT t.type, COUNT(*), SUM(t.price)
+        FROM (SELECT DISTINCT p.id, p.price, i.type
+              FROM order_items oi
+              JOIN pizzas p ON oi.pizza_id = p.id
+              JOIN pizza_ingredients pi ON p.id = pi.pizza_id
+              JOIN ingredients i ON pi.ingredient_id = i.id
+              WHERE oi.order_id BETWEEN ? AND ?) t
+        GROUP BY t.type
+        ON CONFLICT (type) DO UPDATE SET pizzas = pizzas + excluded.pizzas, revenue = revenue + excluded.revenue
+    """
+
+UPDATE_SALES_BY_HOUR_QUERY = """
+        INSERT INTO sales_by_hour (hour, orders, pizzas, revenue)
+        SELECT strftime('%Y-%m-%dT%H:00:00Z', o.created_at, 'unixepoch'), COUNT(DISTINCT o.id),
+               COUNT(p.id), COALESCE(SUM(p.price), 0)
+        FROM orders o
+        LEFT JOIN order_items oi ON o.id = oi.order_id
+        LEFT JOIN pizzas p ON oi.pizza_id = p.id
+        WHERE o.id BETWEEN ? AND ? AND o.created_at IS NOT NULL
+        GROUP BY 1
+        ON CONFLICT (hour) DO UPDATE SET orders = orders + excluded.orders, pizzas = pizzas + excluded.pizzas,
+                                         revenue = revenue + excluded.revenue
+    """
+
+
+ADD_SALES_BY_SIZE_QUERY = """
+        INSERT INTO sales_by_size (size, pizzas, revenue) VALUES (?, ?, ?)
+        ON CONFLICT (size) DO UPDATE SET pizzas = pizzas + excluded.pizzas, revenue = revenue + excluded.revenue
+    """
+
+ADD_SALES_BY_INGREDIENT_TYPE_QUERY = """
+        INSERT INTO sales_by_ingredient_type (type, pizzas, revenue) VALUES (?, ?, ?)
+        ON CONFLICT (type) DO UPDATE SET pizzas = pizzas + excluded.pizzas, revenue = revenue + excluded.revenue
+    """
+
+ADD_SALES_BY_HOUR_QUERY = """
+        INSERT INTO sales_by_hour (hour, orders, pizzas, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT (hour) DO UPDATE SET orders = orders + excluded.orders, pizzas = pizzas + excluded.pizzas,
+                                         revenue = revenue + excluded.revenue
+    """
+
+
+def _refresh_sales_aggregates(cursor, first_order_id: int, last_order_id: int):
+    """Folds the orders with ids in the range into the aggregates, reading them back from the tables."""
+    for query in (UPDATE_SALES_BY_SIZE_QUERY, UPDATE_SALES_BY_INGREDIENT_TYPE_QUERY, UPDATE_SALES_BY_HOUR_QUERY):
+        cursor.execute(query, (first_order_id, last_order_id))
+
+
+def _add_column(table: str, column: str, definition: str):
+    """Migration step for a column that newer CREATE TABLE statements already have, so fresh files skip it."""
+    def step(cursor):
+        if column not in {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+# the price an ingredient had in an order, for rows written before pizza_ingredients kept it
+BACKFILL_INGREDIENT_PRICES = '''UPDATE pizza_ingredients SET price_per_unit = (
+               SELECT i.price_per_unit FROM ingredients i WHERE i.id = pizza_ingredients.ingredient_id)
+           WHERE price_per_unit IS NULL'''
+
+
+# Schema migrations, applied in order on top of the tables above. PRAGMA user_version holds the number of
+# migrations a database file already has, so append new steps and never edit the released ones. A step is
+# either a statement or a function taking the cursor.
+MIGRATIONS = [
+    # 1: intern ingredients on (name, unit_of_measure, type), relinking pizzas to the surviving row
+    (
+        '''UPDATE pizza_ingredients SET ingredient_id = (
+               SELECT MIN(duplicate.id)
+               FROM ingredients original
+               JOIN ingredients duplicate ON duplicate.name IS original.name
+                   AND duplicate.unit_of_measure IS original.unit_of_measure
+                   AND duplicate.type IS original.type
+               WHERE original.id = pizza_ingredients.ingredient_id)
+           WHERE ingredient_id IN (SELECT id FROM ingredients)''',
+        '''DELETE FROM ingredients
+           WHERE id NOT IN (SELECT MIN(id) FROM ingredients GROUP BY name, unit_of_measure, type)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_ingredients_identity
+           ON ingredients (name, unit_of_measure, type)''',
+    ),
+    # 2: covering indexes for both directions of the join tables, so order lookups stop scanning them
+    (
+        "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id, pizza_id)",
+        "CREATE INDEX IF NOT EXISTS idx_order_items_pizza ON order_items (pizza_id, order_id)",
+        "CREATE INDEX IF NOT EXISTS idx_pizza_ingredients_pizza ON pizza_ingredients (pizza_id, ingredient_id)",
+        "CREATE INDEX IF NOT EXISTS idx_pizza_ingredients_ingredient ON pizza_ingredients (ingredient_id, pizza_id)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_recipient_name ON orders (recipient_name)",
+    ),
+    # 3: order timestamps and the incrementally maintained sales aggregates, backfilled from the history
+    (
+        "ALTER TABLE orders ADD COLUMN created_at REAL",
+        '''CREATE TABLE IF NOT EXISTS sales_by_size (
+               size TEXT PRIMARY KEY,
+               pizzas INTEGER NOT NULL,
+               revenue REAL NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS sales_by_ingredient_type (
+               type TEXT PRIMARY KEY,
+               pizzas INTEGER NOT NULL,
+               revenue REAL NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS sales_by_hour (
+               hour TEXT PRIMARY KEY,
+               orders INTEGER NOT NULL,
+               pizzas INTEGER NOT NULL,
+               revenue REAL NOT NULL)''',
+        lambda cursor: _refresh_sales_aggregates(cursor, 0, MAX_ORDER_ID),
+    ),
+    # 4: the uuid of the order, files created before it was part of the orders table lack it
+    (
+        _add_column('orders', 'uid', 'TEXT'),
+    ),
+    # 5: the price of an ingredient in an order, kept with the order from now on. Migration 1 merged the
+    #    duplicate ingredients of older files without keeping their prices, so their orders get the price of
+    #    the surviving row: the prices those orders were placed with are lost for merged ingredients
+    (
+        _add_column('pizza_ingredients', 'price_per_unit', 'REAL'),
+        BACKFILL_INGREDIENT_PRICES,
+    ),
+]
+
+
+def _migrate(cursor):
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            if callable(statement):
+                statement(cursor)
+            else:
+                cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {number}")
 
 # Add Data Models here
 
 # Further implementations for CRUD operations and Business Logic
 
-def get_order(cursor, order_id: int) -> Order:
-    query = """
-        SELECT o.recipient_name, o.position,
+GET_ORDER_QUERY = """
+        SELECT o.uid, o.recipient_name, o.position,
                p.id as pizza_id, p.size, p.price, p.description,
-               i.unit_of_measure, i.name, i.type, i.price_per_unit
+               i.unit_of_measure, i.name, i.type, pi.price_per_unit
         FROM orders o
         JOIN order_items oi ON o.id = oi.order_id
         JOIN pizzas p ON oi.pizza_id = p.id
         LEFT JOIN pizza_ingredients pi ON p.id = pi.pizza_id
         LEFT JOIN ingredients i ON pi.ingredient_id = i.id
         WHERE o.id = ?
+        ORDER BY p.id, pi.rowid
     """
 
-    cursor.execute(query, (order_id,))
-    rows = cursor.fetchall()
 
+def get_order_by_id(order_id: int, database: ConnectionManager = None) -> Order:
+    database = database or get_connection_manager()
+    return _order_from_rows(database.connection().execute(GET_ORDER_QUERY, (order_id,)).fetchall())
+
+
+def get_order(cursor, order_id: int) -> Order:
+    """
+    Looks the order up on the caller's cursor, whose connection has sqlite3.Row as its row factory.
+    Deprecated: get_order_by_id uses the shared per-thread connection instead.
+    """
+    warnings.warn('get_order(cursor, order_id) is deprecated, use get_order_by_id(order_id)', DeprecationWarning,
+                  stacklevel=2)
+    cursor.execute(GET_ORDER_QUERY, (order_id,))
+    return _order_from_rows(cursor.fetchall())
+
+
+def _order_from_rows(rows) -> Order:
     # Processing the result to build the Order object
     if not rows:
         return None  # or raise an exception
@@ -92,12 +364,276 @@ def get_order(cursor, order_id: int) -> Order:
             pizzas[pizza_id]['ingredients'].append(ingredient)
 
     pizza_objs = [Pizza(**pizza) for pizza in pizzas.values()]
-    return Order(recipient_name=rows[0]['recipient_name'], position=rows[0]['position'], pizzas=pizza_objs)
+    order = dict(recipient_name=rows[0]['recipient_name'], position=rows[0]['position'], pizzas=pizza_objs)
+    if rows[0]['uid']:
+        order['id'] = rows[0]['uid']
+    return Order(**order)
+
+
+# the batch loaders bind any number of ids as one json array parameter, so the statements stay cacheable
+GET_ORDERS_QUERY = """
+        SELECT o.id, o.uid, o.recipient_name, o.position
+        FROM orders o
+        WHERE o.id IN (SELECT value FROM json_each(?))
+    """
+
+GET_ORDERS_PIZZAS_QUERY = """
+        SELECT oi.order_id, p.id as pizza_id, p.size, p.price, p.description
+        FROM order_items oi
+        JOIN pizzas p ON oi.pizza_id = p.id
+        WHERE oi.order_id IN (SELECT value FROM json_each(?))
+        ORDER BY p.id
+    """
+
+GET_ORDERS_INGREDIENTS_QUERY = """
+        SELECT pi.pizza_id, i.unit_of_measure, i.name, i.type, pi.price_per_unit
+        FROM order_items oi
+        JOIN pizza_ingredients pi ON oi.pizza_id = pi.pizza_id
+        JOIN ingredients i ON pi.ingredient_id = i.id
+        WHERE oi.order_id IN (SELECT value FROM json_each(?))
+        ORDER BY pi.rowid
+    """
+
+
+class OrderFilter(BaseModel):
+    recipient_name: Optional[str] = None
+    min_id: Optional[int] = None
+    max_id: Optional[int] = None
+
+    def where_clause(self):
+        conditions, params = [], []
+        if self.recipient_name is not None:
+            conditions.append("recipient_name = ?")
+            params.append(self.recipient_name)
+        if self.min_id is not None:
+            conditions.append("id >= ?")
+            params.append(self.min_id)
+        if self.max_id is not None:
+            conditions.append("id <= ?")
+            params.append(self.max_id)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+# the stored strings of the enums, rows are turned back into members without validating them
+_SIZES_BY_VALUE = {size.value: size for size in SizeEnum}
+_TYPES_BY_VALUE = {type_.value: type_ for type_ in TypeEnum}
 
 
-def insert_sample_data():
-    connection = sqlite3.connect('pizza_orders.db')
+def _load_orders(connection: sqlite3.Connection, order_ids: List[int]) -> Dict[int, Order]:
+    ids = json.dumps(order_ids)
+    # plain tuples, sqlite3.Row lookups by name dominate the cost of large batches
     cursor = connection.cursor()
+    cursor.row_factory = None
+    try:
+        orders = {}
+        for order_id, uid, recipient_name, _ in cursor.execute(GET_ORDERS_QUERY, (ids,)):
+            # rows of before orders had a uid get a new one, like Order does
+            orders[order_id] = {'id': uid or str(uuid.uuid4()), 'recipient_name': recipient_name, 'pizzas': []}
+        if not orders:
+            return {}
+
+        ingredients = {}
+        for order_id, pizza_id, size, price, description in cursor.execute(GET_ORDERS_PIZZAS_QUERY, (ids,)):
+            ingredients[pizza_id] = []
+            orders[order_id]['pizzas'].append(construct(Pizza, {
+                'size': _SIZES_BY_VALUE[size],
+                'price': price,
+                'description': description,
+                'ingredients': ingredients[pizza_id],
+            }))
+
+        for pizza_id, unit_of_measure, name, type_, price_per_unit in cursor.execute(GET_ORDERS_INGREDIENTS_QUERY,
+                                                                                     (ids,)):
+            ingredients[pizza_id].append(construct(Ingredient, {
+                'unit_of_measure': unit_of_measure,
+                'name': name,
+                'type': _TYPES_BY_VALUE[type_],
+                'price_per_unit': price_per_unit,
+            }))
+    finally:
+        cursor.close()
+
+    # the rows were validated as models when they were stored, building them again skips validation
+    return {order_id: construct(Order, order) for order_id, order in orders.items()}
+
+
+def get_orders(order_ids: Iterable[int], database: ConnectionManager = None) -> Dict[int, Order]:
+    """
+    Loads any number of orders with three set based queries. Returns them by id, unknown ids are left out.
+    """
+    database = database or get_connection_manager()
+    return _load_orders(database.connection(), [int(order_id) for order_id in order_ids])
+
+
+ITER_ORDERS_QUERY = "SELECT id FROM orders{where} ORDER BY id"
+
+
+def iter_orders(order_filter: OrderFilter = None, chunk_size: int = 1_000,
+                database: ConnectionManager = None) -> Iterator[Order]:
+    """
+    Streams the matching orders in id order. Ids are fetched chunk_size at a time from an open cursor and
+    every chunk is loaded with get_orders, so memory stays bounded by the chunk size.
+    """
+    database = database or get_connection_manager()
+    connection = database.connection()
+    where, params = (order_filter or OrderFilter()).where_clause()
+    cursor = connection.execute(ITER_ORDERS_QUERY.format(where=where), params)
+    try:
+        while rows := cursor.fetchmany(chunk_size):
+            orders = _load_orders(connection, [row[0] for row in rows])
+            for row in rows:
+                if row[0] in orders:
+                    yield orders[row[0]]
+    finally:
+        cursor.close()
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _next_id(cursor, table: str) -> int:
+    return cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+
+UPSERT_INGREDIENT_QUERY = """
+        INSERT INTO ingredients (unit_of_measure, name, type, price_per_unit) VALUES (?, ?, ?, ?)
+        ON CONFLICT (name, unit_of_measure, type) DO NOTHING
+    """
+
+GET_INGREDIENT_IDS_QUERY = """
+        SELECT i.id, i.name, i.unit_of_measure, i.type
+        FROM json_each(?) k
+        JOIN ingredients i ON i.name = json_extract(k.value, '$[0]')
+            AND i.unit_of_measure = json_extract(k.value, '$[1]')
+            AND i.type = json_extract(k.value, '$[2]')
+    """
+
+
+def _ingredient_key(ingredient: Ingredient) -> tuple:
+    return ingredient.name, ingredient.unit_of_measure, ingredient.type.value
+
+
+def _intern_ingredients(cursor, database: ConnectionManager, ingredients: Iterable[Ingredient]):
+    known = database.ingredient_ids
+    missing = {}
+    for ingredient in ingredients:
+        key = _ingredient_key(ingredient)
+        if key not in known and key not in missing:
+            missing[key] = (ingredient.unit_of_measure, ingredient.name, ingredient.type.value,
+                            ingredient.price_per_unit)
+    if not missing:
+        return
+    cursor.executemany(UPSERT_INGREDIENT_QUERY, missing.values())
+    for row in cursor.execute(GET_INGREDIENT_IDS_QUERY, (json.dumps(list(missing)),)):
+        known[(row[1], row[2], row[3])] = row[0]
+
+
+def upsert_ingredients(ingredients: Iterable[Ingredient], database: ConnectionManager = None) -> List[int]:
+    """
+    Interns the ingredients and returns their ids. An ingredient is identified by name, unit of measure and
+    type, the catalogue keeps the price it was first stored with; the price of an ingredient in an order is
+    kept with the order, in pizza_ingredients.
+    """
+    database = database or get_connection_manager()
+    ingredients = list(ingredients)
+    with database.transaction() as connection:
+        cursor = connection.cursor()
+        try:
+            _intern_ingredients(cursor, database, ingredients)
+        finally:
+            cursor.close()
+    return [database.ingredient_ids[_ingredient_key(ingredient)] for ingredient in ingredients]
+
+
+def insert_orders(orders: Iterable[Order], database: ConnectionManager = None) -> List[int]:
+    """
+    Writes the full order/pizza/ingredient graphs in a single transaction and returns the generated order ids.
+
+    The write lock is taken up front (BEGIN IMMEDIATE), so primary keys can be handed out in python and
+    every table is filled with one executemany per chunk instead of one statement per row. Ingredients are
+    interned through the in-process id cache, only ones never seen before cost a round trip.
+    """
+    database = database or get_connection_manager()
+    with database.transaction() as connection:
+        cursor = connection.cursor()
+        try:
+            return _insert_order_graphs(cursor, database, orders)
+        finally:
+            cursor.close()
+
+
+def _insert_order_graphs(cursor, database: ConnectionManager, orders: Iterable[Order]) -> List[int]:
+    order_id = _next_id(cursor, 'orders')
+    pizza_id = _next_id(cursor, 'pizzas')
+    ingredient_ids = database.ingredient_ids
+    created_at = time.time()
+    order_ids = []
+
+    for chunk in _chunked(orders, INSERT_CHUNK_SIZE):
+        _intern_ingredients(cursor, database, (ingredient
+                                               for order in chunk
+                                               for pizza in order.pizzas
+                                               for ingredient in pizza.ingredients))
+        order_rows, order_items = [], []
+        pizza_rows, pizza_ingredients = [], []
+        for order in chunk:
+            order_rows.append((order_id, order.id, order.recipient_name, created_at))
+            order_ids.append(order_id)
+            for pizza in order.pizzas:
+                pizza_rows.append((pizza_id, pizza.size.value, pizza.price, pizza.description))
+                order_items.append((order_id, pizza_id))
+                for ingredient in pizza.ingredients:
+                    pizza_ingredients.append((pizza_id, ingredient_ids[_ingredient_key(ingredient)],
+                                              ingredient.price_per_unit))
+                pizza_id += 1
+            order_id += 1
+
+        cursor.executemany("INSERT INTO orders (id, uid, recipient_name, created_at) VALUES (?, ?, ?, ?)",
+                           order_rows)
+        cursor.executemany("INSERT INTO pizzas (id, size, price, description) VALUES (?, ?, ?, ?)", pizza_rows)
+        cursor.executemany("INSERT INTO order_items (order_id, pizza_id) VALUES (?, ?)", order_items)
+        cursor.executemany("INSERT INTO pizza_ingredients (pizza_id, ingredient_id, price_per_unit) "
+                           "VALUES (?, ?, ?)", pizza_ingredients)
+        _add_to_sales_aggregates(cursor, chunk, created_at)
+
+    return order_ids
+
+
+def _add_to_sales_aggregates(cursor, orders: List[Order], created_at: float):
+    # same numbers _refresh_sales_aggregates would compute, but from the models at hand instead of reading
+    # the freshly written rows back
+    by_size, by_type = {}, {}
+    pizzas, revenue = 0, 0.0
+    for order in orders:
+        for pizza in order.pizzas:
+            pizzas += 1
+            revenue += pizza.price
+            bucket = by_size.setdefault(pizza.size.value, [0, 0.0])
+            bucket[0] += 1
+            bucket[1] += pizza.price
+            for ingredient_type in {ingredient.type.value for ingredient in pizza.ingredients}:
+                bucket = by_type.setdefault(ingredient_type, [0, 0.0])
+                bucket[0] += 1
+                bucket[1] += pizza.price
+    cursor.executemany(ADD_SALES_BY_SIZE_QUERY, [(size, *bucket) for size, bucket in by_size.items()])
+    cursor.executemany(ADD_SALES_BY_INGREDIENT_TYPE_QUERY, [(type_, *bucket) for type_, bucket in by_type.items()])
+    hour = _hour_bucket(datetime.fromtimestamp(created_at, timezone.utc))
+    cursor.execute(ADD_SALES_BY_HOUR_QUERY, (hour, len(orders), pizzas, revenue))
+
+
+def insert_sample_data(database: ConnectionManager = None):
+    database = database or get_connection_manager()
+    with database.transaction() as connection:
+        cursor = connection.cursor()
+        order_id = _insert_sample_data(cursor)
+        cursor.close()
+    return order_id
+
+
+def _insert_sample_data(cursor):
 
     # Inserting sample ingredients
     ingredients = [
@@ -105,7 +641,7 @@ def insert_sample_data():
         ("Piece", "Cheese", "Cheese", 0.75),
         ("Gram", "Pepperoni", "Meat", 1.0),
     ]
-    cursor.executemany("INSERT INTO ingredients (unit_of_measure, name, type, price_per_unit) VALUES (?, ?, ?, ?)", ingredients)
+    cursor.executemany(UPSERT_INGREDIENT_QUERY, ingredients)
 
     # Inserting sample pizza
     pizza = ("Medium", 15.0, "Pepperoni Pizza")
@@ -113,39 +649,155 @@ def insert_sample_data():
     pizza_id = cursor.lastrowid
 
     # Linking pizza with ingredients
-    ingredient_ids = cursor.execute("SELECT id FROM ingredients").fetchall()
-    pizza_ingredients = [(pizza_id, ingredient_id[0]) for ingredient_id in ingredient_ids]
-    cursor.executemany("INSERT INTO pizza_ingredients (pizza_id, ingredient_id) VALUES (?, ?)", pizza_ingredients)
+    ingredients = cursor.execute("SELECT id, price_per_unit FROM ingredients").fetchall()
+    pizza_ingredients = [(pizza_id, ingredient_id, price_per_unit) for ingredient_id, price_per_unit in ingredients]
+    cursor.executemany("INSERT INTO pizza_ingredients (pizza_id, ingredient_id, price_per_unit) VALUES (?, ?, ?)",
+                       pizza_ingredients)
 
     # Inserting sample order
-    order = ("John Doe", 1)
-    cursor.execute("INSERT INTO orders (recipient_name, position) VALUES (?, ?)", order)
+    order = ("John Doe", 1, time.time())
+    cursor.execute("INSERT INTO orders (recipient_name, position, created_at) VALUES (?, ?, ?)", order)
     order_id = cursor.lastrowid
 
     # Linking order with pizza
     order_item = (order_id, pizza_id)
     cursor.execute("INSERT INTO order_items (order_id, pizza_id) VALUES (?, ?)", order_item)
+    _refresh_sales_aggregates(cursor, order_id, order_id)
 
-    connection.commit()
-    cursor.close()
-    connection.close()
     return order_id
 
 
+class SalesBucket(BaseModel):
+    orders: Optional[int] = None
+    pizzas: int
+    revenue: float
+
+
+SALES_BY_SIZE_QUERY = "SELECT size, pizzas, revenue FROM sales_by_size"
+SALES_BY_INGREDIENT_TYPE_QUERY = "SELECT type, pizzas, revenue FROM sales_by_ingredient_type"
+SALES_BY_HOUR_QUERY = "SELECT hour, orders, pizzas, revenue FROM sales_by_hour WHERE hour BETWEEN ? AND ? ORDER BY hour"
+
+
+def _hour_bucket(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:00:00Z')
+
+
+def get_sales_by_size(database: ConnectionManager = None) -> Dict[SizeEnum, SalesBucket]:
+    database = database or get_connection_manager()
+    return {SizeEnum(row['size']): SalesBucket(pizzas=row['pizzas'], revenue=row['revenue'])
+            for row in database.connection().execute(SALES_BY_SIZE_QUERY)}
+
+
+def get_sales_by_ingredient_type(database: ConnectionManager = None) -> Dict[TypeEnum, SalesBucket]:
+    database = database or get_connection_manager()
+    return {TypeEnum(row['type']): SalesBucket(pizzas=row['pizzas'], revenue=row['revenue'])
+            for row in database.connection().execute(SALES_BY_INGREDIENT_TYPE_QUERY)}
+
+
+def get_sales_by_hour(since: datetime = None, until: datetime = None,
+                      database: ConnectionManager = None) -> Dict[str, SalesBucket]:
+    """Sales per UTC hour, keyed like 2024-01-31T18:00:00Z. since and until are inclusive."""
+    database = database or get_connection_manager()
+    params = (_hour_bucket(since) if since else '', _hour_bucket(until) if until else '~')
+    return {row['hour']: SalesBucket(orders=row['orders'], pizzas=row['pizzas'], revenue=row['revenue'])
+            for row in database.connection().execute(SALES_BY_HOUR_QUERY, params)}
+
+
+def rebuild_sales_aggregates(database: ConnectionManager = None):
+    """Recomputes all sales aggregates from the order history, for example after repairing data by hand."""
+    database = database or get_connection_manager()
+    with database.transaction() as connection:
+        cursor = connection.cursor()
+        for table in ('sales_by_size', 'sales_by_ingredient_type', 'sales_by_hour'):
+            cursor.execute(f"DELETE FROM {table}")
+        _refresh_sales_aggregates(cursor, 0, MAX_ORDER_ID)
+        cursor.close()
+
+
+class QueryPlanError(Exception):
+    pass
+
+
+# Every read query of this module with representative parameters and the tables (by alias) it is allowed to
+# scan. check_query_plans() fails as soon as a query falls back to a full scan or an automatic index.
+QUERY_PLAN_CHECKS = {
+    'get_order': (GET_ORDER_QUERY, (1,), ()),
+    'get_orders': (GET_ORDERS_QUERY, ('[1, 2]',), ()),
+    'get_orders_pizzas': (GET_ORDERS_PIZZAS_QUERY, ('[1, 2]',), ()),
+    'get_orders_ingredients': (GET_ORDERS_INGREDIENTS_QUERY, ('[1, 2]',), ()),
+    'get_ingredient_ids': (GET_INGREDIENT_IDS_QUERY, ('[["Tomato", "Gram", "Spice"]]',), ()),
+    'next_order_id': ("SELECT COALESCE(MAX(id), 0) + 1 FROM orders", (), ()),
+    # streaming every order is meant to walk the whole table, in primary key order
+    'iter_orders': (ITER_ORDERS_QUERY.format(where=''), (), ('orders',)),
+    'iter_orders_by_recipient': (ITER_ORDERS_QUERY.format(where=OrderFilter(recipient_name='x').where_clause()[0]),
+                                 ('x',), ()),
+    'iter_orders_by_id_range': (ITER_ORDERS_QUERY.format(where=OrderFilter(min_id=1, max_id=2).where_clause()[0]),
+                                (1, 2), ()),
+    'update_sales_by_size': (UPDATE_SALES_BY_SIZE_QUERY, (1, 2), ()),
+    # t is the materialized subquery of the chunk's pizzas, not a table
+    'update_sales_by_ingredient_type': (UPDATE_SALES_BY_INGREDIENT_TYPE_QUERY, (1, 2), ('t',)),
+    'update_sales_by_hour': (UPDATE_SALES_BY_HOUR_QUERY, (1, 2), ()),
+    # the summary tables hold one row per bucket, reading all of them is the point
+    'sales_by_size': (SALES_BY_SIZE_QUERY, (), ('sales_by_size',)),
+    'sales_by_ingredient_type': (SALES_BY_INGREDIENT_TYPE_QUERY, (), ('sales_by_ingredient_type',)),
+    'sales_by_hour': (SALES_BY_HOUR_QUERY, ('', '~'), ()),
+}
+
+_TABLE_SCAN = re.compile(r'^SCAN (\w+)\b(?! VIRTUAL TABLE)')
+
+
+def explain_query_plan(query: str, params=(), database: ConnectionManager = None) -> List[str]:
+    database = database or get_connection_manager()
+    return [row['detail'] for row in database.connection().execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+def check_query_plans(database: ConnectionManager = None) -> Dict[str, List[str]]:
+    """
+    Runs EXPLAIN QUERY PLAN for every entry of QUERY_PLAN_CHECKS and raises QueryPlanError listing all queries
+    that scan a table or need an automatic index. Returns the plans when all of them are fine.
+    """
+    plans, failures = {}, []
+    for name, (query, params, allowed_scans) in QUERY_PLAN_CHECKS.items():
+        plans[name] = explain_query_plan(query, params, database)
+        for detail in plans[name]:
+            scan = _TABLE_SCAN.match(detail)
+            if (scan and scan.group(1) not in allowed_scans) or 'AUTOMATIC' in detail:
+                failures.append(f'{name}: {detail}')
+    if failures:
+        raise QueryPlanError('query plans regressed to table scans:\n' + '\n'.join(failures))
+    return plans
+
+
 def main():
     order_id = insert_sample_data()
     print('inserted sample data with order id', order_id)
 
-    connection = sqlite3.connect('pizza_orders.db')
-    connection.row_factory = sqlite3.Row
-    cursor = connection.cursor()
-    order = get_order(cursor, order_id)
+    order = get_order_by_id(order_id)
     print(order)
 
-    cursor.close()
-    connection.close()
-
 if __name__ == "__main__":
-    flush_database()
-    initialize_database()
-    main()
+    parser = argparse.ArgumentParser(description='pizza order database')
+    parser.add_argument('command', nargs='?', default='demo', choices=['demo', 'check-plans', 'rebuild-aggregates'])
+    parser.add_argument('--path', default=None,
+                        help='database file, check-plans uses a fresh in-memory database by default')
+    args = parser.parse_args()
+    if args.command == 'check-plans':
+        configure_database(args.path or ':memory:')
+        initialize_database()
+        for name, plan in check_query_plans().items():
+            print(name)
+            for detail in plan:
+                print('   ', detail)
+    elif args.command == 'rebuild-aggregates':
+        if args.path:
+            configure_database(args.path)
+        initialize_database()
+        rebuild_sales_aggregates()
+        for size, bucket in get_sales_by_size().items():
+            print(size.value, bucket)
+    else:
+        if args.path:
+            configure_database(args.path)
+        flush_database()
+        initialize_database()
+        main()
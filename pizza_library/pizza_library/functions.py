@@ -1,11 +1,20 @@
 import asyncio
+import contextvars
+import multiprocessing
+import os
 import random
+import sys
+import threading
 import time
-from multiprocessing import Pool
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterator, Union
 
-from opentelemetry import trace
+from opentelemetry import context, metrics, propagate, trace
 
-from pizza_library.models import Order, SizeEnum, TypeEnum, Ingredient, Pizza
+from pizza_library import tracing
+from pizza_library.models import Order, SizeEnum, TypeEnum, Ingredient, Pizza, construct
 
 
 def create_random_order() -> Order:
@@ -34,19 +43,448 @@ def create_random_order() -> Order:
     return order
 
 
-tracer = trace.get_tracer(__name__)
+# orders drawn per round of vectorized sampling in create_random_orders
+BULK_CHUNK_SIZE = 10_000
+_SIZES = list(SizeEnum)
+_TYPES = list(TypeEnum)
+_UNITS = ['grams', 'pieces']
+_MAX_INGREDIENTS = 5
+_MAX_PIZZAS = 4
+# prices are drawn in whole cents, like a menu has them, so every value comes from a small table
+_UNIT_PRICE_CENTS = range(50, 301)
+_PIZZA_PRICE_CENTS = range(500, 2001)
+_PRICES = [cents / 100 for cents in range(_PIZZA_PRICE_CENTS.stop)]
+_INGREDIENT_NAMES = [f'Ingredient {i}' for i in range(_MAX_INGREDIENTS)]
+_PIZZA_DESCRIPTIONS = [f'Pizza {i}' for i in range(_MAX_PIZZAS)]
+
+
+def create_random_orders(n: int, seed: int = None, as_json: bool = False,
+                         chunk_size: int = BULK_CHUNK_SIZE) -> Iterator[Union[Order, bytes]]:
+    """
+    Generates n random orders shaped like create_random_order ones, for load and replay jobs. Prices are
+    whole cents.
+
+    All random draws of a chunk happen in a few vectorized NumPy calls and models are built without
+    validation. With as_json the orders are yielded as the bytes model_dump_json would produce, put together
+    from precomputed JSON of every ingredient and pizza that can be drawn, without building models at all.
+    The same seed, n and chunk_size always yield the same orders, ids included. A chunk draws each field for
+    all of its orders at once, so another n or chunk_size gives other orders, not more or fewer of the same
+    ones.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    while n > 0:
+        count = min(chunk_size, n)
+        yield from _random_order_chunk(np, rng, count, as_json)
+        n -= count
+
+
+@lru_cache(maxsize=None)
+def _json_fragments(np):
+    """
+    The JSON of every ingredient and of the start of every pizza create_random_orders can draw, as object
+    arrays indexed by the codes _random_order_chunk computes.
+    """
+    prices = [repr(price) for price in _PRICES]
+    ingredients = [f'{{"unit_of_measure":"{unit}","name":"{name}","type":"{type_.value}",'
+                   f'"price_per_unit":{prices[cents]}}}'
+                   for unit in _UNITS for name in _INGREDIENT_NAMES for type_ in _TYPES
+                   for cents in _UNIT_PRICE_CENTS]
+    pizzas = [f'{{"size":"{size.value}","price":{prices[cents]},"description":"{description}","ingredients":['
+              for size in _SIZES for description in _PIZZA_DESCRIPTIONS for cents in _PIZZA_PRICE_CENTS]
+    return np.array(ingredients, dtype=object), np.array(pizzas, dtype=object)
+
+
+def _random_order_chunk(np, rng, count: int, as_json: bool):
+    ingredient_counts = rng.integers(1, _MAX_INGREDIENTS + 1, size=count)
+    pizza_counts = rng.integers(1, _MAX_PIZZAS + 1, size=count)
+    total_ingredients = int(ingredient_counts.sum())
+    total_pizzas = int(pizza_counts.sum())
+
+    units = rng.integers(0, len(_UNITS), size=total_ingredients)
+    types = rng.integers(0, len(_TYPES), size=total_ingredients)
+    unit_prices = rng.integers(_UNIT_PRICE_CENTS.start, _UNIT_PRICE_CENTS.stop, size=total_ingredients)
+    sizes = rng.integers(0, len(_SIZES), size=total_pizzas)
+    prices = rng.integers(_PIZZA_PRICE_CENTS.start, _PIZZA_PRICE_CENTS.stop, size=total_pizzas)
+
+    # every pizza takes a random subset of its order's ingredients, like random.sample: rank random keys
+    # and push the slots the order does not have to the back
+    available = np.repeat(ingredient_counts, pizza_counts)
+    picks = rng.integers(1, available + 1).tolist()
+    keys = rng.random((total_pizzas, _MAX_INGREDIENTS))
+    keys[np.arange(_MAX_INGREDIENTS) >= available[:, None]] = 2.0
+    rankings = np.argsort(keys, axis=1)
+
+    # random uuid4s: set the version and variant bits on the whole chunk at once
+    ids = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    ids[:, 6] = ids[:, 6] & 0x0F | 0x40
+    ids[:, 8] = ids[:, 8] & 0x3F | 0x80
+    hexes = ids.tobytes().hex()
+    order_ids = [f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+                 for h in (hexes[32 * i:32 * i + 32] for i in range(count))]
+
+    # position of every ingredient and pizza within its order, for the names and descriptions
+    first_ingredients = np.cumsum(ingredient_counts) - ingredient_counts
+    ingredient_numbers = np.arange(total_ingredients) - np.repeat(first_ingredients, ingredient_counts)
+    first_pizzas = np.cumsum(pizza_counts) - pizza_counts
+    pizza_numbers = np.arange(total_pizzas) - np.repeat(first_pizzas, pizza_counts)
+    pizza_ends = (first_pizzas + pizza_counts).tolist()
+    first_pizzas = first_pizzas.tolist()
+
+    if as_json:
+        ingredient_json, pizza_json = _json_fragments(np)
+        codes = ((units * _MAX_INGREDIENTS + ingredient_numbers) * len(_TYPES) + types) * len(_UNIT_PRICE_CENTS) \
+            + unit_prices - _UNIT_PRICE_CENTS.start
+        ingredients = ingredient_json[codes].tolist()
+        codes = (sizes * _MAX_PIZZAS + pizza_numbers) * len(_PIZZA_PRICE_CENTS) + prices - _PIZZA_PRICE_CENTS.start
+        # the rankings as indexes into the ingredients of the whole chunk
+        rankings = (rankings + np.repeat(first_ingredients, pizza_counts)[:, None]).tolist()
+        pizzas = [head + ','.join([ingredients[slot] for slot in ranking[:pick]]) + ']}'
+                  for head, ranking, pick in zip(pizza_json[codes].tolist(), rankings, picks)]
+        for order_id, first, end in zip(order_ids, first_pizzas, pizza_ends):
+            yield f'{{"id":"{order_id}","recipient_name":"John Doe","pizzas":[{",".join(pizzas[first:end])}]}}'.encode()
+        return
+
+    # built order by order, so that only the orders the caller keeps stay alive
+    ingredient_fields = list(zip(units.tolist(), ingredient_numbers.tolist(), types.tolist(), unit_prices.tolist()))
+    pizza_fields = list(zip(sizes.tolist(), prices.tolist(), pizza_numbers.tolist(), rankings.tolist(), picks))
+    first_ingredients = first_ingredients.tolist()
+    for order_id, first_ingredient, ingredient_count, first, end in zip(
+            order_ids, first_ingredients, ingredient_counts.tolist(), first_pizzas, pizza_ends):
+        own = [
+            construct(Ingredient, {
+                'unit_of_measure': _UNITS[unit],
+                'name': _INGREDIENT_NAMES[number],
+                'type': _TYPES[type_],
+                'price_per_unit': _PRICES[cents],
+            })
+            for unit, number, type_, cents in ingredient_fields[first_ingredient:first_ingredient + ingredient_count]
+        ]
+        yield construct(Order, {
+            'id': order_id,
+            'recipient_name': 'John Doe',
+            'pizzas': [
+                construct(Pizza, {
+                    'size': _SIZES[size],
+                    'price': _PRICES[cents],
+                    'description': _PIZZA_DESCRIPTIONS[number],
+                    'ingredients': [own[slot] for slot in ranking[:pick]],
+                })
+                for size, cents, number, ranking, pick in pizza_fields[first:end]
+            ],
+        })
+
+
+tracer = tracing.get_tracer(__name__)
+
+
+PIZZA_KITCHEN_WORKERS = int(os.environ.get('PIZZA_KITCHEN_WORKERS', 0)) or os.cpu_count()
+# results of repeated inputs kept in the shop process, off by default: the steps are there to load the kitchen
+PIZZA_KITCHEN_CACHE_SIZE = int(os.environ.get('PIZZA_KITCHEN_CACHE_SIZE', 0))
+
+
+def _work_in_kitchen(function, args, carrier: dict):
+    # runs in a worker process, continuing the trace of the request that dispatched the step
+    token = context.attach(propagate.extract(carrier))
+    try:
+        with tracer.span(function.__name__):
+            return function(*args)
+    finally:
+        context.detach(token)
+
+
+class KitchenExecutor:
+    """
+    Long-lived process pool for the CPU-bound pizza steps, so they neither hold the GIL nor block the event
+    loop. The pool is started on first use and shared by the sync and async paths. With a cache_size, results
+    of repeated inputs come from an LRU cache without leaving the process.
+
+    initializer runs once in every worker, for example to set up telemetry there.
+    """
+
+    def __init__(self, workers: int = PIZZA_KITCHEN_WORKERS, cache_size: int = PIZZA_KITCHEN_CACHE_SIZE,
+                 initializer=None, initargs=()):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool: ProcessPoolExecutor = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawn: forking a process that runs exporter and server threads is not safe
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=self.initializer, initargs=self.initargs)
+        return self._pool
+
+    def submit(self, function, *args) -> Future:
+        key = (function.__module__, function.__qualname__, args) if self.cache_size else None
+        if key is not None:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    future = Future()
+                    future.set_result(self._cache[key])
+                    return future
+        carrier = {}
+        propagate.inject(carrier)
+        future = self._get_pool().submit(_work_in_kitchen, function, args, carrier)
+        if key is not None:
+            future.add_done_callback(lambda done: self._remember(key, done))
+        return future
+
+    def _remember(self, key, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            self._cache[key] = future.result()
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def run(self, function, *args):
+        return self.submit(function, *args).result()
+
+    async def run_async(self, function, *args):
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        if wait:
+            pool.shutdown()
+        else:
+            # the pool cancels its queued steps from its manager thread, which skips that for a pool nobody holds
+            threading.Thread(target=pool.shutdown, kwargs={'cancel_futures': True}, daemon=True).start()
+
+
+_kitchen: KitchenExecutor = None
+_kitchen_lock = threading.Lock()
+
+
+def _kitchen_telemetry() -> dict:
+    # spawned workers start without a tracer provider, the trace context they get would go nowhere without one
+    startup = sys.modules.get('pizza_library.startup')
+    if startup is None or startup.telemetry_settings is None:
+        return {}
+    return dict(initializer=startup.setup_worker_telemetry, initargs=(startup.telemetry_settings,))
+
+
+def get_kitchen() -> KitchenExecutor:
+    """The shared kitchen; its workers set up telemetry like this process did, if it did."""
+    global _kitchen
+    if _kitchen is None:
+        with _kitchen_lock:
+            if _kitchen is None:
+                _kitchen = KitchenExecutor(**_kitchen_telemetry())
+    return _kitchen
+
+
+def set_kitchen(kitchen: KitchenExecutor):
+    global _kitchen
+    with _kitchen_lock:
+        _kitchen = kitchen
+
+
+def shutdown_kitchen(wait: bool = True):
+    global _kitchen
+    with _kitchen_lock:
+        kitchen, _kitchen = _kitchen, None
+    if kitchen is not None:
+        kitchen.shutdown(wait)
+
+
+PIZZA_OVEN_SLOTS = int(os.environ.get('PIZZA_OVEN_SLOTS', 8))
+PIZZA_OVEN_DEGREES = int(os.environ.get('PIZZA_OVEN_DEGREES', 200))
+# seconds the oven stays hot after preheating or baking
+PIZZA_OVEN_PREHEAT_TTL = float(os.environ.get('PIZZA_OVEN_PREHEAT_TTL', 60.0))
+# pizzas that arrive within this many seconds of the first waiting one go into the same bake cycle
+PIZZA_OVEN_BATCH_WINDOW = float(os.environ.get('PIZZA_OVEN_BATCH_WINDOW', 0.05))
+PIZZA_OVEN_BAKE_TIME = float(os.environ.get('PIZZA_OVEN_BAKE_TIME', 2.0))
+
+meter = metrics.get_meter(__name__)
+oven_queue_depth = meter.create_up_down_counter('pizza_oven_queue_depth', 'pizzas waiting for the oven', 'pizzas')
+oven_wait_time = meter.create_histogram('pizza_oven_wait_time', 'time from queuing a pizza to baking it', 's')
+oven_batch_size = meter.create_histogram('pizza_oven_batch_size', 'pizzas baked per oven cycle', 'pizzas')
+
+
+class Oven:
+    """
+    One shared oven for all pizzas of the process. It bakes up to slots pizzas per cycle, and pizzas that
+    arrive within batch_window of each other share a cycle. Preheating is only needed when the oven was
+    idle for longer than preheat_ttl.
+
+    The oven belongs to the event loop it is first used on, bake() has to be awaited on that loop.
+    """
+
+    def __init__(self, slots: int = PIZZA_OVEN_SLOTS, degrees: int = PIZZA_OVEN_DEGREES,
+                 preheat_ttl: float = PIZZA_OVEN_PREHEAT_TTL, batch_window: float = PIZZA_OVEN_BATCH_WINDOW,
+                 bake_time: float = PIZZA_OVEN_BAKE_TIME):
+        self.slots = slots
+        self.degrees = degrees
+        self.preheat_ttl = preheat_ttl
+        self.batch_window = batch_window
+        self.bake_time = bake_time
+        self.queue_depth = 0
+        self.cycles = 0
+        self.baked = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._hot_until = 0.0
+        self._queue: asyncio.Queue = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._scheduler: asyncio.Task = None
+        self._preheating: asyncio.Task = None
+
+    def _bind(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._preheating = None
+            self._hot_until = 0.0
+            # the scheduler is a root task: it must not live on in the trace context of the first pizza
+            self._scheduler = loop.create_task(self._run(), name='pizza-oven', context=contextvars.Context())
+        return self._queue
+
+    def warm_up(self):
+        """Starts preheating if the oven is cold, without waiting for it."""
+        self._bind()
+        if self._loop.time() >= self._hot_until and (self._preheating is None or self._preheating.done()):
+            self._preheating = self._loop.create_task(self._preheat(), context=contextvars.Context())
+
+    async def bake(self, pizza_id: int):
+        """Waits until the pizza went through a bake cycle."""
+        pizzas = self._bind()
+        future = self._loop.create_future()
+        pizzas.put_nowait((pizza_id, future, self._loop.time(), trace.get_current_span().get_span_context()))
+        self.queue_depth += 1
+        oven_queue_depth.add(1)
+        await future
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'cycles': self.cycles,
+            'baked': self.baked,
+            'mean_wait': self.total_wait / self.baked if self.baked else 0.0,
+            'max_wait': self.max_wait,
+            'hot': self._loop is not None and self._loop.time() < self._hot_until,
+        }
+
+    def close(self):
+        """Stops the oven, pizzas still waiting fail with CancelledError."""
+        for task in (self._scheduler, self._preheating):
+            if task is not None:
+                task.cancel()
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait()[1].cancel()
+        self._loop = self._queue = self._scheduler = self._preheating = None
+
+    async def _preheat(self):
+        # runs as a root task of the oven, not a step of one pizza
+        with tracer.span("preheat_oven", tracing.REQUEST, attributes={"degrees": self.degrees}):
+            await asyncio.sleep(self.degrees / 100)
+        self._hot_until = self._loop.time() + self.preheat_ttl
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.batch_window
+        while len(batch) < self.slots:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self.queue_depth -= len(batch)
+        oven_queue_depth.add(-len(batch))
+        # pizzas whose request went away do not take a slot
+        return [pizza for pizza in batch if not pizza[1].done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                await self._cycle(batch)
+            finally:
+                # on close the pizzas in the oven fail instead of waiting forever
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.cancel()
+
+    async def _cycle(self, batch: list):
+        if self._loop.time() >= self._hot_until:
+            self.warm_up()
+            await asyncio.shield(self._preheating)
+        started = self._loop.time()
+        for _, _, queued_at, _ in batch:
+            wait = started - queued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            oven_wait_time.record(wait)
+        oven_batch_size.record(len(batch))
+        links = [trace.Link(span_context) for _, _, _, span_context in batch if span_context.is_valid]
+        with tracer.span("bake_pizza", tracing.REQUEST, links=links,
+                         attributes={"pizza_ids": [pizza_id for pizza_id, *_ in batch]}):
+            await asyncio.sleep(self.bake_time)
+        self.cycles += 1
+        self.baked += len(batch)
+        self._hot_until = max(self._hot_until, self._loop.time() + self.preheat_ttl)
+        for _, future, _, _ in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+_oven: Oven = None
+
+
+def get_oven() -> Oven:
+    global _oven
+    if _oven is None:
+        _oven = Oven()
+    return _oven
+
+
+def set_oven(oven: Oven):
+    global _oven
+    _oven = oven
+
+
+def close_oven():
+    global _oven
+    oven, _oven = _oven, None
+    if oven is not None:
+        oven.close()
 
 
 async def make_the_pizza(pizza_id: int):
-    with tracer.start_as_current_span("make_pizza", attributes={"pizza_id": pizza_id}):
-        await preheat_oven(200)
-        flatten_dough()
-        prepare_pizza()
-        await bake_pizza()
+    with tracer.span("make_pizza", tracing.REQUEST, attributes={"pizza_id": pizza_id}):
+        oven = get_oven()
+        # the oven heats up while the dough is worked on
+        oven.warm_up()
+        await flatten_dough_async()
+        await prepare_pizza_async()
+        await oven.bake(pizza_id)
 
 
 def make_the_pizza_sync(pizza_id: int):
-    with tracer.start_as_current_span("make_pizza_sync", attributes={"pizza_id": pizza_id}):
+    with tracer.span("make_pizza_sync", tracing.REQUEST, attributes={"pizza_id": pizza_id}):
         preheat_oven_sync(200)
         flatten_dough()
         prepare_pizza()
@@ -54,32 +492,42 @@ def make_the_pizza_sync(pizza_id: int):
 
 
 def preheat_oven_sync(degrees: int):
-    with tracer.start_as_current_span("preheat_oven_sync"):
+    with tracer.span("preheat_oven_sync"):
         time.sleep(degrees / 100)
 
 
 async def preheat_oven(degrees: int):
-    with tracer.start_as_current_span("preheat_oven"):
+    with tracer.span("preheat_oven"):
         await asyncio.sleep(degrees / 100)
 
 
 def prepare_pizza():
-    with tracer.start_as_current_span("prepare_pizza"):
-        _manual_labor_fibonacci(35)
+    with tracer.span("prepare_pizza"):
+        get_kitchen().run(_manual_labor_fibonacci, 35)
+
+
+async def prepare_pizza_async():
+    with tracer.span("prepare_pizza"):
+        await get_kitchen().run_async(_manual_labor_fibonacci, 35)
 
 
 def flatten_dough():
-    with tracer.start_as_current_span("flatten_dough"):
-        _manual_labor_fibonacci(34)
+    with tracer.span("flatten_dough"):
+        get_kitchen().run(_manual_labor_fibonacci, 34)
+
+
+async def flatten_dough_async():
+    with tracer.span("flatten_dough"):
+        await get_kitchen().run_async(_manual_labor_fibonacci, 34)
 
 
 async def bake_pizza():
-    with tracer.start_as_current_span("bake_pizza"):
+    with tracer.span("bake_pizza"):
         await asyncio.sleep(2)
 
 
 def bake_pizza_sync():
-    with tracer.start_as_current_span("bake_pizza_sync"):
+    with tracer.span("bake_pizza_sync"):
         time.sleep(2)
 
 
@@ -89,8 +537,3 @@ def fib(n):
 
 def _manual_labor_fibonacci(n):
     return [fib(n)] * 10
-
-#
-# def _fibonacci_multiprocessing(n):
-#     with Pool(10) as p:
-#         return p.map(fib, [n] * 10)
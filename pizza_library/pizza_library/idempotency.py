@@ -0,0 +1,69 @@
+# Idempotency-Key support: a request that is repeated with the same key gets the result of the first one
+#
+# While the first request is still running, repeats wait for it (single flight). Its result is then kept for
+# ttl seconds, bounded to max_keys keys, and repeats get it from there. Failures are not kept, the next repeat
+# runs the work again. The work runs in a task of its own, a client that gives up does not cancel it for the
+# others waiting on the same key. The keys live in the memory of one process: a shop with several worker
+# processes needs every client routed to the same worker for its repeats to be recognized.
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from opentelemetry import metrics
+
+PIZZA_IDEMPOTENCY_TTL = float(os.environ.get('PIZZA_IDEMPOTENCY_TTL', 3600.0))
+PIZZA_IDEMPOTENCY_MAX_KEYS = int(os.environ.get('PIZZA_IDEMPOTENCY_MAX_KEYS', 100_000))
+
+meter = metrics.get_meter(__name__)
+idempotent_requests = meter.create_counter('pizza_idempotent_requests',
+                                           'requests with an idempotency key, by how they were answered', 'requests')
+
+# how a request was answered
+EXECUTED = 'executed'
+JOINED = 'joined'
+REPLAYED = 'replayed'
+
+
+class IdempotencyStore:
+    """For use from one event loop; it takes no locks."""
+
+    def __init__(self, ttl: float = PIZZA_IDEMPOTENCY_TTL, max_keys: int = PIZZA_IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._results: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable]) -> Tuple[Any, str]:
+        """Returns the result of work() for the first request with key, and how this request was answered."""
+        stored = self._results.get(key)
+        if stored is not None:
+            if stored[0] > time.monotonic():
+                idempotent_requests.add(1, {'answer': REPLAYED})
+                return stored[1], REPLAYED
+            del self._results[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            idempotent_requests.add(1, {'answer': JOINED})
+            return await asyncio.shield(task), JOINED
+
+        task = asyncio.ensure_future(work())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        idempotent_requests.add(1, {'answer': EXECUTED})
+        return await asyncio.shield(task), EXECUTED
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._results[key] = (time.monotonic() + self.ttl, task.result())
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_keys:
+            self._results.popitem(last=False)
+
+    def __len__(self):
+        return len(self._results)
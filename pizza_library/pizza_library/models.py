@@ -41,4 +41,26 @@ class Order(BaseModel):
 class Payment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     order_id: str
-    secret_data: str
\ No newline at end of file
+    secret_data: str
+
+
+_new_instance = object.__new__
+_set_attribute = object.__setattr__
+_field_names = {}
+
+
+def construct(model, values: dict):
+    """
+    model_construct minus its per call bookkeeping, for the hot paths that generate or decode values which
+    are known to be valid already. values has to contain every field and becomes the instance __dict__.
+    The attributes are set the way model_construct sets them, every instance gets a fields set of its own.
+    """
+    fields_set = _field_names.get(model)
+    if fields_set is None:
+        fields_set = _field_names[model] = set(model.model_fields)
+    instance = _new_instance(model)
+    _set_attribute(instance, '__dict__', values)
+    _set_attribute(instance, '__pydantic_fields_set__', fields_set.copy())
+    _set_attribute(instance, '__pydantic_extra__', None)
+    _set_attribute(instance, '__pydantic_private__', None)
+    return instance
@@ -1,22 +1,135 @@
 import logging
 import os
 
-from azure.core.settings import settings
-from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
-from azure.monitor.opentelemetry import configure_azure_monitor
 from opentelemetry import trace
-from opentelemetry._logs import set_logger_provider
-from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
-from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
-from opentelemetry.sdk.resources import Resource, SERVICE_NAME, SERVICE_INSTANCE_ID
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry import metrics
-from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
-from opentelemetry.sdk.metrics import MeterProvider
-
-
-def setup_telemetry(service_name, enable_console=False):
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.sampling import ALWAYS_ON, Decision, ParentBased, Sampler, SamplingResult, \
+    TraceIdRatioBased
+from opentelemetry.trace import SpanContext, StatusCode, TraceFlags
+
+# share of traces that are recorded and exported, decided once at the root span and inherited by the children
+PIZZA_TRACE_SAMPLE_RATIO = float(os.environ.get('PIZZA_TRACE_SAMPLE_RATIO', 1.0))
+# export spans that failed even when their trace was not sampled. Off by default: it has every unsampled trace
+# recorded in full, which gives back most of what a sample ratio below 1 saves
+PIZZA_TRACE_KEEP_ERRORS = os.environ.get('PIZZA_TRACE_KEEP_ERRORS', 'false').lower() in ('1', 'true', 'yes')
+# export spans that took at least this many milliseconds even when their trace was not sampled, 0 is off; costs
+# as much as PIZZA_TRACE_KEEP_ERRORS
+PIZZA_TRACE_SLOW_SPAN_MS = float(os.environ.get('PIZZA_TRACE_SLOW_SPAN_MS', 0))
+# records below this level are neither logged nor exported
+PIZZA_LOG_LEVEL = os.environ.get('PIZZA_LOG_LEVEL', 'INFO').upper()
+PIZZA_TELEMETRY_BATCH_SIZE = int(os.environ.get('PIZZA_TELEMETRY_BATCH_SIZE', 512))
+PIZZA_TELEMETRY_EXPORT_DELAY_MS = int(os.environ.get('PIZZA_TELEMETRY_EXPORT_DELAY_MS', 5000))
+
+# the arguments setup_telemetry was called with in this process, for worker processes to do the same
+telemetry_settings: dict = None
+
+
+class _RecordUnsampled(Sampler):
+    """
+    Records the spans of traces the wrapped sampler drops instead of making them no-ops, so
+    KeepErrorsAndSlowSpans can still export the ones that fail or run long. They are never exported otherwise.
+    """
+
+    def __init__(self, sampler: Sampler):
+        self.sampler = sampler
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None,
+                      trace_state=None) -> SamplingResult:
+        result = self.sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision is Decision.DROP:
+            return SamplingResult(Decision.RECORD_ONLY, result.attributes, result.trace_state)
+        return result
+
+    def get_description(self) -> str:
+        return f'RecordUnsampled{{{self.sampler.get_description()}}}'
+
+
+class KeepErrorsAndSlowSpans(SpanProcessor):
+    """
+    Passes sampled spans on to the exporting processor, plus the recorded but unsampled spans that ended
+    with an error or took at least slow_span_ms.
+    """
+
+    def __init__(self, processor: SpanProcessor, keep_errors: bool = True, slow_span_ms: float = 0):
+        self.processor = processor
+        self.keep_errors = keep_errors
+        self.slow_span_ns = slow_span_ms * 1e6
+
+    def on_start(self, span, parent_context=None):
+        self.processor.on_start(span, parent_context)
+
+    def on_end(self, span: ReadableSpan):
+        if span.context.trace_flags.sampled:
+            self.processor.on_end(span)
+        elif (self.keep_errors and span.status.status_code is StatusCode.ERROR) or \
+                (self.slow_span_ns and span.end_time - span.start_time >= self.slow_span_ns):
+            self.processor.on_end(_as_sampled(span))
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.processor.force_flush(timeout_millis)
+
+
+def _as_sampled(span: ReadableSpan) -> ReadableSpan:
+    # exporting processors skip unsampled spans, hand them a copy that carries the sampled flag
+    context = span.context
+    return ReadableSpan(
+        name=span.name,
+        context=SpanContext(context.trace_id, context.span_id, context.is_remote, TraceFlags(TraceFlags.SAMPLED),
+                            context.trace_state),
+        parent=span.parent,
+        resource=span.resource,
+        attributes=span.attributes,
+        events=span.events,
+        links=span.links,
+        kind=span.kind,
+        status=span.status,
+        start_time=span.start_time,
+        end_time=span.end_time,
+        instrumentation_scope=span.instrumentation_scope,
+    )
+
+
+def create_sampler(ratio: float = PIZZA_TRACE_SAMPLE_RATIO, keep_errors: bool = PIZZA_TRACE_KEEP_ERRORS,
+                   slow_span_ms: float = PIZZA_TRACE_SLOW_SPAN_MS) -> Sampler:
+    """
+    Head sampling by trace id ratio that follows the decision of the parent span, also across services.
+    Keeping errors or slow spans of unsampled traces needs those traces recorded, which costs about as much as
+    sampling them; benchmarks.telemetry compares the two.
+    """
+    if ratio >= 1.0:
+        return ParentBased(ALWAYS_ON)
+    sampler = ParentBased(TraceIdRatioBased(ratio))
+    if keep_errors or slow_span_ms:
+        return _RecordUnsampled(sampler)
+    return sampler
+
+
+def create_span_processor(exporter, keep_errors: bool = PIZZA_TRACE_KEEP_ERRORS,
+                          slow_span_ms: float = PIZZA_TRACE_SLOW_SPAN_MS,
+                          batch_size: int = PIZZA_TELEMETRY_BATCH_SIZE,
+                          export_delay_ms: int = PIZZA_TELEMETRY_EXPORT_DELAY_MS) -> SpanProcessor:
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    processor = BatchSpanProcessor(exporter, max_export_batch_size=batch_size,
+                                   max_queue_size=max(2048, 4 * batch_size), schedule_delay_millis=export_delay_ms)
+    return KeepErrorsAndSlowSpans(processor, keep_errors, slow_span_ms)
+
+
+def setup_telemetry(service_name, enable_console=False, sample_ratio: float = PIZZA_TRACE_SAMPLE_RATIO,
+                    keep_errors: bool = PIZZA_TRACE_KEEP_ERRORS, slow_span_ms: float = PIZZA_TRACE_SLOW_SPAN_MS,
+                    log_level: str = PIZZA_LOG_LEVEL, batch_size: int = PIZZA_TELEMETRY_BATCH_SIZE,
+                    export_delay_ms: int = PIZZA_TELEMETRY_EXPORT_DELAY_MS):
+    global telemetry_settings
+    telemetry_settings = dict(service_name=service_name, enable_console=enable_console, sample_ratio=sample_ratio,
+                              keep_errors=keep_errors, slow_span_ms=slow_span_ms, log_level=log_level,
+                              batch_size=batch_size, export_delay_ms=export_delay_ms)
+    # the exporters and their dependencies are only imported once it is known which backend is used
+    from opentelemetry.sdk.resources import Resource, SERVICE_NAME
+    from opentelemetry.sdk.trace import TracerProvider
+
     resource = Resource.create({
         SERVICE_NAME: service_name,
     })
@@ -27,52 +140,65 @@ def setup_telemetry(service_name, enable_console=False):
     application_insights_connection_string = os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING")
 
     os.environ["OTEL_SERVICE_NAME"] = os.getenv("OTEL_SERVICE_NAME", service_name)
-    tracer_provider = TracerProvider(resource=resource)
-    logger_provider = LoggerProvider(resource=resource)
+    sampler = create_sampler(sample_ratio, keep_errors, slow_span_ms)
+    tracer_provider = TracerProvider(resource=resource, sampler=sampler)
+    processor_options = dict(keep_errors=keep_errors, slow_span_ms=slow_span_ms, batch_size=batch_size,
+                             export_delay_ms=export_delay_ms)
+    # level of the root logger, which every library logger inherits unless it sets its own
+    logging.getLogger().setLevel(log_level)
 
     if oltp_endpoint and oltp_auth_key:
+        from opentelemetry._logs import set_logger_provider
         from opentelemetry.exporter.otlp.proto.http._log_exporter import OTLPLogExporter
         from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+        from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
 
         print("Using OTLP endpoint: " + oltp_endpoint)
 
+        logger_provider = LoggerProvider(resource=resource)
         set_logger_provider(logger_provider)
 
-        url = 'http://localhost:5080/api/default/v1/traces'
         headers = {"Authorization": "Basic " + oltp_auth_key}
 
         exporter = OTLPSpanExporter(endpoint=oltp_endpoint + '/traces', headers=headers)
         log_exporter = OTLPLogExporter(endpoint=oltp_endpoint + "/logs", headers=headers)
-        logger_provider.add_log_record_processor(BatchLogRecordProcessor(log_exporter))
-        oltp_log_handler = LoggingHandler(level=logging.NOTSET, logger_provider=logger_provider)
+        logger_provider.add_log_record_processor(BatchLogRecordProcessor(
+            log_exporter, max_export_batch_size=batch_size, max_queue_size=max(2048, 4 * batch_size),
+            schedule_delay_millis=export_delay_ms))
+        oltp_log_handler = LoggingHandler(level=log_level, logger_provider=logger_provider)
         logging.getLogger().addHandler(oltp_log_handler)
-        logging.getLogger().setLevel(logging.NOTSET)
-        span_processor = BatchSpanProcessor(exporter)
 
         # add the span processor to the tracer provider
-        tracer_provider.add_span_processor(span_processor)
+        tracer_provider.add_span_processor(create_span_processor(exporter, **processor_options))
 
         # set the tracer provider as the global provider
         trace.set_tracer_provider(tracer_provider)
     elif application_insights_connection_string:
+        from azure.core.settings import settings
+        from azure.core.tracing.ext.opentelemetry_span import OpenTelemetrySpan
+        from azure.monitor.opentelemetry import configure_azure_monitor
 
         print("Using Application Insights endpoint: " + application_insights_connection_string)
         settings.tracing_implementation = OpenTelemetrySpan
+        # azure monitor brings its own trace id ratio sampler and batching
         configure_azure_monitor(
             connection_string=application_insights_connection_string,
             logger_name=service_name,
+            sampling_ratio=min(sample_ratio, 1.0),
         )
 
     else:
         enable_console = True
     if enable_console:
-        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+        from opentelemetry import metrics
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter, PeriodicExportingMetricReader
         from opentelemetry.sdk.trace.export import ConsoleSpanExporter
 
         print("Using Console logging")
         span_exporter = ConsoleSpanExporter()
-        span_processor = BatchSpanProcessor(span_exporter)
-        tracer_provider.add_span_processor(span_processor)
+        tracer_provider.add_span_processor(create_span_processor(span_exporter, **processor_options))
         trace.set_tracer_provider(tracer_provider)
 
         metrics_exporter = ConsoleMetricExporter()
@@ -84,3 +210,8 @@ def setup_telemetry(service_name, enable_console=False):
         print("AZURE_SDK_TRACING_IMPLEMENTATION is set to:", azure_sdk_tracing_implementation)
 
     logging.getLogger(service_name).info("Tracing and logging initialized")
+
+
+def setup_worker_telemetry(settings: dict):
+    """Initializer for process pools: sets up telemetry in the worker like setup_telemetry(**settings) did here."""
+    setup_telemetry(**settings)
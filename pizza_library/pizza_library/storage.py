@@ -3,33 +3,324 @@
 import os
 import logging
 import json
+import queue
+import socket
+import threading
+import time
+import asyncio
+from collections import deque
 
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
-from azure.identity import DefaultAzureCredential
+from pizza_library import codec
 from pizza_library.models import Order
-from datetime import datetime
-blob_service_client = None
+from datetime import datetime, timezone
+logger = logging.getLogger(__name__)
 
 PIZZA_STORAGE_CONNECTION_STRING = os.environ.get('PIZZA_STORAGE_CONNECTION_STRING')
 PIZZA_STORAGE_ACCOUNT_NAME = os.environ.get('PIZZA_STORAGE_ACCOUNT_NAME')
 PIZZA_STORAGE_CONTAINER_NAME = os.environ.get('PIZZA_STORAGE_CONTAINER_NAME')
-if (not PIZZA_STORAGE_CONNECTION_STRING) and PIZZA_STORAGE_ACCOUNT_NAME:
-    blob_service_client = BlobServiceClient(credential=DefaultAzureCredential(), logging_enable=True, account_url=f'https://{PIZZA_STORAGE_ACCOUNT_NAME}.blob.core.windows.net')
-elif PIZZA_STORAGE_CONNECTION_STRING: 
-    blob_service_client = BlobServiceClient.from_connection_string(PIZZA_STORAGE_CONNECTION_STRING)
-else:
-    raise ValueError('PIZZA_STORAGE_CONNECTION_STRING or PIZZA_STORAGE_ACCOUNT_NAME environment variable is not set')
+# azure or local, defaults to azure when one of the azure settings above is present
+PIZZA_STORAGE_BACKEND = os.environ.get('PIZZA_STORAGE_BACKEND')
+PIZZA_STORAGE_LOCAL_PATH = os.environ.get('PIZZA_STORAGE_LOCAL_PATH', 'pizza_storage')
+
+
+class BlobBackend:
+    """Where pizza data ends up. Backends create their clients on first use, not on import."""
+
+    def upload(self, name: str, content):
+        raise NotImplementedError
+
+    def append(self, name: str, data: bytes):
+        """Appends to the blob, creating it when it does not exist yet."""
+        raise NotImplementedError
+
+
+class AzureBlobBackend(BlobBackend):
+    def __init__(self, container: str = None, connection_string: str = None, account_name: str = None):
+        self.container = container or PIZZA_STORAGE_CONTAINER_NAME
+        self.connection_string = connection_string or PIZZA_STORAGE_CONNECTION_STRING
+        self.account_name = account_name or PIZZA_STORAGE_ACCOUNT_NAME
+        if not (self.connection_string or self.account_name):
+            raise ValueError('PIZZA_STORAGE_CONNECTION_STRING or PIZZA_STORAGE_ACCOUNT_NAME environment variable is not set')
+        self._client = None
+        self._lock = threading.Lock()
+        self._append_blobs = set()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from azure.storage.blob import BlobServiceClient
+                    if self.connection_string:
+                        self._client = BlobServiceClient.from_connection_string(self.connection_string)
+                    else:
+                        from azure.identity import DefaultAzureCredential
+                        self._client = BlobServiceClient(credential=DefaultAzureCredential(), logging_enable=True,
+                                                         account_url=f'https://{self.account_name}.blob.core.windows.net')
+        return self._client
+
+    def upload(self, name: str, content):
+        blob_client = self.client.get_blob_client(container=self.container, blob=name)
+        blob_client.upload_blob(content, overwrite=True)
+
+    def append(self, name: str, data: bytes):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError
+
+        blob_client = self.client.get_blob_client(container=self.container, blob=name)
+        if name not in self._append_blobs:
+            try:
+                blob_client.create_append_blob(etag='*', match_condition=MatchConditions.IfMissing)
+            except ResourceExistsError:
+                pass
+            self._append_blobs.add(name)
+        blob_client.append_block(data)
+
+
+class LocalBlobBackend(BlobBackend):
+    """Keeps the blobs as files below a directory, for development and tests without a storage account."""
+
+    def __init__(self, root: str = None, container: str = None):
+        self.root = os.path.join(root or PIZZA_STORAGE_LOCAL_PATH, container or PIZZA_STORAGE_CONTAINER_NAME or '')
+
+    def _path(self, name: str) -> str:
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def upload(self, name: str, content):
+        with open(self._path(name), 'wb') as f:
+            f.write(content.encode() if isinstance(content, str) else content)
+
+    def append(self, name: str, data: bytes):
+        with open(self._path(name), 'ab') as f:
+            f.write(data)
+
+
+_blob_backend: BlobBackend = None
+_blob_backend_lock = threading.Lock()
+
+
+def _create_blob_backend() -> BlobBackend:
+    backend = PIZZA_STORAGE_BACKEND
+    if backend is None:
+        backend = 'azure' if PIZZA_STORAGE_CONNECTION_STRING or PIZZA_STORAGE_ACCOUNT_NAME else 'local'
+        if backend == 'local':
+            logger.warning('no azure storage configured, keeping pizza data in %s', PIZZA_STORAGE_LOCAL_PATH)
+    if backend == 'azure':
+        return AzureBlobBackend()
+    if backend == 'local':
+        return LocalBlobBackend()
+    raise ValueError(f'unknown PIZZA_STORAGE_BACKEND {backend!r}, expected azure or local')
+
+
+def get_blob_backend() -> BlobBackend:
+    global _blob_backend
+    if _blob_backend is None:
+        with _blob_backend_lock:
+            if _blob_backend is None:
+                _blob_backend = _create_blob_backend()
+    return _blob_backend
+
+
+def set_blob_backend(backend: BlobBackend):
+    global _blob_backend
+    with _blob_backend_lock:
+        _blob_backend = backend
 
-blob_service_client = BlobServiceClient.from_connection_string(os.environ.get('PIZZA_STORAGE_CONNECTION_STRING'))
 
 def upload_pizza_order(order: Order):
     # create a filename variable with a path like YYYY/MM/DD/HHMMSS-HASHOORDER.json
     now = datetime.now()
     filename = f'{now.strftime("%Y/%m/%d/")}order-{order.id}.json'
-    upload_pizza_data(filename, order.model_dump_json())
+    upload_pizza_data(filename, codec.encode_order(order))
+
+def upload_pizza_data(filename: str, content: bytes):
+    get_blob_backend().upload(filename, content)
+
+
+# Write-behind archiving: orders are buffered in memory and appended as NDJSON lines to one append blob per
+# hour and process, instead of one tiny blob and one storage round trip per order.
+ARCHIVE_MAX_BATCH = int(os.environ.get('PIZZA_ARCHIVE_MAX_BATCH', 500))
+ARCHIVE_MAX_DELAY = float(os.environ.get('PIZZA_ARCHIVE_MAX_DELAY', 5.0))
+ARCHIVE_BUFFER_SIZE = int(os.environ.get('PIZZA_ARCHIVE_BUFFER_SIZE', 10_000))
+# seconds archive() waits for room in a full buffer before it raises ArchiveBufferFull
+ARCHIVE_TIMEOUT = float(os.environ.get('PIZZA_ARCHIVE_TIMEOUT', 5.0))
+# limit of a single append block, and so of the line of one order
+APPEND_BLOCK_MAX_BYTES = 4 * 1024 * 1024
+# failed appends of a block, other than the storage being unreachable or busy, before its orders are dropped
+ARCHIVE_MAX_ATTEMPTS = int(os.environ.get('PIZZA_ARCHIVE_MAX_ATTEMPTS', 5))
+# stands for ARCHIVE_TIMEOUT as it is when archive() is called, None already means waiting without limit
+_DEFAULT_TIMEOUT = object()
+
+
+class ArchiveBufferFull(Exception):
+    pass
+
+
+class OrderArchiver:
+    def __init__(self, max_batch: int = ARCHIVE_MAX_BATCH, max_delay: float = ARCHIVE_MAX_DELAY,
+                 buffer_size: int = ARCHIVE_BUFFER_SIZE, max_retry_delay: float = 30.0, backend: BlobBackend = None):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retry_delay = max_retry_delay
+        self.instance = f'{socket.gethostname()}-{os.getpid()}'
+        self._buffer: queue.Queue = queue.Queue(maxsize=buffer_size)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='order-archiver', daemon=True)
+        self._thread.start()
+
+    def archive(self, order: Order, timeout: float = _DEFAULT_TIMEOUT, payload: bytes = None):
+        """
+        Queues the order for the next flush. Blocks while the buffer is full, at most timeout seconds
+        (ARCHIVE_TIMEOUT by default), then raises ArchiveBufferFull so callers feel backpressure instead of
+        growing memory without bound. A timeout of None waits for as long as storage is down.
+        payload is the order as codec.encode_order returned it, if the caller has it already. An order longer
+        than an append block raises ValueError, storage would refuse it.
+        """
+        line = _line(order, payload)
+        try:
+            self._buffer.put(line, timeout=ARCHIVE_TIMEOUT if timeout is _DEFAULT_TIMEOUT else timeout)
+        except queue.Full:
+            raise ArchiveBufferFull(f'{self._buffer.maxsize} orders are waiting to be archived') from None
+
+    async def archive_async(self, order: Order, timeout: float = _DEFAULT_TIMEOUT, payload: bytes = None):
+        line = _line(order, payload)
+        if timeout is _DEFAULT_TIMEOUT:
+            timeout = ARCHIVE_TIMEOUT
+        try:
+            self._buffer.put_nowait(line)
+        except queue.Full:
+            # only wait on a thread when there is backpressure, the common case never leaves the loop
+            try:
+                await asyncio.to_thread(self._buffer.put, line, timeout=timeout)
+            except queue.Full:
+                raise ArchiveBufferFull(f'{self._buffer.maxsize} orders are waiting to be archived') from None
+
+    def close(self, timeout: float = None):
+        """Flushes everything buffered so far and stops the background thread."""
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        lines = []
+        deadline = time.monotonic() + self.max_delay
+        while len(lines) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if self._stopping.is_set():
+                remaining = 0
+            try:
+                lines.append(self._buffer.get(timeout=remaining) if remaining > 0 else self._buffer.get_nowait())
+            except queue.Empty:
+                if lines or self._stopping.is_set():
+                    break
+                deadline = time.monotonic() + self.max_delay
+        return lines
+
+    def _run(self):
+        while True:
+            lines = self._next_batch()
+            if lines:
+                self._flush(lines)
+            elif self._stopping.is_set():
+                return
+
+    def _flush(self, lines):
+        # retries start at the block that failed, appending the ones before it again would duplicate their lines
+        blocks = deque(_blocks(lines, APPEND_BLOCK_MAX_BYTES))
+        retry_delay = 0.5
+        attempt = failures = 0
+        while blocks:
+            try:
+                self._append(blocks[0])
+                blocks.popleft()
+                attempt = failures = 0
+                retry_delay = 0.5
+            except Exception as e:
+                attempt += 1
+                remaining = sum(block.count(b'\n') for block in blocks)
+                if self._stopping.is_set() and attempt >= 3:
+                    logger.exception('dropping %d orders that could not be archived before shutdown', remaining)
+                    return
+                if not _is_transient(e):
+                    # storage answered and refused the block, it would go on refusing it
+                    failures += 1
+                    if failures >= ARCHIVE_MAX_ATTEMPTS:
+                        logger.exception('dropping %d orders that storage refused %d times',
+                                         blocks.popleft().count(b'\n'), failures)
+                        attempt = failures = 0
+                        retry_delay = 0.5
+                        continue
+                # keep the batch, the buffer filling up pushes back on the producers meanwhile
+                logger.exception('archiving %d orders failed, retrying in %.1fs', remaining, retry_delay)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+
+    def _append(self, block: bytes):
+        now = datetime.now(timezone.utc)
+        blob_name = f'{now.strftime("%Y/%m/%d/")}orders-{now.strftime("%H")}-{self.instance}.ndjson'
+        (self.backend or get_blob_backend()).append(blob_name, block)
+
+
+def _line(order: Order, payload: bytes = None) -> bytes:
+    line = payload or codec.encode_order(order)
+    if len(line) >= APPEND_BLOCK_MAX_BYTES:
+        raise ValueError(f'order {order.id} takes {len(line)} bytes, more than an append block holds')
+    return line
+
+
+def _is_transient(error: Exception) -> bool:
+    # storage that is unreachable, throttles or fails on its side may take the same block later
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    try:
+        from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+    except ImportError:
+        return False
+    return isinstance(error, (ServiceRequestError, ServiceResponseError))
+
+
+def _blocks(lines, max_bytes: int):
+    block, size = [], 0
+    for line in lines:
+        data = line + b'\n'
+        if block and size + len(data) > max_bytes:
+            yield b''.join(block)
+            block, size = [], 0
+        block.append(data)
+        size += len(data)
+    if block:
+        yield b''.join(block)
+
+
+_order_archiver: OrderArchiver = None
+_order_archiver_lock = threading.Lock()
+
+
+def get_order_archiver() -> OrderArchiver:
+    global _order_archiver
+    if _order_archiver is None:
+        with _order_archiver_lock:
+            if _order_archiver is None:
+                _order_archiver = OrderArchiver()
+    return _order_archiver
+
+
+def archive_pizza_order(order: Order, timeout: float = _DEFAULT_TIMEOUT, payload: bytes = None):
+    get_order_archiver().archive(order, timeout, payload)
+
+
+async def archive_pizza_order_async(order: Order, timeout: float = _DEFAULT_TIMEOUT, payload: bytes = None):
+    await get_order_archiver().archive_async(order, timeout, payload)
 
-def upload_pizza_data(filename: str, content: str):
 
-    # Create a blob client using the local file name as the name for the blob
-    blob_client = blob_service_client.get_blob_client(container=PIZZA_STORAGE_CONTAINER_NAME, blob=filename)
-    blob_client.upload_blob(content, overwrite=True)
\ No newline at end of file
+def close_order_archiver(timeout: float = None):
+    global _order_archiver
+    with _order_archiver_lock:
+        archiver, _order_archiver = _order_archiver, None
+    if archiver is not None:
+        archiver.close(timeout)
@@ -0,0 +1,131 @@
+# async access to the sqlite order store for the FastAPI services
+#
+# sqlite3 blocks, so every call is handed to a thread: reads go to a small pool of reader threads, each with
+# its own connection from the ConnectionManager, writes go to one writer thread. The writer coalesces inserts
+# that arrive within a few milliseconds of each other into a single transaction.
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, List
+
+from pizza_library import database
+from pizza_library.database import ConnectionManager
+from pizza_library.models import Order
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class OrderStore:
+    def __init__(self, connection_manager: ConnectionManager = None, readers: int = 4,
+                 coalesce_window: float = 0.002, max_batch_orders: int = 5_000):
+        self.connection_manager = connection_manager or database.get_connection_manager()
+        self.readers = readers
+        self.coalesce_window = coalesce_window
+        self.max_batch_orders = max_batch_orders
+        self._writes: queue.Queue = queue.Queue()
+        self._writer: threading.Thread = None
+        self._reader_pool: ThreadPoolExecutor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._writer is None:
+                self._reader_pool = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='order-store-reader')
+                self._writer = threading.Thread(target=self._write_loop, name='order-store-writer', daemon=True)
+                self._writer.start()
+        return self
+
+    def close(self):
+        """Commits the pending writes and stops the threads."""
+        with self._lock:
+            writer, reader_pool = self._writer, self._reader_pool
+            self._writer, self._reader_pool = None, None
+        if writer is not None:
+            self._writes.put(_STOP)
+            writer.join()
+            reader_pool.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def _read(self, function, *args):
+        if self._reader_pool is None:
+            self.start()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._reader_pool, partial(function, *args, database=self.connection_manager))
+
+    async def get_order(self, order_id: int) -> Order:
+        return await self._read(database.get_order_by_id, order_id)
+
+    async def get_orders(self, order_ids: Iterable[int]) -> Dict[int, Order]:
+        return await self._read(database.get_orders, list(order_ids))
+
+    async def insert_orders(self, orders: Iterable[Order]) -> List[int]:
+        if self._writer is None:
+            self.start()
+        future = Future()
+        self._writes.put((list(orders), future))
+        return await asyncio.wrap_future(future)
+
+    async def insert_order(self, order: Order) -> int:
+        return (await self.insert_orders([order]))[0]
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            request = self._writes.get()
+            if request is _STOP:
+                break
+            batch = [request]
+            size = len(request[0])
+            # anything that arrives within the window rides along in the same transaction
+            deadline = time.monotonic() + self.coalesce_window
+            while size < self.max_batch_orders:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._writes.get(timeout=timeout) if timeout > 0 else self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._commit(batch)
+
+    def _commit(self, batch):
+        batch = [(orders, future) for orders, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            order_ids = database.insert_orders([order for orders, _ in batch for order in orders],
+                                               self.connection_manager)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # one bad request must not fail the ones it was coalesced with
+            logger.warning('coalesced insert of %d requests failed, retrying them one by one', len(batch))
+            self._commit_each(batch)
+            return
+        start = 0
+        for orders, future in batch:
+            future.set_result(order_ids[start:start + len(orders)])
+            start += len(orders)
+
+    def _commit_each(self, batch):
+        for orders, future in batch:
+            try:
+                future.set_result(database.insert_orders(orders, self.connection_manager))
+            except Exception as e:
+                future.set_exception(e)
@@ -0,0 +1,135 @@
+# spans for hot code paths that cost next to nothing when nobody looks at them
+#
+# tracer.span() and @tracer.traced() open a real span only when the verbosity asks for the level of the call
+# and the enclosing trace is sampled. Otherwise they hand back one shared no-op context manager: no context
+# is attached, no attributes dict is built, no span object is allocated. Traces that are only recorded, for
+# keeping their errors (PIZZA_TRACE_KEEP_ERRORS), still get their REQUEST level spans but no STEP level ones.
+#
+# PIZZA_TRACE_VERBOSITY
+#   off      no spans from these helpers at all
+#   request  spans for REQUEST level calls only, STEP level calls are skipped
+#   events   REQUEST level spans, every STEP level call becomes an event with its duration on the enclosing span
+#   step     spans for every call (default)
+
+import functools
+import inspect
+import os
+import time
+
+from opentelemetry import trace
+from opentelemetry.trace import INVALID_SPAN, Span, get_current_span
+
+REQUEST = 1
+STEP = 2
+
+VERBOSITIES = {
+    # verbosity: (highest level that gets a span, highest level that gets an event)
+    'off': (0, 0),
+    'request': (REQUEST, REQUEST),
+    'events': (REQUEST, STEP),
+    'step': (STEP, STEP),
+}
+PIZZA_TRACE_VERBOSITY = os.environ.get('PIZZA_TRACE_VERBOSITY', 'step')
+
+_span_level, _event_level = 0, 0
+
+
+def set_verbosity(verbosity: str):
+    global _span_level, _event_level
+    if verbosity not in VERBOSITIES:
+        raise ValueError(f'unknown trace verbosity {verbosity!r}, expected one of {", ".join(VERBOSITIES)}')
+    _span_level, _event_level = VERBOSITIES[verbosity]
+
+
+set_verbosity(PIZZA_TRACE_VERBOSITY)
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return INVALID_SPAN
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP = _Noop()
+
+
+class _StepEvent:
+    """Times the block and adds it as one event to the span it runs in, instead of a span of its own."""
+    __slots__ = ('parent', 'name', 'attributes', 'start')
+
+    def __init__(self, parent: Span, name: str, attributes: dict):
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self.parent
+
+    def __exit__(self, exc_type, exc, traceback):
+        attributes = {'duration_ms': (time.perf_counter_ns() - self.start) / 1e6}
+        if self.attributes:
+            attributes.update(self.attributes)
+        if exc_type is not None:
+            attributes['exception.type'] = exc_type.__qualname__
+        self.parent.add_event(self.name, attributes)
+        return False
+
+
+class Tracer:
+    def __init__(self, tracer: trace.Tracer):
+        self.tracer = tracer
+
+    def span(self, name: str, level: int = STEP, attributes: dict = None, **options):
+        """
+        Context manager for a span around a block. options go to start_as_current_span, for example links.
+        The block sees the span, the parent span for events, or an invalid span when nothing is recorded.
+        """
+        if level > _span_level:
+            if level > _event_level:
+                return NOOP
+            parent = get_current_span()
+            if not parent.is_recording() or not parent.get_span_context().trace_flags.sampled:
+                return NOOP
+            return _StepEvent(parent, name, attributes)
+        parent = get_current_span()
+        if parent is not INVALID_SPAN and not parent.get_span_context().trace_flags.sampled:
+            # the trace was sampled out further up, its children would not be exported either; only a request
+            # span of a trace that is recorded anyway can still end up exported, when it fails or runs long
+            if level > REQUEST or not parent.is_recording():
+                return NOOP
+        return self.tracer.start_as_current_span(name, attributes=attributes, **options)
+
+    def traced(self, name: str = None, level: int = STEP):
+        """Decorator version of span() for functions and coroutine functions, named after the function."""
+
+        def decorator(function):
+            span_name = name or function.__name__
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    span = self.span(span_name, level)
+                    if span is NOOP:
+                        return await function(*args, **kwargs)
+                    with span:
+                        return await function(*args, **kwargs)
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    span = self.span(span_name, level)
+                    if span is NOOP:
+                        return function(*args, **kwargs)
+                    with span:
+                        return function(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+
+def get_tracer(name: str) -> Tracer:
+    return Tracer(trace.get_tracer(name))
+
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pizza_library import storage
+from pizza_library.functions import create_random_order
+from pizza_library.storage import ArchiveBufferFull, BlobBackend, OrderArchiver
+
+
+class FlakyBackend(BlobBackend):
+    """Fails the appends whose number is in failures, counting from 1."""
+
+    def __init__(self, failures=(), error=OSError):
+        self.failures = set(failures)
+        self.error = error
+        self.attempts = 0
+        self.blocks = []
+
+    def append(self, name: str, data: bytes):
+        self.attempts += 1
+        if self.attempts in self.failures:
+            raise self.error('storage is down')
+        self.blocks.append(data)
+
+
+class StuckBackend(BlobBackend):
+    """Hangs on every append until released, like a storage account that stopped answering."""
+
+    def __init__(self):
+        self.released = threading.Event()
+
+    def append(self, name: str, data: bytes):
+        self.released.wait()
+
+
+def test_failed_block_is_retried_alone(monkeypatch):
+    # three blocks, the second fails once: every line ends up archived exactly once
+    monkeypatch.setattr(storage, 'APPEND_BLOCK_MAX_BYTES', 10)
+    monkeypatch.setattr(storage.time, 'sleep', lambda seconds: None)
+    backend = FlakyBackend(failures={2})
+    archiver = OrderArchiver(max_delay=0.01, backend=backend)
+    archiver._flush([b'order-1', b'order-2', b'order-3'])
+    archiver.close()
+    assert b''.join(backend.blocks) == b'order-1\norder-2\norder-3\n'
+
+
+def test_full_buffer_raises_after_timeout():
+    # the archiver thread holds one order in its stuck batch, the buffer one more
+    backend = StuckBackend()
+    archiver = OrderArchiver(max_batch=1, max_delay=0.01, buffer_size=1, backend=backend)
+    order = create_random_order()
+    try:
+        with pytest.raises(ArchiveBufferFull):
+            for _ in range(3):
+                archiver.archive(order, timeout=0.1)
+        with pytest.raises(ArchiveBufferFull):
+            asyncio.run(archiver.archive_async(order, timeout=0.01))
+    finally:
+        backend.released.set()
+        archiver.close()
+
+
+def test_full_buffer_raises_after_the_default_timeout(monkeypatch):
+    monkeypatch.setattr(storage, 'ARCHIVE_TIMEOUT', 0.05)
+    backend = StuckBackend()
+    archiver = OrderArchiver(max_batch=1, max_delay=0.01, buffer_size=1, backend=backend)
+    order = create_random_order()
+    try:
+        started = time.monotonic()
+        with pytest.raises(ArchiveBufferFull):
+            for _ in range(3):
+                archiver.archive(order)
+        with pytest.raises(ArchiveBufferFull):
+            asyncio.run(archiver.archive_async(order))
+        assert time.monotonic() - started < storage.ARCHIVE_TIMEOUT * 3 + 1
+    finally:
+        backend.released.set()
+        archiver.close()
+
+
+def test_orders_longer_than_a_block_are_refused(monkeypatch):
+    monkeypatch.setattr(storage, 'APPEND_BLOCK_MAX_BYTES', 10)
+    backend = FlakyBackend()
+    archiver = OrderArchiver(max_delay=0.01, backend=backend)
+    order = create_random_order()
+    with pytest.raises(ValueError):
+        archiver.archive(order)
+    with pytest.raises(ValueError):
+        asyncio.run(archiver.archive_async(order, payload=b'x' * 10))
+    archiver.archive(order, payload=b'x' * 9)
+    archiver.close()
+    assert backend.blocks == [b'x' * 9 + b'\n']
+
+
+def test_refused_block_is_dropped_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(storage, 'APPEND_BLOCK_MAX_BYTES', 10)
+    monkeypatch.setattr(storage.time, 'sleep', lambda seconds: None)
+    backend = FlakyBackend(failures=range(2, 2 + storage.ARCHIVE_MAX_ATTEMPTS))
+    archiver = OrderArchiver(max_delay=0.01, backend=backend)
+    archiver._flush([b'order-1', b'order-2', b'order-3'])
+    archiver.close()
+    assert b''.join(backend.blocks) == b'order-1\norder-3\n'
+
+
+def test_unreachable_storage_is_retried_without_limit(monkeypatch):
+    monkeypatch.setattr(storage.time, 'sleep', lambda seconds: None)
+    backend = FlakyBackend(failures=range(1, 3 * storage.ARCHIVE_MAX_ATTEMPTS), error=ConnectionError)
+    archiver = OrderArchiver(max_delay=0.01, backend=backend)
+    archiver._flush([b'order-1'])
+    archiver.close()
+    assert backend.blocks == [b'order-1\n']
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from pizza_library.broadcast import DISCONNECT, DROP_OLDEST, BroadcastHub, TooManySubscribers
+
+
+def test_frames_reach_every_subscriber():
+    async def main():
+        hub = BroadcastHub()
+        first, second = hub.subscribe(), hub.subscribe()
+        hub.publish(b'a')
+        hub.publish(b'b')
+        assert await first.get(1) == ([b'a', b'b'], 0)
+        assert await second.get(1) == ([b'a', b'b'], 0)
+        assert await first.get(0.01) == ([], 0)
+    asyncio.run(main())
+
+
+def test_slow_subscriber_loses_the_oldest_frames():
+    async def main():
+        hub = BroadcastHub(max_buffer=2, drop=DROP_OLDEST)
+        slow = hub.subscribe()
+        for frame in (b'a', b'b', b'c', b'd'):
+            hub.publish(frame)
+        assert await slow.get(1) == ([b'c', b'd'], 2)
+        assert not slow.closed
+    asyncio.run(main())
+
+
+def test_slow_subscriber_is_disconnected():
+    async def main():
+        hub = BroadcastHub(max_buffer=2, drop=DISCONNECT)
+        slow, fast = hub.subscribe(), hub.subscribe()
+        hub.publish(b'a')
+        hub.publish(b'b')
+        assert await fast.get(1) == ([b'a', b'b'], 0)
+        hub.publish(b'c')
+        assert slow.closed
+        assert await slow.get(1) is None
+        assert await fast.get(1) == ([b'c'], 0)
+        assert hub.stats()['subscribers'] == 1
+    asyncio.run(main())
+
+
+def test_unknown_drop_policy_is_refused():
+    with pytest.raises(ValueError):
+        BroadcastHub(drop='newest')
+
+
+def test_subscribers_are_limited():
+    hub = BroadcastHub(max_subscribers=1)
+    subscription = hub.subscribe()
+    assert hub.full()
+    with pytest.raises(TooManySubscribers):
+        hub.subscribe()
+    subscription.close()
+    assert not hub
+
+
+def test_close_ends_waiting_and_later_subscriptions():
+    async def main():
+        hub = BroadcastHub()
+        subscription = hub.subscribe()
+        hub.publish(b'a')
+        waiting = asyncio.ensure_future(hub.subscribe().get())
+        await asyncio.sleep(0)
+        hub.close()
+        # what was buffered is still read, then the subscription ends
+        assert await subscription.get(1) == ([b'a'], 0)
+        assert await subscription.get(1) is None
+        assert await asyncio.wait_for(waiting, 1) is None
+        assert await hub.subscribe().get(1) is None
+        assert not hub
+    asyncio.run(main())
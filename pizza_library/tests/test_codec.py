@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from pizza_library.codec import FORMAT_BINARY, FORMAT_JSON, MAGIC, CodecError, decode_binary, decode_envelope, \
+    decode_order, encode_batch, encode_binary, encode_envelope, encode_order, iter_decode_batch
+from pizza_library.functions import create_random_order, create_random_orders
+
+
+@pytest.fixture
+def orders():
+    return list(create_random_orders(50, seed=3))
+
+
+def test_json_is_what_pydantic_produces(orders):
+    for order in orders:
+        assert encode_order(order) == order.model_dump_json().encode()
+        assert decode_order(encode_order(order)) == order
+
+
+def test_binary_round_trip(orders):
+    for order in orders:
+        assert decode_binary(encode_binary(order)) == ('order', order)
+
+
+def test_binary_round_trip_of_long_strings():
+    order = create_random_order()
+    order.recipient_name = 'Pizzeria Ümlaut ' * 40
+    assert decode_binary(encode_binary(order))[1] == order
+
+
+@pytest.mark.parametrize('format', [FORMAT_JSON, FORMAT_BINARY])
+def test_envelope_round_trip(format):
+    order = create_random_order()
+    assert decode_envelope(encode_envelope(order, format)) == ('order', order)
+
+
+def test_envelope_reuses_the_payload():
+    order = create_random_order()
+    assert encode_envelope(order, payload=encode_order(order)) == encode_envelope(order)
+
+
+def test_legacy_envelope_without_version():
+    order = create_random_order()
+    legacy = json.dumps({'type': 'order', 'data': order.model_dump(mode='json')})
+    assert decode_envelope(legacy) == ('order', order)
+
+
+def test_other_message_types_pass_through():
+    assert decode_envelope(b'{"type":"refund","data":{"amount":3}}') == ('refund', {'amount': 3})
+
+
+@pytest.mark.parametrize('data', [
+    b'not json',
+    b'{"type":"order","v":1,"data":{"pizzas":[]}}',
+    b'{"type":"order","v":2,"data":%s}' % create_random_order().model_dump_json().encode(),
+    b'{"data":{}}',
+])
+def test_invalid_envelopes_are_refused(data):
+    with pytest.raises(CodecError):
+        decode_envelope(data)
+
+
+def test_corrupt_binary_messages_are_refused():
+    message = encode_binary(create_random_order())
+    for data in (MAGIC, message[:-3], message + b'\x00', b'xx' + message[2:], MAGIC + b'\x02\x00' + message[4:]):
+        with pytest.raises(CodecError):
+            decode_binary(data)
+
+
+def test_unknown_format_is_refused():
+    with pytest.raises(ValueError):
+        encode_envelope(create_random_order(), 'xml')
+
+
+@pytest.mark.parametrize('format', [FORMAT_JSON, FORMAT_BINARY])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_batch_round_trip_in_any_chunking(orders, format, chunk_size):
+    batch = encode_batch(orders, format)
+    chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+    assert list(iter_decode_batch(chunks, format)) == orders
+
+
+def test_truncated_binary_batch_is_refused(orders):
+    batch = encode_batch(orders, FORMAT_BINARY)
+    with pytest.raises(CodecError):
+        list(iter_decode_batch([batch[:-1]], FORMAT_BINARY))
+
+
+def test_invalid_line_in_batch_is_refused(orders):
+    with pytest.raises(CodecError):
+        list(iter_decode_batch([encode_batch(orders) + b'{}\n']))
+
+
+@pytest.mark.parametrize('format', [FORMAT_JSON, FORMAT_BINARY])
+def test_long_message_across_many_chunks(orders, format):
+    long = create_random_order()
+    long.recipient_name = 'x' * 100_000
+    batch = encode_batch([orders[0], long, orders[1]], format)
+    chunks = [batch[i:i + 100] for i in range(0, len(batch), 100)]
+    assert list(iter_decode_batch(chunks, format)) == [orders[0], long, orders[1]]
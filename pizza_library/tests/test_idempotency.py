@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from pizza_library import idempotency
+from pizza_library.idempotency import EXECUTED, JOINED, REPLAYED, IdempotencyStore
+
+
+class Work:
+    """Counts its runs and holds every run until released."""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.runs = 0
+        self.released = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.released.wait()
+        if self.fail:
+            raise RuntimeError('oven is cold')
+        return self.runs
+
+
+def test_concurrent_repeats_share_one_run():
+    async def main():
+        store, work = IdempotencyStore(), Work()
+        requests = [asyncio.ensure_future(store.run('key', work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        work.released.set()
+        answers = await asyncio.gather(*requests)
+        assert work.runs == 1
+        assert sorted(answer for _, answer in answers) == [EXECUTED] + [JOINED] * 4
+        assert {result for result, _ in answers} == {1}
+        assert await store.run('key', work) == (1, REPLAYED)
+    asyncio.run(main())
+
+
+def test_failures_are_not_kept():
+    async def main():
+        store, work = IdempotencyStore(), Work(fail=True)
+        work.released.set()
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await store.run('key', work)
+        assert work.runs == 2
+        assert len(store) == 0
+    asyncio.run(main())
+
+
+def test_a_client_giving_up_does_not_cancel_the_work():
+    async def main():
+        store, work = IdempotencyStore(), Work()
+        first = asyncio.ensure_future(store.run('key', work))
+        second = asyncio.ensure_future(store.run('key', work))
+        await asyncio.sleep(0)
+        first.cancel()
+        work.released.set()
+        assert await second == (1, JOINED)
+        assert await store.run('key', work) == (1, REPLAYED)
+    asyncio.run(main())
+
+
+def test_results_expire(monkeypatch):
+    async def main():
+        store, work = IdempotencyStore(ttl=10), Work()
+        work.released.set()
+        now = idempotency.time.monotonic()
+        assert await store.run('key', work) == (1, EXECUTED)
+        monkeypatch.setattr(idempotency.time, 'monotonic', lambda: now + 11)
+        assert await store.run('key', work) == (2, EXECUTED)
+    asyncio.run(main())
+
+
+def test_oldest_keys_are_evicted():
+    async def main():
+        store, work = IdempotencyStore(max_keys=2), Work()
+        work.released.set()
+        for key in ('a', 'b', 'c'):
+            await store.run(key, work)
+        assert len(store) == 2
+        assert (await store.run('a', work))[1] == EXECUTED
+        assert (await store.run('c', work))[1] == REPLAYED
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import Future
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+
+from pizza_library import functions
+from pizza_library.functions import KitchenExecutor, fib
+
+
+def _record_traces():
+    # initializer of the spawned workers
+    trace.set_tracer_provider(TracerProvider())
+
+
+def _current_trace_id(_):
+    return trace.get_current_span().get_span_context().trace_id
+
+
+def _done(result) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def test_workers_continue_the_trace_of_the_caller():
+    tracer = TracerProvider().get_tracer(__name__)
+    kitchen = KitchenExecutor(workers=1, initializer=_record_traces)
+    try:
+        # the cache is off by default: both calls run in the worker, each under its own trace
+        for _ in range(2):
+            with tracer.start_as_current_span('request') as span:
+                assert kitchen.run(_current_trace_id, 1) == span.get_span_context().trace_id
+    finally:
+        kitchen.shutdown()
+
+
+def test_cache_keeps_the_most_recent_results():
+    kitchen = KitchenExecutor(workers=1, cache_size=2)
+    for n in (1, 2, 3):
+        kitchen._remember((fib.__module__, fib.__qualname__, (n,)), _done(fib(n)))
+    # a hit is answered without starting the pool and counts as recent use
+    assert kitchen.submit(fib, 2).result() == 1
+    kitchen._remember((fib.__module__, fib.__qualname__, (4,)), _done(fib(4)))
+    assert [args for _, _, args in kitchen._cache] == [(2,), (4,)]
+    assert kitchen._pool is None
+
+
+def test_failed_and_cancelled_steps_are_not_cached():
+    kitchen = KitchenExecutor(workers=1, cache_size=2)
+    failed, cancelled = Future(), Future()
+    failed.set_exception(RuntimeError('oven is cold'))
+    cancelled.cancel()
+    kitchen._remember(('m', 'f', (1,)), failed)
+    kitchen._remember(('m', 'f', (2,)), cancelled)
+    assert not kitchen._cache
+
+
+def test_shutdown_without_waiting_cancels_queued_steps():
+    kitchen = KitchenExecutor(workers=1)
+    futures = [kitchen.submit(time.sleep, 0.5) for _ in range(6)]
+    kitchen.shutdown(wait=False)
+    assert kitchen._pool is None
+    # the pool cancels what its workers have not picked up yet, from its own thread
+    deadline = time.monotonic() + 30
+    while not all(future.done() for future in futures) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert any(future.cancelled() for future in futures)
+    # the next step starts a new pool
+    assert kitchen.run(fib, 10) == 55
+    kitchen.shutdown()
+
+
+def test_shutdown_kitchen_forgets_the_shared_kitchen(monkeypatch):
+    monkeypatch.setattr(functions, '_kitchen', None)
+    kitchen = functions.get_kitchen()
+    assert functions.get_kitchen() is kitchen
+    functions.shutdown_kitchen()
+    assert functions.get_kitchen() is not kitchen
+    assert kitchen._pool is None
+    functions.shutdown_kitchen()
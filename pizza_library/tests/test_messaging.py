@@ -0,0 +1,86 @@
+from concurrent.futures import Future
+
+import pytest
+from azure.servicebus.exceptions import MessageSizeExceededError, ServiceBusConnectionError
+
+from pizza_library import messaging
+from pizza_library.messaging import ServiceBusBackend
+
+
+class FakeBatch:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bodies = []
+
+    def add_message(self, message):
+        body = b''.join(message.body)
+        if sum(map(len, self.bodies)) + len(body) > self.max_bytes:
+            raise MessageSizeExceededError(message='batch is full')
+        self.bodies.append(body)
+
+
+class FakeSender:
+    """Batches of at most max_bytes; the sends whose number is in failures break the link, counting from 1."""
+
+    def __init__(self, max_bytes: int = 10, failures=()):
+        self.max_bytes = max_bytes
+        self.failures = set(failures)
+        self.sends = 0
+        self.sent = []
+
+    def create_message_batch(self):
+        return FakeBatch(self.max_bytes)
+
+    def send_messages(self, batch):
+        self.sends += 1
+        if self.sends in self.failures:
+            raise ServiceBusConnectionError(message='link detached')
+        self.sent.extend(batch.bodies)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sender():
+    return FakeSender()
+
+
+@pytest.fixture
+def backend(monkeypatch, sender):
+    monkeypatch.setattr(messaging.time, 'sleep', lambda seconds: None)
+    backend = ServiceBusBackend(connection_string='Endpoint=sb://test/', queue_name='orders')
+    # every reconnect gets the same sender, so what it received adds up across attempts
+    monkeypatch.setattr(backend, '_connect', lambda: sender)
+    return backend
+
+
+def _items(*bodies):
+    return [(body, Future()) for body in bodies]
+
+
+def test_oversized_message_fails_alone(backend, sender):
+    items = _items(b'1234', b'x' * 11, b'5678')
+    backend._send_batch(items)
+    assert sender.sent == [b'1234', b'5678']
+    assert items[0][1].result() is None
+    assert isinstance(items[1][1].exception(), MessageSizeExceededError)
+    assert items[2][1].result() is None
+
+
+def test_broken_link_resends_only_unsent_messages(backend, sender):
+    # four batches of two, the second send breaks the link once
+    sender.failures = {2}
+    items = _items(*[b'%04d' % number for number in range(8)])
+    backend._send_batch(items)
+    assert sender.sent == [b'%04d' % number for number in range(8)]
+    assert all(future.result() is None for _, future in items)
+
+
+def test_messages_fail_after_the_last_attempt(backend, sender):
+    sender.failures = {2, 3, 4}
+    items = _items(*[b'%04d' % number for number in range(4)])
+    backend._send_batch(items)
+    # the first batch was accepted before the link broke for good
+    assert sender.sent == [b'0000', b'0001']
+    assert [future.exception() is None for _, future in items] == [True, True, False, False]
@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+from pizza_library.database import MIGRATIONS, ConnectionManager, get_order, get_order_by_id, get_orders, \
+    get_sales_by_size, initialize_database, insert_orders
+from pizza_library.functions import create_random_orders
+from pizza_library.models import SizeEnum
+
+# the tables as the first release of the shop created them
+BASELINE_SCHEMA = '''
+    CREATE TABLE ingredients (id INTEGER PRIMARY KEY, unit_of_measure TEXT, name TEXT, type TEXT, price_per_unit REAL);
+    CREATE TABLE pizzas (id INTEGER PRIMARY KEY, size TEXT, price REAL, description TEXT);
+    CREATE TABLE pizza_ingredients (pizza_id INTEGER, ingredient_id INTEGER);
+    CREATE TABLE orders (id INTEGER PRIMARY KEY, recipient_name TEXT, position INTEGER);
+    CREATE TABLE order_items (order_id INTEGER, pizza_id INTEGER);
+
+    -- the same ingredient stored twice, with the prices of two orders
+    INSERT INTO ingredients VALUES (1, 'grams', 'Tomato', 'Spice', 0.5), (2, 'grams', 'Tomato', 'Spice', 0.9);
+    INSERT INTO pizzas VALUES (1, 'Small', 8.0, 'Pizza 1'), (2, 'Large', 12.0, 'Pizza 2');
+    INSERT INTO pizza_ingredients VALUES (1, 1), (2, 2);
+    INSERT INTO orders VALUES (1, 'Ada', 1), (2, 'Bob', 2);
+    INSERT INTO order_items VALUES (1, 1), (2, 2);
+'''
+
+
+@pytest.fixture
+def baseline_database(tmp_path):
+    path = str(tmp_path / 'orders.db')
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.close()
+    database = ConnectionManager(path)
+    yield database
+    database.close()
+
+
+def _columns(database: ConnectionManager, table: str) -> set:
+    return {row[1] for row in database.connection().execute(f"PRAGMA table_info({table})")}
+
+
+def test_baseline_file_is_migrated(baseline_database):
+    initialize_database(baseline_database)
+
+    connection = baseline_database.connection()
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert 'uid' in _columns(baseline_database, 'orders')
+    assert connection.execute("SELECT COUNT(*) FROM ingredients").fetchone()[0] == 1
+    # interning merged the rows before orders kept their prices, both get the price of the surviving row
+    assert get_order_by_id(1, baseline_database).pizzas[0].ingredients[0].price_per_unit == 0.5
+    assert get_order_by_id(2, baseline_database).pizzas[0].ingredients[0].price_per_unit == 0.5
+    assert get_sales_by_size(baseline_database)[SizeEnum.LARGE].revenue == 12.0
+    # rows of before the uid column read back with a generated id, and with enum members
+    batched = get_orders([1, 2], baseline_database)
+    assert batched[1].id and batched[1].id != batched[2].id
+    assert batched[2].pizzas[0].size is SizeEnum.LARGE
+
+
+def test_migrated_file_takes_new_orders(baseline_database):
+    initialize_database(baseline_database)
+    orders = list(create_random_orders(20, seed=7))
+    order_ids = insert_orders(orders, baseline_database)
+    assert get_orders(order_ids, baseline_database) == dict(zip(order_ids, orders))
+
+
+def test_initialize_is_idempotent(tmp_path):
+    database = ConnectionManager(str(tmp_path / 'fresh.db'))
+    try:
+        initialize_database(database)
+        initialize_database(database)
+        assert database.connection().execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        assert 'price_per_unit' in _columns(database, 'pizza_ingredients')
+    finally:
+        database.close()
+
+
+def test_orders_read_back_unchanged(tmp_path):
+    database = ConnectionManager(str(tmp_path / 'fresh.db'))
+    try:
+        initialize_database(database)
+        orders = list(create_random_orders(200, seed=1))
+        order_ids = insert_orders(orders, database)
+        assert get_orders(order_ids, database) == dict(zip(order_ids, orders))
+        assert get_order_by_id(order_ids[0], database) == orders[0]
+    finally:
+        database.close()
+
+
+def test_get_order_keeps_the_cursor_signature(tmp_path):
+    database = ConnectionManager(str(tmp_path / 'fresh.db'))
+    try:
+        initialize_database(database)
+        orders = list(create_random_orders(3, seed=2))
+        order_ids = insert_orders(orders, database)
+        cursor = database.connection().cursor()
+        with pytest.deprecated_call():
+            assert get_order(cursor, order_ids[1]) == orders[1]
+    finally:
+        database.close()
@@ -0,0 +1,27 @@
+import pytest
+
+from pizza_library.database import QUERY_PLAN_CHECKS, ConnectionManager, QueryPlanError, check_query_plans, \
+    explain_query_plan, initialize_database
+
+
+@pytest.fixture
+def database():
+    database = ConnectionManager(':memory:')
+    initialize_database(database)
+    yield database
+    database.close()
+
+
+def test_read_queries_use_indexes(database):
+    plans = check_query_plans(database)
+    assert set(plans) == set(QUERY_PLAN_CHECKS)
+
+
+def test_dropped_index_is_reported(database):
+    database.connection().execute("DROP INDEX idx_order_items_order")
+    with pytest.raises(QueryPlanError, match='get_orders_pizzas'):
+        check_query_plans(database)
+
+
+def test_explain_query_plan_lists_details(database):
+    assert any('USING' in detail for detail in explain_query_plan("SELECT * FROM orders WHERE id = ?", (1,), database))
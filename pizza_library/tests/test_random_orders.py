@@ -0,0 +1,36 @@
+from pizza_library.codec import encode_order
+from pizza_library.functions import create_random_orders
+from pizza_library.models import Ingredient, Order, TypeEnum, construct
+
+
+def test_json_is_what_the_models_dump_to():
+    orders = list(create_random_orders(2_000, seed=5, chunk_size=700))
+    payloads = list(create_random_orders(2_000, seed=5, as_json=True, chunk_size=700))
+    assert [encode_order(order) for order in orders] == payloads
+    assert Order.model_validate_json(payloads[0]) == orders[0]
+
+
+def test_same_seed_same_orders():
+    assert list(create_random_orders(50, seed=9)) == list(create_random_orders(50, seed=9))
+    assert list(create_random_orders(50, seed=9)) != list(create_random_orders(50, seed=10))
+
+
+def test_orders_are_shaped_like_create_random_order_ones():
+    for order in create_random_orders(500, seed=1):
+        assert 1 <= len(order.pizzas) <= 4
+        names = set()
+        for pizza in order.pizzas:
+            assert 5.0 <= pizza.price <= 20.0
+            assert 1 <= len(pizza.ingredients) <= 5
+            assert len({ingredient.name for ingredient in pizza.ingredients}) == len(pizza.ingredients)
+            names.update(ingredient.name for ingredient in pizza.ingredients)
+        assert len(names) <= 5
+
+
+def test_constructed_models_have_their_own_fields_set():
+    values = {'unit_of_measure': 'grams', 'name': 'Tomato', 'type': TypeEnum.SPICE, 'price_per_unit': 0.5}
+    first, second = construct(Ingredient, dict(values)), construct(Ingredient, dict(values))
+    assert first == Ingredient(**values)
+    first.model_fields_set.discard('name')
+    assert 'name' in second.model_fields_set
+    assert first.model_dump(exclude_unset=True).keys() == {'unit_of_measure', 'type', 'price_per_unit'}
@@ -0,0 +1,118 @@
+import asyncio
+from concurrent.futures import Future
+
+import pytest
+
+from pizza_library import database
+from pizza_library.database import ConnectionManager, get_order_by_id, initialize_database
+from pizza_library.functions import create_random_orders
+from pizza_library.store import OrderStore
+
+
+@pytest.fixture
+def connection_manager(tmp_path):
+    manager = ConnectionManager(str(tmp_path / 'orders.db'))
+    initialize_database(manager)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    """The number of orders of every insert the writer makes; inserts with an order named 'bad' fail."""
+    sizes = []
+    insert_orders = database.insert_orders
+
+    def counting_insert_orders(orders, manager=None):
+        orders = list(orders)
+        sizes.append(len(orders))
+        if any(order.recipient_name == 'bad' for order in orders):
+            raise ValueError('bad order')
+        return insert_orders(orders, manager)
+
+    monkeypatch.setattr(database, 'insert_orders', counting_insert_orders)
+    return sizes
+
+
+def _orders(n: int, seed: int = 1) -> list:
+    return list(create_random_orders(n, seed=seed))
+
+
+def _queue(store: OrderStore, orders: list) -> Future:
+    # what insert_orders hands the writer, without waiting for it
+    future = Future()
+    store._writes.put((orders, future))
+    return future
+
+
+def test_requests_within_the_window_share_a_transaction(connection_manager, inserts):
+    async def main():
+        async with OrderStore(connection_manager, coalesce_window=0.2) as store:
+            requests = [_orders(2, seed) for seed in range(3)]
+            order_ids = await asyncio.gather(*(store.insert_orders(orders) for orders in requests))
+            assert inserts == [6]
+            for orders, ids in zip(requests, order_ids):
+                assert [await store.get_order(order_id) for order_id in ids] == orders
+    asyncio.run(main())
+
+
+def test_batches_stop_at_max_batch_orders(connection_manager, inserts):
+    store = OrderStore(connection_manager, coalesce_window=0.2, max_batch_orders=3)
+    futures = [_queue(store, _orders(2, seed)) for seed in range(3)]
+    store.start()
+    order_ids = [future.result(10) for future in futures]
+    store.close()
+    assert inserts == [4, 2]
+    assert sorted(order_id for ids in order_ids for order_id in ids) == list(range(1, 7))
+
+
+def test_failed_coalesced_insert_is_retried_one_by_one(connection_manager, inserts):
+    store = OrderStore(connection_manager, coalesce_window=0.2)
+    bad = _orders(1, seed=9)
+    bad[0].recipient_name = 'bad'
+    first, failing, last = _queue(store, _orders(2, seed=1)), _queue(store, bad), _queue(store, _orders(1, seed=2))
+    store.start()
+    with pytest.raises(ValueError):
+        failing.result(10)
+    assert len(first.result(10)) == 2 and len(last.result(10)) == 1
+    store.close()
+    assert inserts == [4, 2, 1, 1]
+    assert get_order_by_id(last.result()[0], connection_manager) == _orders(1, seed=2)[0]
+
+
+def test_single_failed_request_is_not_retried(connection_manager, inserts):
+    store = OrderStore(connection_manager).start()
+    bad = _orders(1)
+    bad[0].recipient_name = 'bad'
+    with pytest.raises(ValueError):
+        _queue(store, bad).result(10)
+    store.close()
+    assert inserts == [1]
+
+
+def test_cancelled_requests_are_not_written(connection_manager, inserts):
+    store = OrderStore(connection_manager, coalesce_window=0.2)
+    cancelled = _queue(store, _orders(3, seed=1))
+    cancelled.cancel()
+    kept = _queue(store, _orders(1, seed=2))
+    store.start()
+    assert kept.result(10) == [1]
+    store.close()
+    assert inserts == [1]
+
+    # a batch of nothing but cancelled requests is not written at all
+    store = OrderStore(connection_manager, coalesce_window=0.2)
+    _queue(store, _orders(1)).cancel()
+    store.start()
+    store.close()
+    assert inserts == [1]
+
+
+def test_close_commits_the_pending_writes(connection_manager, inserts):
+    store = OrderStore(connection_manager, coalesce_window=5.0).start()
+    futures = [_queue(store, _orders(1, seed)) for seed in range(3)]
+    # the window is long, close must not wait it out
+    store.close()
+    assert all(future.done() for future in futures)
+    assert sorted(future.result()[0] for future in futures) == [1, 2, 3]
+    assert store._writer is None
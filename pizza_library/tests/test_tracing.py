@@ -0,0 +1,51 @@
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags
+
+from pizza_library import tracing
+from pizza_library.startup import create_sampler
+
+
+@pytest.fixture(autouse=True)
+def step_verbosity():
+    tracing.set_verbosity('step')
+    yield
+    tracing.set_verbosity(tracing.PIZZA_TRACE_VERBOSITY)
+
+
+def _tracer(sampler) -> tracing.Tracer:
+    return tracing.Tracer(TracerProvider(sampler=sampler).get_tracer(__name__))
+
+
+def test_steps_of_sampled_traces_are_spans():
+    tracer = _tracer(create_sampler(1.0))
+    with tracer.span('request', level=tracing.REQUEST):
+        assert tracer.span('step') is not tracing.NOOP
+
+
+def test_steps_of_unsampled_traces_are_skipped():
+    tracer = _tracer(create_sampler(0.0, keep_errors=False, slow_span_ms=0))
+    with tracer.span('request', level=tracing.REQUEST):
+        assert tracer.span('step') is tracing.NOOP
+
+
+def test_recorded_but_unsampled_traces_keep_only_request_spans():
+    # keeping errors records the unsampled trace, its steps would still never be exported
+    tracer = _tracer(create_sampler(0.0, keep_errors=True, slow_span_ms=0))
+    with tracer.span('request', level=tracing.REQUEST):
+        assert trace.get_current_span().is_recording()
+        assert tracer.span('step') is tracing.NOOP
+        assert tracer.span('nested request', level=tracing.REQUEST) is not tracing.NOOP
+    tracing.set_verbosity('events')
+    with tracer.span('request', level=tracing.REQUEST):
+        assert tracer.span('step') is tracing.NOOP
+
+
+def test_steps_under_a_sampled_remote_parent_are_spans():
+    # what a kitchen worker sees: the context of the shop's span, which is not recording in this process
+    tracer = _tracer(create_sampler(1.0))
+    parent = SpanContext(trace_id=1, span_id=2, is_remote=True, trace_flags=TraceFlags(TraceFlags.SAMPLED))
+    with trace.use_span(NonRecordingSpan(parent)):
+        with tracer.span('step') as span:
+            assert span.get_span_context().trace_id == 1
@@ -1,5 +1,4 @@
 import logging
-import os
 import time
 import random
 
@@ -12,25 +11,28 @@ SERVICE_NAME = 'pizza_maker'
 setup_telemetry(SERVICE_NAME)
 
 logging.info("Starting application")
-from azure.servicebus import ServiceBusClient
+from pizza_library.codec import CodecError, decode_envelope
+from pizza_library.messaging import receive_pizza_data
 
 logger = logging.getLogger(SERVICE_NAME)
 logger.setLevel(logging.INFO)
 meter = metrics.get_meter_provider().get_meter(SERVICE_NAME)
 pizza_counter = meter.create_counter("pizza_made_counter", "number of pizzas made", "pizzas")
 tracer = trace.get_tracer(SERVICE_NAME)
-pizza_order_queue_name = os.getenv('PIZZA_ORDER_QUEUE_NAME')
-pizza_order_connection_string = os.getenv('PIZZA_ORDER_CONNECTION_STRING')
 
 # with tracer.start_as_current_span("shift_start"):
-with ServiceBusClient.from_connection_string(pizza_order_connection_string) as client:
-    with client.get_queue_receiver(queue_name=pizza_order_queue_name, max_wait_time=5) as receiver:
-        # Receive all messages
-        for msg in receiver:
-            logger.info('starting to make a pizza %s', msg)
-            # todo get len of pizzas to increase counter
-            pizza_counter.add(1)
-            logger.info('finished making pizza %s', msg)
-            receiver.complete_message(msg)
+# Receive all messages, the transport is picked by PIZZA_MESSAGING_BACKEND (Service Bus in production)
+for msg in receive_pizza_data(max_wait_time=5):
+    try:
+        message_type, order = decode_envelope(msg)
+    except CodecError:
+        logger.exception('skipping a message that is not a pizza order')
+        continue
+    if message_type != 'order':
+        logger.info('skipping a %s message', message_type)
+        continue
+    logger.info('starting to make the %d pizzas of order %s', len(order.pizzas), order.id)
+    pizza_counter.add(len(order.pizzas))
+    logger.info('finished making the pizzas of order %s', order.id)
 logger.info('shift end')
 print('time to go home')
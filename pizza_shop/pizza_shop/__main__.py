@@ -1,24 +1,29 @@
-import logging
 import os
 
 from uvicorn import run
 
-from pizza_library.startup import setup_telemetry
-from pizza_shop import SERVICE_NAME
-
-setup_telemetry(SERVICE_NAME)
-
-logger = logging.getLogger(SERVICE_NAME)
-
-logger.info("Starting application")
-
-from pizza_shop.webapp import app
-
-# already instrumented from Azure Distro: FastAPIInstrumentor.instrument_app(app)
-print("Ready to serve")
 port = int(os.getenv('PORT', 8000))
 host = os.getenv('HOST', "0.0.0.0")
+# one worker process unless asked for more, WEB_CONCURRENCY is what hosting platforms tend to set. Every worker
+# keeps its own Idempotency-Key answers and /orders/stream feed: with more than one, retries only replay and
+# dashboards only see all orders behind a load balancer that routes every client to the same worker
+workers = int(os.getenv('WORKERS', os.getenv('WEB_CONCURRENCY', 1)))
+# seconds an idle keep-alive connection stays open, and connections the kernel queues before accept
+keep_alive = int(os.getenv('KEEP_ALIVE', 5))
+backlog = int(os.getenv('BACKLOG', 2048))
+# on SIGTERM the workers stop accepting and finish the requests in flight, for at most this many seconds
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+# auto takes uvloop and httptools when they are installed
+loop = os.getenv('LOOP', 'auto')
+http = os.getenv('HTTP_PARSER', 'auto')
+
+# the kitchen pool of every worker gets its share of the cores, not all of them
+os.environ.setdefault('PIZZA_KITCHEN_WORKERS', str(max(1, os.cpu_count() // workers)))
+
+print(f"Ready to serve on {host}:{port} with {workers} worker(s)")
+# the workers are started with spawn and import the app and its telemetry themselves, see pizza_shop.asgi
 if os.getenv('DEBUG', 'false').lower() == 'true':
-    run("pizza_shop.webapp:app", host=host, port=port, reload=True)
+    run("pizza_shop.asgi:app", host=host, port=port, reload=True)
 else:
-    run(app, host=host, port=port, reload=False)
+    run("pizza_shop.asgi:app", host=host, port=port, workers=workers, loop=loop, http=http,
+        timeout_keep_alive=keep_alive, backlog=backlog, timeout_graceful_shutdown=graceful_timeout)
@@ -0,0 +1,199 @@
+# admission control for the slow kitchen routes: a burst gets a few fast 503s instead of making every request slow
+#
+# Every guarded route has a concurrency limit. Requests over the limit wait in a bounded queue for at most
+# PIZZA_ADMISSION_QUEUE_TIMEOUT seconds; when the queue is full or the wait runs out they are answered with 503
+# and a Retry-After right away. The limit adapts AIMD style: it grows by one per limit's worth of requests
+# that finished in time, and shrinks by a tenth when one took longer than the target latency. Without
+# PIZZA_ADMISSION_TARGET_LATENCY the target is PIZZA_ADMISSION_TOLERANCE times the fastest recent latency of
+# the route, so the limit settles where requests start to queue up inside the shop.
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict
+
+from fastapi import FastAPI
+from opentelemetry import metrics
+
+PIZZA_ADMISSION_ROUTES = [route.strip() for route in
+                          os.environ.get('PIZZA_ADMISSION_ROUTES', '/make_pizza,/make_pizza_sync').split(',')
+                          if route.strip()]
+PIZZA_ADMISSION_LIMIT = int(os.environ.get('PIZZA_ADMISSION_LIMIT', 8))
+PIZZA_ADMISSION_MIN_LIMIT = int(os.environ.get('PIZZA_ADMISSION_MIN_LIMIT', 1))
+# the sync routes run in starlette's thread pool of 40 threads, more would only queue in there
+PIZZA_ADMISSION_MAX_LIMIT = int(os.environ.get('PIZZA_ADMISSION_MAX_LIMIT', 32))
+PIZZA_ADMISSION_QUEUE = int(os.environ.get('PIZZA_ADMISSION_QUEUE', 16))
+PIZZA_ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('PIZZA_ADMISSION_QUEUE_TIMEOUT', 2.0))
+PIZZA_ADMISSION_TARGET_LATENCY = float(os.environ.get('PIZZA_ADMISSION_TARGET_LATENCY', 0)) or None
+PIZZA_ADMISSION_TOLERANCE = float(os.environ.get('PIZZA_ADMISSION_TOLERANCE', 2.0))
+
+# the fastest latency is forgotten after this many seconds, so the baseline follows a slower or faster shop
+BASELINE_PERIOD = 60.0
+BACKOFF = 0.9
+
+meter = metrics.get_meter(__name__)
+admission_requests = meter.create_counter('pizza_admission_requests',
+                                          'requests to guarded routes by what admission control did', 'requests')
+
+# what happened to a request
+ADMITTED = 'admitted'
+QUEUED = 'queued'
+REJECTED = 'rejected'
+EXPIRED = 'expired'
+
+
+class AdaptiveLimit:
+    """Concurrency limit and wait queue of one route, for use from one event loop; it takes no locks."""
+
+    def __init__(self, name: str, limit: int = PIZZA_ADMISSION_LIMIT, min_limit: int = PIZZA_ADMISSION_MIN_LIMIT,
+                 max_limit: int = PIZZA_ADMISSION_MAX_LIMIT, queue_size: int = PIZZA_ADMISSION_QUEUE,
+                 queue_timeout: float = PIZZA_ADMISSION_QUEUE_TIMEOUT,
+                 target_latency: float = PIZZA_ADMISSION_TARGET_LATENCY,
+                 tolerance: float = PIZZA_ADMISSION_TOLERANCE):
+        self.name = name
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.mean_latency = 0.0
+        self.counts = dict.fromkeys((ADMITTED, QUEUED, REJECTED, EXPIRED), 0)
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_backoff = 0.0
+        # fastest latency of the current and the previous baseline period
+        self._fastest = self._previous_fastest = math.inf
+        self._period_start = time.monotonic()
+
+    def _count(self, result: str):
+        self.counts[result] += 1
+        admission_requests.add(1, {'route': self.name, 'result': result})
+
+    async def acquire(self) -> bool:
+        """True once the request may run, then release() has to follow; False when it is shed."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self._count(ADMITTED)
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self._count(REJECTED)
+            return False
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        expiry = loop.call_later(self.queue_timeout, self._expire, waiter)
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            # the client went away; a slot it was handed already goes to the next in line
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release(None)
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            expiry.cancel()
+        self._count(QUEUED if admitted else EXPIRED)
+        return admitted
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            self._discard(waiter)
+            waiter.set_result(False)
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, started: float = None):
+        """started is when the request was admitted, None leaves the limit as it is."""
+        self.in_flight -= 1
+        if started is not None:
+            self._adapt(started, time.monotonic())
+        # the slot, and any the limit grew by, go to the requests waiting longest
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def target(self) -> float:
+        if self.target_latency:
+            return self.target_latency
+        return self.tolerance * min(self._fastest, self._previous_fastest)
+
+    def _adapt(self, started: float, now: float):
+        latency = now - started
+        self.mean_latency = latency if not self.mean_latency else 0.9 * self.mean_latency + 0.1 * latency
+        if now - self._period_start > BASELINE_PERIOD:
+            self._previous_fastest, self._fastest = self._fastest, math.inf
+            self._period_start = now
+        self._fastest = min(self._fastest, latency)
+
+        if latency > self.target():
+            # one backoff per overload: requests admitted before the last backoff are slow for the same reason
+            if started >= self._last_backoff:
+                self.limit = max(self.min_limit, self.limit * BACKOFF)
+                self._last_backoff = now
+        elif self.in_flight + 1 >= int(self.limit):
+            # only a limit that was reached is worth raising
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free again."""
+        return max(1, math.ceil(self.mean_latency))
+
+    def stats(self) -> dict:
+        return dict(self.counts, limit=int(self.limit), in_flight=self.in_flight, waiting=len(self._waiters),
+                    target_ms=self.target() * 1000 if self.target() < math.inf else None,
+                    mean_latency_ms=self.mean_latency * 1000)
+
+
+class AdmissionMiddleware:
+    """Pure ASGI, shed requests never reach the router, let alone the thread pool."""
+
+    def __init__(self, app, limits: Dict[str, AdaptiveLimit]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope['path']) if scope['type'] == 'http' else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        if not await limit.acquire():
+            return await _service_unavailable(limit, send)
+        started = time.monotonic()
+        failed = True
+        try:
+            await self.app(scope, receive, send)
+            failed = False
+        finally:
+            # a failed request says nothing about how long a good one takes
+            limit.release(None if failed else started)
+
+
+async def _service_unavailable(limit: AdaptiveLimit, send):
+    body = b'{"message":"the kitchen is at capacity, try again later"}'
+    await send({
+        'type': 'http.response.start',
+        'status': 503,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', b'%d' % len(body)),
+                    (b'retry-after', b'%d' % limit.retry_after())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+limits = {route: AdaptiveLimit(route) for route in PIZZA_ADMISSION_ROUTES}
+
+
+def install(app: FastAPI):
+    """Guards the routes in PIZZA_ADMISSION_ROUTES, nothing when it is empty."""
+    if limits:
+        app.add_middleware(AdmissionMiddleware, limits=limits)
@@ -0,0 +1,20 @@
+# the shop with its telemetry, for uvicorn or any other ASGI server: "pizza_shop.asgi:app"
+#
+# Every worker process imports this module for itself, so each one sets up its own exporters and their threads
+# instead of inheriting them from the process that started it.
+
+import logging
+import os
+
+from pizza_library.startup import setup_telemetry
+from pizza_shop import SERVICE_NAME
+
+setup_telemetry(SERVICE_NAME)
+
+logger = logging.getLogger(SERVICE_NAME)
+
+logger.info("Starting application in process %d", os.getpid())
+
+from pizza_shop.webapp import app  # noqa: E402
+
+# already instrumented from Azure Distro: FastAPIInstrumentor.instrument_app(app)
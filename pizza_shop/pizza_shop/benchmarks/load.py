@@ -0,0 +1,309 @@
+# load test of the shop: boots pizza_shop.webapp:app under uvicorn with local stand-ins for its backends
+# (in-process messaging, local storage, sqlite in a temporary directory) and drives its routes over keep-alive
+# HTTP/1.1 connections, one route after the other
+#
+# python -m pizza_shop.benchmarks.load [--paths / /make_pizza /make_pizza_sync] [--mode closed|open]
+#     [--connections 16] [--rate 50] [--duration 10] [--output run.json] [--compare baseline.json]
+#
+# closed: every connection sends its next request when the previous answer arrived, which measures capacity
+#         but hides queueing, the load drops as soon as the shop slows down
+# open:   requests start at a fixed rate whatever the answers do, like independent users; latency counts from
+#         the moment a request was due, so time spent waiting for a free connection is not lost (coordinated
+#         omission)
+#
+# The server inherits the environment, PIZZA_OVEN_BAKE_TIME=0.1 for example makes /make_pizza quick enough for
+# a short run. --url measures a shop that is already running instead. With --compare, a route whose throughput
+# dropped by more than --max-regression percent against the baseline run fails the run, for CI.
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from pizza_shop.histogram import LatencyHistogram
+
+DEFAULT_PATHS = ('/', '/make_pizza', '/make_pizza_sync')
+
+
+class Connection:
+    """Minimal HTTP/1.1 client connection: GET only, bodies are read and thrown away."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+
+    async def get(self, path: str) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(b'GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path.encode(), self.host.encode()))
+        try:
+            return await self._read_response()
+        except BaseException:
+            # a half read answer leaves the connection unusable
+            self.close()
+            raise
+
+    async def _read_response(self) -> int:
+        reader = self.reader
+        status = int((await reader.readline()).split(None, 2)[1])
+        length, chunked, close = 0, False, False
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == b'content-length':
+                length = int(value)
+            elif name == b'transfer-encoding':
+                chunked = b'chunked' in value
+            elif name == b'connection':
+                close = value == b'close'
+        if chunked:
+            while size := int((await reader.readline()).split(b';')[0], 16):
+                await reader.readexactly(size + 2)
+            await reader.readline()
+        elif length:
+            await reader.readexactly(length)
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class RouteResult:
+    def __init__(self, path: str):
+        self.path = path
+        self.latency = LatencyHistogram()
+        self.errors = Counter()
+        self.elapsed = 0.0
+
+    def record(self, seconds: float, status: Optional[int] = None, error: BaseException = None):
+        self.latency.record(seconds)
+        if error is not None:
+            self.errors[type(error).__name__] += 1
+        elif not 200 <= status < 400:
+            self.errors[str(status)] += 1
+
+    def to_dict(self, mode: str) -> dict:
+        return {
+            'mode': mode,
+            'path': self.path,
+            'requests': self.latency.count,
+            'errors': dict(self.errors),
+            'seconds': self.elapsed,
+            'throughput': self.latency.count / self.elapsed if self.elapsed else 0.0,
+            'latency': self.latency.to_dict(),
+        }
+
+
+async def _request(connection: Connection, path: str, result: RouteResult, started: float):
+    try:
+        status = await connection.get(path)
+    except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+        result.record(time.perf_counter() - started, error=e)
+    else:
+        result.record(time.perf_counter() - started, status)
+
+
+async def run_closed(host: str, port: int, path: str, connections: int, duration: float) -> RouteResult:
+    result = RouteResult(path)
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def user():
+        connection = Connection(host, port)
+        try:
+            while (started := time.perf_counter()) < deadline:
+                await _request(connection, path, result, started)
+        finally:
+            connection.close()
+
+    await asyncio.gather(*[user() for _ in range(connections)])
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+async def run_open(host: str, port: int, path: str, connections: int, duration: float, rate: float,
+                   grace: float = 30.0) -> RouteResult:
+    result = RouteResult(path)
+    pool = asyncio.LifoQueue()
+    for _ in range(connections):
+        pool.put_nowait(Connection(host, port))
+
+    async def arrive(due: float):
+        # waiting for a free connection is part of the latency, the request was due already
+        connection = await pool.get()
+        try:
+            await _request(connection, path, result, due)
+        finally:
+            pool.put_nowait(connection)
+
+    start = time.perf_counter()
+    requests = set()
+    sent = 0
+    while (due := start + sent / rate) < start + duration:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(arrive(due))
+        requests.add(task)
+        task.add_done_callback(requests.discard)
+        sent += 1
+    if requests:
+        _, pending = await asyncio.wait(requests, timeout=grace)
+        for task in pending:
+            task.cancel()
+            result.record(time.perf_counter() - start, error=asyncio.TimeoutError())
+    result.elapsed = time.perf_counter() - start
+    while not pool.empty():
+        pool.get_nowait().close()
+    return result
+
+
+async def run(host: str, port: int, paths, mode: str, connections: int, duration: float, rate: float,
+              warmup: float):
+    results = []
+    for path in paths:
+        if warmup:
+            await run_closed(host, port, path, connections, warmup)
+        if mode == 'open':
+            result = await run_open(host, port, path, connections, duration, rate)
+        else:
+            result = await run_closed(host, port, path, connections, duration)
+        _report(mode, result)
+        results.append(result.to_dict(mode))
+    return results
+
+
+def _report(mode: str, result: RouteResult):
+    summary = result.latency.summary()
+    errors = sum(result.errors.values())
+    print(f'{mode:<6} {result.path:<18} {result.latency.count / result.elapsed:9.1f} req/s  '
+          f'p50 {summary["p50_ms"]:8.1f}  p90 {summary["p90_ms"]:8.1f}  p99 {summary["p99_ms"]:8.1f}  '
+          f'p99.9 {summary["p99.9_ms"]:8.1f}  max {summary["max_ms"]:8.1f} ms  errors {errors}')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(process: subprocess.Popen, host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'the shop exited with {process.returncode} before it was ready')
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'the shop did not listen on {host}:{port} within {timeout:g}s')
+
+
+@contextmanager
+def local_shop(startup_timeout: float = 60.0) -> Iterator[Tuple[str, int]]:
+    """Runs the shop in a subprocess, against stand-ins for Service Bus, Blob Storage and the database."""
+    host, port = '127.0.0.1', _free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        env = {name: value for name, value in os.environ.items()
+               if name not in ('PIZZA_ORDER_CONNECTION_STRING', 'PIZZA_STORAGE_CONNECTION_STRING',
+                               'PIZZA_STORAGE_ACCOUNT_NAME', 'PIZZA_DEBUG_TOKEN')}
+        env.update(PIZZA_MESSAGING_BACKEND='memory', PIZZA_STORAGE_BACKEND='local',
+                   PIZZA_STORAGE_LOCAL_PATH=os.path.join(directory, 'pizza_storage'),
+                   PIZZA_DATABASE_PATH=os.path.join(directory, 'pizza_orders.db'))
+        process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'pizza_shop.webapp:app', '--host', host,
+                                    '--port', str(port), '--no-access-log', '--log-level', 'warning'],
+                                   cwd=directory, env=env)
+        try:
+            _wait_until_ready(process, host, port, startup_timeout)
+            yield host, port
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def compare(results, baseline: dict, max_regression: float = None) -> list:
+    """Prints the change against a baseline run, returns the routes whose throughput regressed too much."""
+    previous = {(entry['mode'], entry['path']): entry for entry in baseline['results']}
+    regressed = []
+    for entry in results:
+        before = previous.get((entry['mode'], entry['path']))
+        if before is None or not before['throughput']:
+            continue
+        change = (entry['throughput'] / before['throughput'] - 1) * 100
+        p99_before, p99 = before['latency']['p99_ms'], entry['latency']['p99_ms']
+        print(f'{entry["mode"]:<6} {entry["path"]:<18} throughput {change:+7.1f}%  '
+              f'p99 {p99_before:8.1f} -> {p99:8.1f} ms')
+        if max_regression is not None and change < -max_regression:
+            regressed.append(entry['path'])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test of the shop routes')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed')
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=50.0, help='requests per second, open mode only')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per route')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds of closed loop load before each route')
+    parser.add_argument('--url', help='a running shop to measure, instead of booting a local one')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='fail when a route lost more than this many percent of throughput against --compare')
+    args = parser.parse_args()
+
+    def measure(host: str, port: int):
+        return asyncio.run(run(host, port, args.paths, args.mode, args.connections, args.duration, args.rate,
+                               args.warmup))
+
+    if args.url:
+        url = urlsplit(args.url)
+        results = measure(url.hostname, url.port or 80)
+    else:
+        with local_shop() as (host, port):
+            results = measure(host, port)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'config': vars(args),
+                'results': results,
+            }, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f), args.max_regression)
+        if regressed:
+            sys.exit(f'throughput regressed by more than {args.max_regression:g}%: {", ".join(regressed)}')
+
+
+if __name__ == '__main__':
+    main()
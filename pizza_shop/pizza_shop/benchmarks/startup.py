@@ -0,0 +1,11 @@
+# cold import time of the shop modules, each measured in a fresh interpreter
+# python -m pizza_shop.benchmarks.startup [--max-seconds 2.0] [--importtime]
+#
+# Same options as pizza_library.benchmarks.startup, which measures the library modules.
+
+from pizza_library.benchmarks.startup import main
+
+DEFAULT_MODULES = ('pizza_shop.webapp', 'pizza_shop.asgi')
+
+if __name__ == '__main__':
+    main(DEFAULT_MODULES)
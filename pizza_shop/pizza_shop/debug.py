@@ -0,0 +1,188 @@
+# production diagnostics for the shop, only present when PIZZA_DEBUG_TOKEN is set
+#
+# GET /debug/profile?seconds=N  samples the stacks of all threads, and with tasks=true the awaiting asyncio
+#                               tasks, for N seconds and returns them collapsed, one "frame;frame;... count"
+#                               line per stack, ready for flamegraph.pl or speedscope
+# GET /debug/stats              per route latency histograms, requests in flight, event loop lag and the
+#                               admission limits of the kitchen routes
+#
+# Both need an "Authorization: Bearer <PIZZA_DEBUG_TOKEN>" header. Without the token nothing is installed:
+# no routes, no middleware, no lag watcher. The profiler only runs while a profile request is open.
+
+import asyncio
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from pizza_shop import admission
+from pizza_shop.histogram import LatencyHistogram
+
+PIZZA_DEBUG_TOKEN = os.environ.get('PIZZA_DEBUG_TOKEN')
+PROFILE_INTERVAL = float(os.environ.get('PIZZA_DEBUG_PROFILE_INTERVAL', 0.005))
+LOOP_LAG_INTERVAL = float(os.environ.get('PIZZA_DEBUG_LOOP_LAG_INTERVAL', 0.1))
+
+
+class RequestStats:
+    """Fed by StatsMiddleware and the loop lag watcher, all updates happen on the event loop."""
+
+    def __init__(self):
+        self.routes: Dict[str, LatencyHistogram] = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.loop_lag = LatencyHistogram()
+        self.last_loop_lag = 0.0
+        self.lag_watcher: asyncio.Task = None
+
+    def record(self, route: str, seconds: float):
+        histogram = self.routes.get(route)
+        if histogram is None:
+            histogram = self.routes[route] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def watch_loop_lag(self):
+        if self.lag_watcher is None or self.lag_watcher.get_loop() is not asyncio.get_running_loop():
+            self.lag_watcher = asyncio.get_running_loop().create_task(self._watch_loop_lag(),
+                                                                      name='debug-loop-lag')
+
+    async def _watch_loop_lag(self):
+        # how late the loop wakes a sleeper up is how long callbacks wait for their turn
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.last_loop_lag = max(0.0, loop.time() - expected)
+            self.loop_lag.record(self.last_loop_lag)
+
+    def snapshot(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'routes': {route: histogram.summary() for route, histogram in sorted(self.routes.items())},
+            'event_loop_lag': dict(self.loop_lag.summary(), last_ms=self.last_loop_lag * 1000),
+        }
+
+
+class StatsMiddleware:
+    def __init__(self, app, stats: RequestStats):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stats = self.stats
+        stats.watch_loop_lag()
+        stats.in_flight += 1
+        if stats.in_flight > stats.peak_in_flight:
+            stats.peak_in_flight = stats.in_flight
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stats.in_flight -= 1
+            # the router put the matched route into the scope, its path template keeps the key count bounded
+            route = scope.get('route')
+            stats.record(f'{scope["method"]} {route.path if route is not None else "<unmatched>"}',
+                         time.perf_counter() - start)
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread from a thread of its own, one profile at a time."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._labels = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            self._labels[code] = label
+        return label
+
+    def _collapse(self, frames) -> str:
+        return ';'.join([self._label(frame.f_code) for frame in frames])
+
+    def profile(self, seconds: float, loop: asyncio.AbstractEventLoop = None) -> Counter:
+        """
+        Returns how often each stack was seen. With a loop, the stacks of its tasks that wait on an await are
+        sampled as well, under a "task <name>" root, which shows wall clock time that no thread is spending.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError('a profile is already running')
+        try:
+            return self._sample(seconds, loop)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, loop) -> Counter:
+        me = threading.get_ident()
+        thread_names = {}
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in thread_names:
+                    thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                frames = []
+                while frame is not None:
+                    frames.append(frame)
+                    frame = frame.f_back
+                frames.reverse()
+                stacks[f'{thread_names.get(ident, ident)};{self._collapse(frames)}'] += 1
+            if loop is not None:
+                for task in asyncio.all_tasks(loop):
+                    frames = task.get_stack()
+                    if frames:
+                        stacks[f'task {task.get_name()};{self._collapse(frames)}'] += 1
+            time.sleep(self.interval)
+        return stacks
+
+
+def collapsed(stacks: Counter) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def _authorize(authorization: str = Header(None)):
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not secrets.compare_digest(token.encode(), PIZZA_DEBUG_TOKEN.encode()):
+        raise HTTPException(401, 'debug endpoints need the debug token', headers={'WWW-Authenticate': 'Bearer'})
+
+
+stats = RequestStats()
+profiler = SamplingProfiler()
+router = APIRouter(prefix='/debug', dependencies=[Depends(_authorize)], include_in_schema=False)
+
+
+@router.get('/profile', response_class=PlainTextResponse)
+async def profile(seconds: float = Query(10.0, gt=0, le=120), tasks: bool = False):
+    try:
+        stacks = await asyncio.to_thread(profiler.profile, seconds, asyncio.get_running_loop() if tasks else None)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return collapsed(stacks)
+
+
+@router.get('/stats')
+async def get_stats():
+    return dict(stats.snapshot(), admission={route: limit.stats() for route, limit in admission.limits.items()})
+
+
+def install(app: FastAPI, token: str = None):
+    """Adds the debug routes and the stats middleware when a debug token is configured, else nothing."""
+    global PIZZA_DEBUG_TOKEN
+    PIZZA_DEBUG_TOKEN = token or PIZZA_DEBUG_TOKEN
+    if not PIZZA_DEBUG_TOKEN:
+        return
+    app.include_router(router)
+    app.add_middleware(StatsMiddleware, stats=stats)
@@ -0,0 +1,93 @@
+# latency histogram in the style of HdrHistogram: exact below 2 ** (precision + 1) microseconds, above that
+# buckets as wide as 1 / 2 ** precision of their value, so every percentile is off by less than that much
+# (0.8% with the default precision of 7) however long the tail is. Counts are sparse, a histogram of a
+# run is a few hundred buckets whatever the number of requests, and two runs can be merged or compared.
+# benchmarks.load records the client side with it, /debug/stats the server side.
+
+import math
+from typing import Dict
+
+PRECISION = 7
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    def __init__(self, precision: int = PRECISION):
+        self.precision = precision
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        exponent = value.bit_length() - self.precision - 1
+        if exponent <= 0:
+            return value
+        return (exponent << self.precision) + (value >> exponent)
+
+    def _highest_value(self, index: int) -> int:
+        """Largest value that lands in the bucket, what HdrHistogram reports as well."""
+        exponent = (index >> self.precision) - 1
+        if exponent <= 0:
+            return index
+        return ((index - (exponent << self.precision) + 1) << exponent) - 1
+
+    def record(self, seconds: float):
+        value = max(0, round(seconds * 1e6))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram'):
+        if other.precision != self.precision:
+            raise ValueError('only histograms of the same precision can be merged')
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> float:
+        """In seconds."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highest_value(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self) -> dict:
+        summary = {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1e3 if self.count else 0.0,
+            'min_ms': (self.min or 0) / 1e3,
+            'max_ms': self.max / 1e3,
+        }
+        for percent in PERCENTILES:
+            summary[f'p{percent:g}_ms'] = self.percentile(percent) * 1e3
+        return summary
+
+    def to_dict(self) -> dict:
+        return dict(self.summary(), precision=self.precision, unit='us', total=self.total,
+                    counts={str(index): count for index, count in sorted(self.counts.items())})
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LatencyHistogram':
+        histogram = cls(data['precision'])
+        histogram.counts = {int(index): count for index, count in data['counts'].items()}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = round(data['min_ms'] * 1e3) if data['count'] else None
+        histogram.max = round(data['max_ms'] * 1e3)
+        return histogram
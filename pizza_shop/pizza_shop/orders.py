@@ -0,0 +1,168 @@
+# order lookups for the frontend, which polls them: answered from the order cache whenever possible
+#
+# GET /orders/{id}         one order
+# GET /orders?ids=1,2,3    up to MAX_BATCH_IDS orders, as {"orders": {"1": {...}}, "missing": [3]}
+# GET /orders/stream       server-sent events, an "order" event for every order placed from now on
+#
+# GET / only stores the orders it places, and answers with the id to look them up by, with PIZZA_PERSIST_ORDERS
+# set. The lookups send an ETag and answer a matching If-None-Match with 304 and no body. The stream replaces
+# polling: every new order is framed once and the same bytes go to all watchers of this worker. A watcher that
+# falls PIZZA_BROADCAST_BUFFER orders behind loses the oldest ones and gets a "dropped" event with their number.
+# A watcher only sees the orders placed through its own worker process: with WORKERS above 1, a dashboard
+# that has to see every order needs a shop that runs one worker.
+#
+# The streams end when the server is told to exit, see end_streams_on_exit; browsers reconnect after
+# STREAM_RETRY_MS, to whichever instance is up by then.
+
+import asyncio
+import os
+import signal
+import threading
+from typing import List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+
+from pizza_library.broadcast import BroadcastHub
+from pizza_library.cache import OrderCache, etag_matches, etag_of
+from pizza_library.codec import encode_order
+from pizza_library.store import OrderStore
+
+MAX_BATCH_IDS = int(os.environ.get('PIZZA_ORDERS_MAX_BATCH_IDS', 100))
+# seconds between comments on an idle stream, which keep proxies from closing it
+STREAM_KEEP_ALIVE = float(os.environ.get('PIZZA_ORDERS_STREAM_KEEP_ALIVE', 15.0))
+# milliseconds a client waits before it reconnects to a stream that ended
+STREAM_RETRY_MS = int(os.environ.get('PIZZA_ORDERS_STREAM_RETRY_MS', 1000))
+# keep the orders GET / places in the sqlite order store, which costs every order a write
+PERSIST_ORDERS = os.environ.get('PIZZA_PERSIST_ORDERS', 'false').lower() in ('1', 'true', 'yes')
+
+router = APIRouter()
+cache = OrderCache()
+hub = BroadcastHub()
+_store: OrderStore = None
+
+
+def get_store() -> OrderStore:
+    global _store
+    if _store is None:
+        _store = OrderStore().start()
+    return _store
+
+
+def close_store():
+    global _store
+    store, _store = _store, None
+    if store is not None:
+        store.close()
+
+
+async def save_order(order, payload: bytes) -> Optional[int]:
+    """
+    Streams a new order to the watchers. With PERSIST_ORDERS, stores it first and caches the bytes it was
+    serialized to, and returns the id it is stored under; None without.
+    """
+    if not PERSIST_ORDERS:
+        if hub:
+            hub.publish(b'event: order\ndata: {"order":%s}\n\n' % payload)
+        return None
+    order_id = await get_store().insert_order(order)
+    cache.put(order_id, payload)
+    if hub:
+        hub.publish(b'id: %d\nevent: order\ndata: {"order_id":%d,"order":%s}\n\n' % (order_id, order_id, payload))
+    return order_id
+
+
+def _respond(body: bytes, etag: str, if_none_match: str) -> Response:
+    # clients may keep the response but have to revalidate it, which is what the ETag makes cheap
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+async def _events():
+    # subscribed once the response streams: a generator that never started would not unsubscribe
+    subscription = hub.subscribe()
+    try:
+        # starts the response, so the client knows it is subscribed before the first order
+        yield b'retry: %d\n: subscribed\n\n' % STREAM_RETRY_MS
+        while (received := await subscription.get(STREAM_KEEP_ALIVE)) is not None:
+            frames, dropped = received
+            if dropped:
+                frames.insert(0, b'event: dropped\ndata: %d\n\n' % dropped)
+            # everything that is buffered in one write
+            yield b''.join(frames) if frames else b': keep-alive\n\n'
+    finally:
+        subscription.close()
+
+
+def end_streams_on_exit():
+    """
+    Ends the order streams as soon as the server is told to exit. The server waits for open responses before
+    it shuts the app down, and streams would not end before its graceful timeout ran out. To be called from
+    the lifespan startup, after the server installed its signal handlers, which are chained to.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # only the main thread can set signal handlers, the test client runs the app in another one
+        return
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(signum)
+        if not callable(previous):
+            continue
+
+        def handle_exit(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(hub.close)
+            previous(signum, frame)
+        signal.signal(signum, handle_exit)
+
+
+# before /orders/{order_id}, which would take "stream" for an id
+@router.get('/orders/stream')
+async def stream_orders():
+    if hub.closed:
+        raise HTTPException(503, 'shutting down', headers={'Retry-After': '1'})
+    if hub.full():
+        raise HTTPException(503, f'at most {hub.max_subscribers} watchers', headers={'Retry-After': '10'})
+    return StreamingResponse(_events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get('/orders/{order_id}')
+async def get_order(order_id: int, if_none_match: str = Header(None)):
+    entry = cache.get(order_id)
+    if entry is None:
+        order = await get_store().get_order(order_id)
+        if order is None:
+            raise HTTPException(404, f'order {order_id} not found')
+        entry = cache.put(order_id, encode_order(order))
+    return _respond(entry.body, entry.etag, if_none_match)
+
+
+def _parse_ids(ids: List[str]) -> List[int]:
+    try:
+        order_ids = list(dict.fromkeys(int(part) for value in ids for part in value.split(',') if part.strip()))
+    except ValueError:
+        raise HTTPException(400, 'ids must be integers, comma separated or repeated')
+    if not order_ids:
+        raise HTTPException(400, 'ids is empty')
+    if len(order_ids) > MAX_BATCH_IDS:
+        raise HTTPException(400, f'at most {MAX_BATCH_IDS} ids per request')
+    return order_ids
+
+
+@router.get('/orders')
+async def get_orders(ids: List[str] = Query(...), if_none_match: str = Header(None)):
+    order_ids = _parse_ids(ids)
+    entries = cache.get_many(order_ids)
+    missing = [order_id for order_id in order_ids if order_id not in entries]
+    if missing:
+        # one read for all misses
+        for order_id, order in (await get_store().get_orders(missing)).items():
+            entries[order_id] = cache.put(order_id, encode_order(order))
+    found = [order_id for order_id in order_ids if order_id in entries]
+    body = b'{"orders":{%s},"missing":[%s]}' % (
+        b','.join([b'"%d":%s' % (order_id, entries[order_id].body) for order_id in found]),
+        b','.join([b'%d' % order_id for order_id in order_ids if order_id not in entries]),
+    )
+    return _respond(body, etag_of(body), if_none_match)
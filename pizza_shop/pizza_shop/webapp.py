@@ -1,22 +1,44 @@
+import asyncio
 import logging
 import random
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from opentelemetry import metrics
 from opentelemetry import trace
 from opentelemetry.context import get_current as get_current_context
 from opentelemetry.sdk.trace import _Span
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
+from pizza_library.codec import encode_order
 from pizza_library.functions import create_random_order, preheat_oven, prepare_pizza, flatten_dough, bake_pizza, \
-    make_the_pizza, make_the_pizza_sync
-from pizza_library.messaging import send_pizza_order
-from pizza_library.storage import upload_pizza_order
-from pizza_shop import SERVICE_NAME
+    make_the_pizza, make_the_pizza_sync, shutdown_kitchen, close_oven
+from pizza_library.messaging import send_pizza_order_async, close_message_backend
+from pizza_library.storage import ArchiveBufferFull, archive_pizza_order_async, close_order_archiver
+from pizza_library.database import initialize_database
+from pizza_library.idempotency import EXECUTED, IdempotencyStore
+from pizza_shop import SERVICE_NAME, admission, debug, orders
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialize_database()
+    orders.end_streams_on_exit()
+    yield
+    orders.hub.close()
+    # write out the orders still buffered for archiving and the messages still queued for sending
+    close_order_archiver()
+    orders.close_store()
+    close_message_backend()
+    close_oven()
+    shutdown_kitchen()
+
+
+app = FastAPI(lifespan=lifespan)
+# concurrency limits for the kitchen routes, inside CORS so that a 503 reaches the browser as one
+admission.install(app)
 
 # Configure CORS
 origins = ["*"]  # Update this with the allowed origins
@@ -27,6 +49,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.include_router(orders.router)
+# /debug/profile and /debug/stats, only with PIZZA_DEBUG_TOKEN set
+debug.install(app)
 
 
 @app.exception_handler(StarletteHTTPException)
@@ -58,22 +83,44 @@ def http_exception_handler(request: Request, exc):
 meter = metrics.get_meter_provider().get_meter(__name__)
 pizza_counter = meter.create_counter("pizza_order_counter", "number of pizzas ordered", "pizzas")
 tracer = trace.get_tracer(__name__)
+logger = logging.getLogger(SERVICE_NAME)
+# answers to GET / by Idempotency-Key, so a retried order is placed once
+placed_orders = IdempotencyStore()
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
 
 
-@app.get("/")
-def root():
+async def place_order() -> bytes:
     with tracer.start_as_current_span("shop"):
-        logger = logging.getLogger(SERVICE_NAME)
-        logger.setLevel(logging.INFO)
         order = create_random_order()
         pizza_counter.add(len(order.pizzas))
-        logger.info(f"Created order: {order}")
-        send_pizza_order(order)
-        upload_pizza_order(order)
-        logger.info(f"Sent order: {order}")
-        return {
-            "order": order
-        }
+        logger.info("Created order: %s", order)
+        # serialized once, for the message, the archive, the order cache and the response
+        payload = encode_order(order)
+        # the archive is write-behind and only waits while storage is behind; first, so that an order it has no
+        # room for is turned away before anything else happened to it
+        try:
+            await archive_pizza_order_async(order, payload=payload)
+        except ArchiveBufferFull as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": "10"})
+        # the message waits until the broker accepted it and a stored order until it is committed, both at once
+        order_id, _ = await asyncio.gather(orders.save_order(order, payload), send_pizza_order_async(order, payload))
+        logger.info("Sent order: %s", order.id)
+        if order_id is None:
+            return b'{"order":%s}' % payload
+        return b'{"order_id":%d,"order":%s}' % (order_id, payload)
+
+
+@app.get("/")
+async def root(idempotency_key: str = Header(None)):
+    if idempotency_key is None:
+        return Response(await place_order(), media_type="application/json")
+    if not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(400, f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    # a retry waits for the order still being placed, or gets the one already placed: no new order, message
+    # or upload
+    body, answer = await placed_orders.run(idempotency_key, place_order)
+    headers = None if answer == EXECUTED else {"Idempotent-Replayed": "true"}
+    return Response(body, media_type="application/json", headers=headers)
 
 # hey -n 10 -c 5 http://127.0.0.1:8000/make_pizza
 @app.get("/make_pizza")
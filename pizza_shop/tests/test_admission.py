@@ -0,0 +1,116 @@
+import asyncio
+
+from pizza_shop import admission
+from pizza_shop.admission import ADMITTED, EXPIRED, QUEUED, REJECTED, AdaptiveLimit, AdmissionMiddleware
+
+
+def _limit(**options) -> AdaptiveLimit:
+    settings = dict(limit=2, min_limit=1, max_limit=4, queue_size=1, queue_timeout=0.05, target_latency=1.0)
+    settings.update(options)
+    return AdaptiveLimit('/make_pizza', **settings)
+
+
+def test_requests_over_the_limit_queue_then_get_rejected():
+    async def main():
+        limit = _limit()
+        assert await limit.acquire()
+        assert await limit.acquire()
+        queued = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        assert not await limit.acquire()
+        limit.release()
+        assert await queued
+        assert limit.counts == {ADMITTED: 2, QUEUED: 1, REJECTED: 1, EXPIRED: 0}
+        assert limit.in_flight == 2
+    asyncio.run(main())
+
+
+def test_queued_requests_expire():
+    async def main():
+        limit = _limit(limit=1)
+        assert await limit.acquire()
+        assert not await limit.acquire()
+        assert limit.counts[EXPIRED] == 1
+        assert limit.stats()['waiting'] == 0
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_hands_its_slot_on():
+    async def main():
+        limit = _limit(limit=1, queue_size=2, queue_timeout=1.0)
+        assert await limit.acquire()
+        first = asyncio.ensure_future(limit.acquire())
+        second = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        # the slot goes to the first waiter, whose client is gone by the time it would run
+        limit.release()
+        first.cancel()
+        assert await second
+        assert limit.in_flight == 1
+    asyncio.run(main())
+
+
+def test_slow_requests_back_off_once_per_overload():
+    limit = _limit(limit=4)
+    limit.in_flight = 4
+    # four requests admitted together all run slow: one backoff, not four
+    for _ in range(4):
+        limit.in_flight -= 1
+        limit._adapt(started=10.0, now=12.0)
+    assert limit.limit == 4 * admission.BACKOFF
+    # a request admitted after the backoff that is still slow backs off again
+    limit._adapt(started=12.5, now=14.0)
+    assert limit.limit == 4 * admission.BACKOFF ** 2
+
+
+def test_limit_grows_only_when_it_was_reached():
+    limit = _limit(limit=2)
+    limit.in_flight = 0
+    limit._adapt(started=1.0, now=1.1)
+    assert limit.limit == 2
+    limit.in_flight = 1
+    limit._adapt(started=1.0, now=1.1)
+    assert limit.limit == 2.5
+
+
+def test_limit_stays_within_bounds():
+    limit = _limit(limit=1, max_limit=1)
+    limit._adapt(started=0.0, now=5.0)
+    assert limit.limit == 1
+    limit._adapt(started=6.0, now=6.1)
+    assert limit.limit == 1
+
+
+def test_target_follows_the_fastest_latency():
+    limit = _limit(target_latency=None, tolerance=2.0)
+    limit._adapt(started=0.0, now=0.2)
+    limit._adapt(started=0.0, now=0.5)
+    assert limit.target() == 0.4
+
+
+def test_middleware_sheds_with_retry_after():
+    async def main():
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+
+        limit = _limit(limit=1, queue_size=0)
+        middleware = AdmissionMiddleware(app, {'/make_pizza': limit})
+        scope = {'type': 'http', 'path': '/make_pizza'}
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        running = asyncio.ensure_future(middleware(scope, None, send))
+        await asyncio.sleep(0)
+        await middleware(scope, None, send)
+        assert sent[0]['status'] == 503
+        assert (b'retry-after', b'1') in sent[0]['headers']
+        # other paths are not guarded
+        release.set()
+        await middleware({'type': 'http', 'path': '/orders/1'}, None, send)
+        await running
+        assert limit.in_flight == 0
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from pizza_shop import debug
+
+TOKEN = 'debug-secret'
+AUTHORIZATION = {'Authorization': f'Bearer {TOKEN}'}
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/pizza/{pizza_id}')
+    async def pizza(pizza_id: int):
+        return {'pizza_id': pizza_id}
+
+    return app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(debug, 'PIZZA_DEBUG_TOKEN', None)
+    monkeypatch.setattr(debug, 'stats', debug.RequestStats())
+    app = _app()
+    debug.install(app, TOKEN)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_nothing_is_installed_without_a_token(monkeypatch):
+    monkeypatch.setattr(debug, 'PIZZA_DEBUG_TOKEN', None)
+    app = _app()
+    debug.install(app)
+    assert not [route for route in app.routes if route.path.startswith('/debug')]
+    assert not app.user_middleware
+    with TestClient(app) as client:
+        assert client.get('/debug/stats', headers=AUTHORIZATION).status_code == 404
+
+
+@pytest.mark.parametrize('headers', [{}, {'Authorization': 'Bearer wrong'}, {'Authorization': TOKEN},
+                                     {'Authorization': f'Basic {TOKEN}'}])
+def test_debug_routes_need_the_token(client, headers):
+    for path in ('/debug/stats', '/debug/profile?seconds=0.01'):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 401
+        assert response.headers['www-authenticate'] == 'Bearer'
+
+
+def test_stats_per_route_template(client):
+    for pizza_id in (1, 2, 3):
+        assert client.get(f'/pizza/{pizza_id}').status_code == 200
+    client.get('/nowhere')
+    stats = client.get('/debug/stats', headers=AUTHORIZATION).json()
+    assert set(stats) == {'in_flight', 'peak_in_flight', 'routes', 'event_loop_lag', 'admission'}
+    assert stats['in_flight'] == 1 and stats['peak_in_flight'] >= 1
+    assert {route: summary['count'] for route, summary in stats['routes'].items()} == \
+           {'GET /pizza/{pizza_id}': 3, 'GET <unmatched>': 1}
+    summary = stats['routes']['GET /pizza/{pizza_id}']
+    assert {'mean_ms', 'min_ms', 'max_ms', 'p50_ms', 'p99_ms'} <= set(summary)
+    assert summary['min_ms'] <= summary['p50_ms'] <= summary['max_ms']
+    assert 'last_ms' in stats['event_loop_lag']
+
+
+def test_profile_returns_collapsed_stacks(client):
+    response = client.get('/debug/profile?seconds=0.05', headers=AUTHORIZATION)
+    assert response.status_code == 200
+    stack, _, count = response.text.splitlines()[0].rpartition(' ')
+    assert ';' in stack and int(count) > 0
+
+
+def test_one_profile_at_a_time(client):
+    # a profile request of someone else is holding the profiler
+    with debug.profiler._lock:
+        response = client.get('/debug/profile?seconds=0.01', headers=AUTHORIZATION)
+    assert response.status_code == 409
+    assert client.get('/debug/profile?seconds=0.01', headers=AUTHORIZATION).status_code == 200
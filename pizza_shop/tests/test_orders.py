@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from pizza_library.broadcast import BroadcastHub
+from pizza_library.cache import OrderCache
+from pizza_library.codec import encode_order
+from pizza_library.database import ConnectionManager, initialize_database, insert_orders
+from pizza_library.functions import create_random_orders
+from pizza_library.store import OrderStore
+from pizza_shop import orders
+
+
+@pytest.fixture
+def connection_manager(tmp_path, monkeypatch):
+    manager = ConnectionManager(str(tmp_path / 'orders.db'))
+    initialize_database(manager)
+    monkeypatch.setattr(orders, '_store', OrderStore(manager))
+    monkeypatch.setattr(orders, 'cache', OrderCache())
+    monkeypatch.setattr(orders, 'hub', BroadcastHub())
+    yield manager
+    orders.close_store()
+    manager.close()
+
+
+@pytest.fixture
+def placed(connection_manager) -> dict:
+    placed = list(create_random_orders(3, seed=4))
+    return dict(zip(insert_orders(placed, connection_manager), placed))
+
+
+@pytest.fixture
+def client(connection_manager):
+    app = FastAPI()
+    app.include_router(orders.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_order_by_id(client, placed):
+    for order_id, order in placed.items():
+        response = client.get(f'/orders/{order_id}')
+        assert response.status_code == 200
+        assert response.content == encode_order(order)
+        assert response.headers['cache-control'] == 'no-cache'
+    assert client.get('/orders/99').status_code == 404
+
+
+def test_orders_by_ids(client, placed):
+    first, second = list(placed)[:2]
+    response = client.get(f'/orders?ids={second},99,{first}&ids={first}')
+    assert response.status_code == 200
+    assert response.json() == {
+        'orders': {str(order_id): placed[order_id].model_dump(mode='json') for order_id in (second, first)},
+        'missing': [99],
+    }
+    assert list(response.json()['orders']) == [str(second), str(first)]
+
+
+@pytest.mark.parametrize('ids', ['', 'one', ','.join(str(n) for n in range(orders.MAX_BATCH_IDS + 1))])
+def test_invalid_ids_are_refused(client, ids):
+    assert client.get(f'/orders?ids={ids}').status_code == 400
+
+
+@pytest.mark.parametrize('path', ['/orders/1', '/orders?ids=1,2'])
+def test_unchanged_orders_are_not_sent_again(client, placed, path):
+    etag = client.get(path).headers['etag']
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+    assert client.get(path, headers={'If-None-Match': '"other"'}).status_code == 200
+    assert client.get(path, headers={'If-None-Match': '*'}).status_code == 304
+
+
+def test_placed_orders_are_only_stored_when_persisted(connection_manager, monkeypatch):
+    async def main():
+        watcher = orders.hub.subscribe()
+        first, second = create_random_orders(2, seed=8)
+        assert await orders.save_order(first, encode_order(first)) is None
+        monkeypatch.setattr(orders, 'PERSIST_ORDERS', True)
+        order_id = await orders.save_order(second, encode_order(second))
+        assert orders.cache.get(order_id).body == encode_order(second)
+        assert await orders.get_store().get_order(order_id) == second
+        # the first order was streamed without an id to look it up by
+        frames, _ = await watcher.get(1)
+        assert frames == [b'event: order\ndata: {"order":%s}\n\n' % encode_order(first),
+                          b'id: %d\nevent: order\ndata: {"order_id":%d,"order":%s}\n\n'
+                          % (order_id, order_id, encode_order(second))]
+        assert await orders.get_store().get_orders([1, 2]) == {1: second}
+    asyncio.run(main())